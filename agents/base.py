@@ -1,7 +1,5 @@
 from abc import ABC, abstractmethod
 
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from langchain_openai import AzureChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langgraph.graph import START, END, StateGraph
 from langgraph.prebuilt import ToolNode
@@ -10,9 +8,8 @@ from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from agents.rag.prompts.evaluation import EVALUATOR_SYSTEM_PROMPT
 from agents.rag.schemas.evaluation import ScoreSchema
-from agents.rag.utils import load_json_examples
-
-from config.config import ENV_VARIABLES
+from agents.rag.utils import load_json_examples, content_hash
+from agents.llm import build_chat_model, llm_config_key
 
 
 
@@ -52,26 +49,13 @@ class EvaluationAgent():
     def __init__(self, llm_provider: str):
         self.llm_provider = llm_provider
 
-        credential = DefaultAzureCredential()
-        token_provider = get_bearer_token_provider(credential, "https://cognitiveservices.azure.com/.default")
+        self.llm = build_chat_model(self.llm_provider)
 
-        if self.llm_provider == "azure":
-            self.llm = AzureChatOpenAI(
-                deployment_name=ENV_VARIABLES["AZURE_OPENAI_CHATGPT4_DEPLOYMENT"],
-                azure_endpoint=f"https://{ENV_VARIABLES['AZURE_OPENAI_SERVICE']}.openai.azure.com/",
-                api_version="2025-04-01-preview",
-            azure_ad_token_provider=token_provider,
-            temperature=0.7,
-            seed=42,
-        )
-        else:
-            raise ValueError(f"LLM provider {self.llm_provider} not supported")
-        
         self.evaluation_examples = load_json_examples("evaluation_examples.json")
         self.evaluation_prompt = EVALUATOR_SYSTEM_PROMPT
+        self.eval_runnable = self._build_eval_runnable()
 
-    async def run(self, record_dataset: dict) -> dict:
-        
+    def _build_eval_runnable(self):
         prompt = ChatPromptTemplate.from_messages(
     [
         (
@@ -82,8 +66,19 @@ class EvaluationAgent():
         ]
         ) 
         
-        eval_runnable = prompt | self.llm.with_structured_output(schema=ScoreSchema, method="function_calling", include_raw=False)
-        eval_response = await eval_runnable.ainvoke({
+        return prompt | self.llm.with_structured_output(schema=ScoreSchema, method="function_calling", include_raw=False)
+
+    def config_fingerprint(self) -> dict:
+        return {"llm": llm_config_key(self.llm_provider, self.llm)}
+
+    def prompt_versions(self) -> dict:
+        return {
+            "evaluation": content_hash(self.evaluation_prompt),
+            "evaluation_examples": content_hash(self.evaluation_examples),
+        }
+
+    async def run(self, record_dataset: dict) -> dict:
+        eval_response = await self.eval_runnable.ainvoke({
             "examples": self.evaluation_examples,
             "ground_truth": record_dataset["answer"],
             "candidate": record_dataset["result"]["answer"]
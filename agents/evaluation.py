@@ -3,11 +3,13 @@ from pathlib import Path
 import json
 from datetime import datetime
 import random
-import asyncio
 import time
 
 from agents.rag.base import BaseAgent
 from agents.base import EvaluationAgent
+from agents.scheduler import AdaptiveScheduler
+from config.config import ENV_VARIABLES
+from agents.rag.utils import content_hash
 from schemas.conversation import MessageItem
 
 METADATA = {
@@ -38,14 +40,126 @@ class DataLoader:
         return [MessageItem(role="user", content=session["question"])]
 
 
+class CheckpointStore:
+    """
+    Append-only JSONL file of results, one record per line with a "key" field.
+    Each record is flushed when it is written, so an interrupted run keeps every
+    completed item; a partially written last line is ignored on load.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.records: Dict[str, dict] = {}
+        needs_newline = False
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    needs_newline = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.records[record["key"]] = record
+        self._file = open(self.path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def get(self, key: str) -> dict | None:
+        return self.records.get(key)
+
+    def append(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.records[record["key"]] = record
+
+    def close(self) -> None:
+        self._file.close()
+
+
 class Evaluator:
-    def __init__(self, dataloader, model_pipeline: BaseAgent):
+    def __init__(
+        self,
+        dataloader,
+        model_pipeline: BaseAgent,
+        scheduler_args: dict | None = None,
+        checkpoint_dir: Path | None = None,
+    ):
+        """
+        Args:
+            dataloader (DataLoader): Loads the golden dataset.
+            model_pipeline (BaseAgent): Agent under evaluation.
+            scheduler_args (dict): Arguments of the AdaptiveScheduler (rpm, tpm, concurrency...).
+                Defaults to the EVAL_* environment variables.
+            checkpoint_dir (Path): Directory of the predictions.jsonl / judgments.jsonl checkpoints.
+                Predictions are reused while the question, agent config and agent prompts are
+                unchanged; judgments while the answers, judge config and judge prompt are unchanged.
+        """
 
         self.dataloader = dataloader
         self.assistant = model_pipeline
-        self.evaluator = EvaluationAgent(llm_provider="azure")
-
-    async def run_prediction(self, size_sample: int = 100) -> None:
+        self.evaluator = EvaluationAgent(llm_provider=getattr(model_pipeline, "llm_provider", "azure"))
+        self.scheduler_args = scheduler_args or {}
+        # LLM calls and tokens of one agent run, used to take quota before each prediction
+        self.prediction_cost = (
+            float(ENV_VARIABLES.get("EVAL_PREDICTION_REQUESTS", 3)),
+            float(ENV_VARIABLES.get("EVAL_PREDICTION_TOKENS", 8000)),
+        )
+
+        self.predictions_store = CheckpointStore(checkpoint_dir / "predictions.jsonl") if checkpoint_dir else None
+        self.judgments_store = CheckpointStore(checkpoint_dir / "judgments.jsonl") if checkpoint_dir else None
+        self.agent_version = self._version(self.assistant)
+        self.judge_version = self._version(self.evaluator)
+
+    @staticmethod
+    def _version(agent) -> dict:
+        fingerprint = agent.config_fingerprint() if hasattr(agent, "config_fingerprint") else {}
+        prompts = agent.prompt_versions() if hasattr(agent, "prompt_versions") else {}
+        return {"config": content_hash(fingerprint), "prompts": prompts}
+
+    def _prediction_key(self, session: dict) -> str:
+        return content_hash({"id": session.get("id"), "question": session["question"], "agent": self.agent_version})
+
+    def _judgment_key(self, session: dict) -> str:
+        # Independent of the agent: an unchanged answer keeps its judgment
+        return content_hash({
+            "question": session["question"],
+            "ground_truth": session["answer"],
+            "candidate": session["result"]["answer"],
+            "judge": self.judge_version,
+        })
+
+    def close(self) -> None:
+        for store in (self.predictions_store, self.judgments_store):
+            if store is not None:
+                store.close()
+
+    def _report(self, stage: str, scheduler: AdaptiveScheduler, elapsed: float) -> None:
+        stats = dict(scheduler.stats)
+        print(
+            f"{stage}: {stats.get('succeeded', 0)} ok, {stats.get('failed', 0)} failed, "
+            f"{stats.get('retries', 0)} retries ({stats.get('rate_limited', 0)} rate limited) "
+            f"in {elapsed:.1f}s, max concurrency {scheduler.max_limit_reached:.1f}"
+        )
+
+    @staticmethod
+    def _drop_failed(sampled_data: list, pending: list, results: list) -> list:
+        failed = set()
+        for session, result in zip(pending, results):
+            if isinstance(result, Exception):
+                print(f"Error evaluating session {session.get('id')}: {result}")
+                failed.add(id(session))
+        return [session for session in sampled_data if id(session) not in failed]
+
+    async def run_prediction(self, size_sample: int = 100, seed: int | None = 42) -> list:
+        """
+        Runs the agent over a sample of the dataset. With checkpoints, completed
+        predictions are reused and new ones are saved as soon as they finish.
+
+        Args:
+            size_sample (int): Number of records to sample.
+            seed (int): Seed of the sample, so a re-run selects the same records.
+        """
         dataset = self.dataloader.load_data()
         if len(dataset) >= size_sample:
             sample_size = size_sample
@@ -53,63 +167,70 @@ class Evaluator:
             sample_size = len(dataset)
             print(f"La lista tiene menos de {size_sample} elementos. Seleccionando todos los {sample_size} elementos.")
 
-        sampled_data = random.sample(dataset, sample_size)
-        # sampled_data = dataset[:10]
-
-        async def evaluate_batch(batch):
-            tasks = [self.assistant.run(session["messages"], METADATA) for session in batch]
-            results = await asyncio.gather(*tasks)
-            for session, result in zip(batch, results):
-                session["result"] = {
-                    "answer": result["messages"][-1].content,
-                    "ids_content": result["ids_content"]
-                }
-                session.pop("messages")
-
+        sampled_data = random.Random(seed).sample(dataset, sample_size)
 
-        # # Dividir sampled_data en lotes de 4
-        batches = [sampled_data[i:i + 4] for i in range(0, len(sampled_data), 4)]
-        
-        # Evaluar cada lote de forma secuencial (puedes también hacer esto concurrente si es necesario)
-        for batch in batches:
-            #time.sleep(1)  # for limit quota
-            try:
-                await evaluate_batch(batch)
-            except Exception as e:
-                print(f"Error evaluating batch: {e}")
-                print("Assuming quota limit reached. Sleeping for 1 minute.")
-                time.sleep(60)
-                await evaluate_batch(batch)
-
-        # for session in sampled_data:
-        #     try:
-        #         result = await self.assistant.run(session["messages"], METADATA)
-        #        session["result"] = {
-        #            "answer": result["messages"][-1].content,
-        #            "ids_content": result["ids_content"]}
-        #        session.pop("messages")
-        #    except Exception as e:
-        #        print(f"Error evaluating session: {e}")
-        #        print("parsing error")
-        #        continue
-
-        return sampled_data
-    
-    async def evaluate_prediction(self, sampled_data: list) -> None:
-
-        async def evaluate_batch(batch):
-            tasks = [self.evaluator.run(session) for session in batch]
-            results = await asyncio.gather(*tasks)
-            for session, result in zip(batch, results):
-                session["evaluation"] = {
-                    "analysis": result.analysis,
-                    "score": result.evaluation,
-                }
-
-        # # Dividir sampled_data en lotes de 15
-        batches = [sampled_data[i:i + 15] for i in range(0, len(sampled_data), 15)]
-
-        for batch in batches:
-            await evaluate_batch(batch)
-
-        return sampled_data
+        pending = []
+        for session in sampled_data:
+            session["prediction_key"] = self._prediction_key(session)
+            checkpoint = self.predictions_store.get(session["prediction_key"]) if self.predictions_store else None
+            if checkpoint is not None:
+                session["result"] = checkpoint["result"]
+                session.pop("messages")
+            else:
+                pending.append(session)
+        print(f"Predictions: {len(sampled_data) - len(pending)} reused from checkpoints, {len(pending)} to run")
+
+        async def predict(session):
+            result = await self.assistant.run(session["messages"], METADATA)
+            session["result"] = {
+                "answer": result["messages"][-1].content,
+                "ids_content": result["ids_content"]
+            }
+            session.pop("messages")
+            if self.predictions_store is not None:
+                self.predictions_store.append({"key": session["prediction_key"], "id": session.get("id"), "result": session["result"]})
+            return session
+
+        # Rate-limit aware: each prediction is retried on its own, without blocking the event loop
+        scheduler = AdaptiveScheduler(**self.scheduler_args)
+        start = time.perf_counter()
+        results = await scheduler.run(pending, predict, cost=lambda session: self.prediction_cost)
+        self._report("Predictions", scheduler, time.perf_counter() - start)
+
+        return self._drop_failed(sampled_data, pending, results)
+
+    def _evaluation_cost(self, session: dict) -> tuple:
+        text = json.dumps(self.evaluator.evaluation_examples, ensure_ascii=False) + session["answer"] + session["result"]["answer"]
+        # One structured-output call; prompt chars/4 plus the judgment
+        return 1, len(text) // 4 + 500
+
+    async def evaluate_prediction(self, sampled_data: list) -> list:
+        """
+        Judges the predictions. With checkpoints, judgments of unchanged answers are reused.
+        """
+        pending = []
+        for session in sampled_data:
+            session["judgment_key"] = self._judgment_key(session)
+            checkpoint = self.judgments_store.get(session["judgment_key"]) if self.judgments_store else None
+            if checkpoint is not None:
+                session["evaluation"] = checkpoint["evaluation"]
+            else:
+                pending.append(session)
+        print(f"Evaluations: {len(sampled_data) - len(pending)} reused from checkpoints, {len(pending)} to run")
+
+        async def evaluate(session):
+            result = await self.evaluator.run(session)
+            session["evaluation"] = {
+                "analysis": result.analysis,
+                "score": result.evaluation,
+            }
+            if self.judgments_store is not None:
+                self.judgments_store.append({"key": session["judgment_key"], "id": session.get("id"), "evaluation": session["evaluation"]})
+            return session
+
+        scheduler = AdaptiveScheduler(**self.scheduler_args)
+        start = time.perf_counter()
+        results = await scheduler.run(pending, evaluate, cost=self._evaluation_cost)
+        self._report("Evaluations", scheduler, time.perf_counter() - start)
+
+        return self._drop_failed(sampled_data, pending, results)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import Field
+
+# Approximation of the tokenizer, only used for usage_metadata and streaming pace
+CHARS_PER_TOKEN = 4
+
+
+def _text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+
+
+def _fill_schema(parameters: dict, text: str) -> dict:
+    """
+    Builds arguments valid for a JSON schema: enums take their first value,
+    strings take `text`, numbers 0 and booleans False.
+    """
+    args = {}
+    for name, spec in parameters.get("properties", {}).items():
+        if name not in parameters.get("required", []):
+            continue
+        if "enum" in spec:
+            args[name] = spec["enum"][0]
+        elif spec.get("type") == "string":
+            args[name] = text
+        elif spec.get("type") in ("integer", "number"):
+            args[name] = spec.get("minimum", 0)
+        elif spec.get("type") == "boolean":
+            args[name] = False
+        elif spec.get("type") == "array":
+            args[name] = []
+        else:
+            args[name] = {}
+    return args
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic in-process chat model used when RAG_BACKEND=fake.
+
+    Replies come from `script` while it has entries and then from a default policy:
+    - structured output (tool_choice forced): arguments filled from the schema,
+    - tools bound and no tool result yet in the current turn: call the first tool
+      with the last user message as query,
+    - otherwise: a text answer built from the last tool result or user message.
+    `latency` is waited before the first token and `tokens_per_second` paces the rest,
+    so the graph can be profiled without network.
+    """
+
+    script: List[Any] = Field(default_factory=list)
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    deployment_name: str = "fake-chat"
+    temperature: float = 0.0
+    seed: int = 42
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[str] = None, **kwargs: Any):
+        formatted_tools = [convert_to_openai_tool(tool) for tool in tools]
+        if tool_choice is not None:
+            kwargs["tool_choice"] = tool_choice
+        return self.bind(tools=formatted_tools, **kwargs)
+
+    def _default_reply(self, messages: List[BaseMessage], tools: List[dict], tool_choice: Any) -> AIMessage:
+        turn_start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+        question = _text(messages[turn_start]) if messages else ""
+        tool_results = [m for m in messages[turn_start:] if isinstance(m, ToolMessage)]
+
+        if tools and (tool_choice is not None or not tool_results):
+            function = tools[0]["function"]
+            return AIMessage(
+                content="",
+                tool_calls=[{
+                    "name": function["name"],
+                    "args": _fill_schema(function.get("parameters", {}), question),
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "tool_call",
+                }],
+            )
+
+        if tool_results:
+            passage = re.sub(r"\s+", " ", _text(tool_results[-1]))[:400]
+            return AIMessage(content=f"Según la documentación encontrada: {passage}")
+        return AIMessage(content=f"Solo puedo responder preguntas sobre garantías y manuales de producto. {question}")
+
+    def _reply(self, messages: List[BaseMessage], **kwargs: Any) -> AIMessage:
+        if self.script:
+            reply = self.script.pop(0)
+            message = reply if isinstance(reply, AIMessage) else AIMessage(content=str(reply))
+        else:
+            message = self._default_reply(messages, kwargs.get("tools") or [], kwargs.get("tool_choice"))
+
+        input_tokens = sum(len(_text(m)) for m in messages) // CHARS_PER_TOKEN + 1
+        output_chars = len(_text(message)) + sum(len(json.dumps(tc["args"])) for tc in message.tool_calls)
+        output_tokens = output_chars // CHARS_PER_TOKEN + 1
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        message.response_metadata = {"model_name": self.deployment_name, "finish_reason": "tool_calls" if message.tool_calls else "stop"}
+        return message
+
+    def _generation_time(self, message: AIMessage) -> float:
+        if not self.tokens_per_second:
+            return self.latency
+        return self.latency + message.usage_metadata["output_tokens"] / self.tokens_per_second
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._reply(messages, **kwargs)
+        time.sleep(self._generation_time(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._reply(messages, **kwargs)
+        await asyncio.sleep(self._generation_time(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        if message.tool_calls:
+            yield AIMessageChunk(
+                content=message.content,
+                tool_call_chunks=[
+                    {"name": tc["name"], "args": json.dumps(tc["args"], ensure_ascii=False), "id": tc["id"], "index": i}
+                    for i, tc in enumerate(message.tool_calls)
+                ],
+            )
+        else:
+            for piece in re.findall(r"\S+\s*", message.content):
+                yield AIMessageChunk(content=piece)
+        yield AIMessageChunk(
+            content="", usage_metadata=message.usage_metadata, response_metadata=message.response_metadata
+        )
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._reply(messages, **kwargs)
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(message):
+            if self.tokens_per_second and chunk.content:
+                await asyncio.sleep(max(len(chunk.content) // CHARS_PER_TOKEN, 1) / self.tokens_per_second)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"deployment_name": self.deployment_name, "latency": self.latency, "tokens_per_second": self.tokens_per_second}
@@ -0,0 +1,55 @@
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from langchain_core.language_models import BaseChatModel
+from langchain_openai import AzureChatOpenAI
+
+from config.config import ENV_VARIABLES
+
+
+def llm_config_key(llm_provider: str, llm: BaseChatModel) -> tuple:
+    """
+    Returns a hashable description of the LLM configuration of an agent
+    (part of the evaluation config fingerprints).
+    """
+    return (
+        llm_provider,
+        type(llm).__name__,
+        getattr(llm, "deployment_name", None),
+        getattr(llm, "azure_endpoint", None),
+        getattr(llm, "openai_api_version", None),
+        getattr(llm, "temperature", None),
+        getattr(llm, "seed", None),
+    )
+
+
+def build_chat_model(llm_provider: str) -> BaseChatModel:
+    """
+    Builds the chat model of an agent.
+
+    Args:
+        llm_provider (str): "azure" for Azure OpenAI, "fake" for the in-process FakeChatModel
+            (latency and pace from FAKE_LLM_LATENCY and FAKE_LLM_TOKENS_PER_SECOND).
+
+    Returns:
+        BaseChatModel: The chat model.
+    """
+    if llm_provider == "azure":
+        credential = DefaultAzureCredential()
+        token_provider = get_bearer_token_provider(credential, "https://cognitiveservices.azure.com/.default")
+        return AzureChatOpenAI(
+            deployment_name=ENV_VARIABLES["AZURE_OPENAI_CHATGPT4_DEPLOYMENT"],
+            azure_endpoint=f"https://{ENV_VARIABLES['AZURE_OPENAI_SERVICE']}.openai.azure.com/",
+            api_version="2025-04-01-preview",
+            azure_ad_token_provider=token_provider,  # Aquí usamos AAD en vez de api_key
+            temperature=0.7,
+            seed=42,
+            # Token usage also when streaming (counted per node in /metrics)
+            stream_usage=True,
+        )
+    if llm_provider == "fake":
+        from agents.fake_llm import FakeChatModel
+
+        return FakeChatModel(
+            latency=float(ENV_VARIABLES.get("FAKE_LLM_LATENCY", 0)),
+            tokens_per_second=float(ENV_VARIABLES.get("FAKE_LLM_TOKENS_PER_SECOND", 0)),
+        )
+    raise ValueError(f"LLM provider {llm_provider} not supported")
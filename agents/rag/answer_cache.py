@@ -0,0 +1,116 @@
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from config.config import ENV_VARIABLES
+
+
+class SemanticAnswerCache:
+    """
+    Final answers of single-turn questions, looked up by embedding similarity.
+
+    Question vectors are kept L2-normalized in one float32 matrix, so a lookup is a
+    single matrix-vector product over the live entries. A hit needs a cosine
+    similarity of at least `threshold`. When full, expired entries and then
+    the least recently used one are replaced. Entries belong to an index generation:
+    a lookup with a new generation (after re-indexing) drops every entry.
+    """
+
+    def __init__(self, maxsize: int | None = None, threshold: float | None = None, ttl: float | None = None):
+        """
+        Args:
+            maxsize (int): Maximum number of answers (ANSWER_CACHE_SIZE).
+            threshold (float): Minimum cosine similarity for a hit (ANSWER_CACHE_THRESHOLD).
+            ttl (float): Seconds an answer is served (ANSWER_CACHE_TTL).
+        """
+        self.maxsize = maxsize if maxsize is not None else int(ENV_VARIABLES.get("ANSWER_CACHE_SIZE", 2048))
+        self.threshold = threshold if threshold is not None else float(ENV_VARIABLES.get("ANSWER_CACHE_THRESHOLD", 0.95))
+        self.ttl = ttl if ttl is not None else float(ENV_VARIABLES.get("ANSWER_CACHE_TTL", 86400))
+
+        # Allocated on the first store, when the embedding dimension is known
+        self._vectors: np.ndarray | None = None
+        self._expires = np.zeros(self.maxsize, dtype=np.float64)
+        self._last_used = np.zeros(self.maxsize, dtype=np.int64)
+        self._entries: List[Dict | None] = [None] * self.maxsize
+        self._size = 0
+        self._tick = 0
+        self.generation: str | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_generation(self, generation: str) -> None:
+        if generation != self.generation:
+            self.invalidate()
+            self.generation = generation
+
+    def _similarities(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity to every live entry; -inf for the expired ones."""
+        n = self._size
+        valid = self._expires[:n] > time.time()
+        return np.where(valid, self._vectors[:n] @ query, -np.inf)
+
+    def lookup(self, vector, generation: str) -> Dict | None:
+        """
+        Returns the cached entry (question, answer, ids_content) of the most similar
+        question, or None if none reaches the threshold.
+        """
+        self._check_generation(generation)
+        if self._size == 0 or self._vectors is None:
+            self.misses += 1
+            return None
+        similarities = self._similarities(self._normalize(vector))
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+        self._tick += 1
+        self._last_used[best] = self._tick
+        self.hits += 1
+        return {**self._entries[best], "similarity": float(similarities[best])}
+
+    def store(self, vector, generation: str, question: str, answer: str, ids_content: List[str]) -> None:
+        """Stores the final answer of a question. A near-identical question is replaced."""
+        self._check_generation(generation)
+        if self.maxsize == 0:
+            return
+        query = self._normalize(vector)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.maxsize, query.shape[0]), dtype=np.float32)
+
+        slot = None
+        if self._size:
+            similarities = self._similarities(query)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= 0.999:
+                slot = best
+        if slot is None and self._size < self.maxsize:
+            slot = self._size
+            self._size += 1
+        if slot is None:
+            # Expired entries first, then the least recently used
+            expired = self._expires < time.time()
+            slot = int(np.argmin(np.where(expired, -1, self._last_used)))
+            self.evictions += 1
+
+        self._tick += 1
+        self._vectors[slot] = query
+        self._expires[slot] = time.time() + self.ttl
+        self._last_used[slot] = self._tick
+        self._entries[slot] = {"question": question, "answer": answer, "ids_content": list(ids_content)}
+
+    def invalidate(self) -> None:
+        self._size = 0
+        self._entries = [None] * self.maxsize
+
+    @property
+    def stats(self) -> dict:
+        return {"size": self._size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
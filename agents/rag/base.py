@@ -1,79 +1,190 @@
 
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import Counter
+from contextlib import nullcontext
 from typing import Literal
 
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-
-
-from langchain_openai import AzureChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage, RemoveMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import START, END, StateGraph
 from langgraph.prebuilt import ToolNode
 from langgraph.types import Command
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from agents.base import BaseAgent
+from agents.llm import build_chat_model, llm_config_key
 from config.config import ENV_VARIABLES
 from agents.rag.schemas.graph import AgentState, GuardialSchema
-from agents.rag.prompts.agent import AGENT_SYSTEM_PROMPT_RRR, AGENT_SYSTEM_PROMPT_PIC
+from agents.rag.prompts.agent import AGENT_SYSTEM_PROMPT_RRR, AGENT_SYSTEM_PROMPT_PIC, AGENT_FINAL_ANSWER_PROMPT
 from agents.rag.prompts.guardrails import GUARDRAILS_PROMPT, FRIENDLY_RESPONSE_PROMPT
-from agents.rag.utils import format_tool_for_prompt
-from agents.rag.tools.base import AVAILABLE_TOOLS
+from agents.rag.utils import format_tool_for_prompt, search_result_score, content_hash
+from agents.rag.tools.base import AVAILABLE_TOOLS, TOOLS_BY_NAME
 from agents.rag.utils import load_guardrails_examples
+from agents.rag.guardrails import LocalGuardrailClassifier
+from agents.rag.context import ContextBudgetManager
+from agents.rag.answer_cache import SemanticAnswerCache
+from agents.rag.retriever.pool import get_retriever_pool
+from agents.rag.checkpointer import ConversationRetention, build_checkpointer, close_checkpointer
+from schemas.conversation import MessageItem
 
 from tracing.tracing_config import get_tracer
+from tracing.metrics import AGENT_ITERATIONS, STAGE_LATENCY, TOKEN_USAGE_CALLBACK, observe_stage, timed_stage
+
+# Settings read by the retriever and the tools that change the retrieved passages
+RETRIEVAL_SETTINGS = (
+    "RAG_BACKEND", "RETRIEVER_BACKEND", "AZURE_SEARCH_INDEX", "AZURE_OPENAI_EMBEDDING", "SEARCH_INDEX_GENERATION",
+    "TOOL_PASSAGE_MAX_CHARS", "SEARCH_CONTENT_MAX_CHARS", "MULTI_SEARCH_TOP",
+    "SEARCH_MODE", "SEARCH_SEMANTIC_RERANK", "SEARCH_SEMANTIC_CONFIG",
+    "SEARCH_TOP_K_INITIAL", "SEARCH_TOP_K_MAX", "SEARCH_TOP_K_MARGIN", "SEARCH_RERANKER_CONFIDENT", "SEARCH_FUSION_CONFIDENT",
+    "LOCAL_CORPUS_PATH", "LOCAL_INDEX_DIR", "LOCAL_INDEX_K_NEAREST", "LOCAL_INDEX_BM25_K1", "LOCAL_INDEX_BM25_B",
+)
+
+logger = logging.getLogger(__name__)
 
 class RAGAgent(BaseAgent):
     """
     Agent specialized in user workspace.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        guardrails_threshold: float | None = None,
+        speculative: bool | None = None,
+        context_budget: int | None = None,
+        max_iterations: int | None = None,
+        answer_cache: bool | None = None,
+        checkpointer: BaseCheckpointSaver | str | None = None,
+        **kwargs,
+    ):
+        """
+        Args:
+            guardrails_threshold (float): Confidence needed to take the guardrail decision
+                locally without the LLM. Defaults to GUARDRAILS_LOCAL_THRESHOLD.
+            speculative (bool): Run the first agent_brain step in parallel with the LLM
+                guardrail call. Defaults to RAG_SPECULATIVE_GUARDRAILS.
+            context_budget (int): Token budget of each agent_brain call. Defaults to AGENT_CONTEXT_TOKEN_BUDGET.
+            max_iterations (int): agent_brain calls allowed per user turn. Defaults to AGENT_MAX_ITERATIONS.
+            answer_cache (bool): Serve single-turn questions similar to an already answered one
+                from a semantic answer cache. Defaults to ANSWER_CACHE_ENABLED.
+            checkpointer (BaseCheckpointSaver | str): Store of the conversation state, keyed by
+                conversation_id, or the name of one ("sqlite", "memory", "none").
+                Defaults to CONVERSATION_STORE. Only turns that send just the new
+                `message` use it; turns that send the whole history run stateless.
+        """
         super().__init__(*args, **kwargs)
 
-        credential = DefaultAzureCredential()
-        token_provider = get_bearer_token_provider(credential, "https://cognitiveservices.azure.com/.default")
-
-        if self.llm_provider == "azure":
-            self.llm = AzureChatOpenAI(
-                deployment_name=ENV_VARIABLES["AZURE_OPENAI_CHATGPT4_DEPLOYMENT"],
-                azure_endpoint=f"https://{ENV_VARIABLES['AZURE_OPENAI_SERVICE']}.openai.azure.com/",
-                api_version="2025-04-01-preview",
-            azure_ad_token_provider=token_provider,  # Aquí usamos AAD en vez de api_key
-            temperature=0.7,
-            seed=42,
-        )
-        else:
-            raise ValueError(f"LLM provider {self.llm_provider} not supported")
-        
+        self.llm = build_chat_model(self.llm_provider)
+
         self.guardrails_prompt = GUARDRAILS_PROMPT
         self.friendly_response_prompt = FRIENDLY_RESPONSE_PROMPT
         self.guardrails_examples = load_guardrails_examples()
-
+        self.guardrails_classifier = LocalGuardrailClassifier(
+            self.guardrails_examples, threshold=guardrails_threshold
+        )
+        if speculative is None:
+            speculative = str(ENV_VARIABLES.get("RAG_SPECULATIVE_GUARDRAILS", "false")).lower() in ("1", "true", "yes")
+        self.speculative = speculative
+        # started / committed / discarded / cancelled / wasted_prompt_tokens / wasted_completion_tokens
+        self.speculation_stats = Counter()
+
+        self.context_manager = ContextBudgetManager(max_tokens=context_budget)
+        self.max_iterations = max_iterations or int(ENV_VARIABLES.get("AGENT_MAX_ITERATIONS", 6))
+
+        if answer_cache is None:
+            answer_cache = str(ENV_VARIABLES.get("ANSWER_CACHE_ENABLED", "false")).lower() in ("1", "true", "yes")
+        self.answer_cache = SemanticAnswerCache() if answer_cache else None
+
+        if checkpointer is None or isinstance(checkpointer, str):
+            checkpointer = build_checkpointer(checkpointer)
+        self.checkpointer = checkpointer
+        self.retention = ConversationRetention(checkpointer) if checkpointer is not None else None
+        # Messages kept in a stored conversation; older turns are dropped
+        self.max_stored_messages = int(ENV_VARIABLES.get("CONVERSATION_MAX_MESSAGES", 100))
+        # One turn at a time per conversation when resuming from the store
+        self._conversation_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+        self.build_runnables()
         self.agent_graph = self.create()
+        # Turns that send the whole history neither read nor write the store
+        self.stateless_graph = self.create(stored=False) if checkpointer is not None else self.agent_graph
+
+    def build_runnables(self):
+        """
+        Builds the prompts and runnables of every node once for this agent; the
+        nodes reuse them on every call. The agent itself is built once per worker.
+        """
+        self.guardrails_runnable = self._build_guardrails_runnable()
+        self.friendly_response_runnable = self._build_friendly_response_runnable()
+        self.llm_with_tools, self.agent_sys_msg = self._build_agent_runnable()
+
+    def _build_guardrails_runnable(self):
+        prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            self.guardrails_prompt["system"] # .format(examples=self.guardrails_examples)
+        ),
+        MessagesPlaceholder(variable_name="history"),
+        ("human",  self.guardrails_prompt["human"]),
+    ]
+        ) 
+        return prompt | self.llm.with_structured_output(schema=GuardialSchema, method="function_calling", include_raw=False)
+
+    def _build_friendly_response_runnable(self):
+        prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            self.friendly_response_prompt["system"]
+        ),
+        MessagesPlaceholder(variable_name="history"),
+        ("human",  self.friendly_response_prompt["human"]),
+    ]
+        ) 
+        return prompt | self.llm
+
+    def _build_agent_runnable(self):
+        llm_with_tools = self.llm.bind_tools(AVAILABLE_TOOLS)
+        textual_description_tool = [format_tool_for_prompt(tool_schema) for tool_schema in AVAILABLE_TOOLS]
+        textual_description_tool = "\n\n".join(textual_description_tool)
+
+        sys_msg = SystemMessage(content=AGENT_SYSTEM_PROMPT_PIC.format(textual_description_tool=textual_description_tool))
+        return llm_with_tools, sys_msg
 
     def route_condition(self, state: AgentState):
         """
         Route the agent to the appropriate node based on the state.
         """
-        # If len of messages is greater than 12, stop the agent
-        if len(state["messages"]) > 12:
-            return END
+        # Stop the agent after max_iterations agent_brain calls in the current turn
+        iterations = 0
+        for message in reversed(state["messages"]):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, AIMessage):
+                iterations += 1
         # If the latest message requires a tool, route to tools
         # Otherwise, provide a direct response
         if hasattr(state["messages"][-1], "tool_calls") and len(state["messages"][-1].tool_calls) > 0:
-            return "tools"
+            # Out of iterations: answer without tools instead of leaving the tool calls unanswered
+            return "final_answer" if iterations >= self.max_iterations else "tools"
         else:
             return END
 
-    def create(self):
+    def create(self, stored: bool = True):
         """
-        Creates the user workspace agent.
+        Creates the user workspace agent, with the conversation store unless `stored` is False.
         """
         builder = StateGraph(AgentState)
         builder.add_node("guardrial", self.guardrial_node)
         builder.add_node("friendly_response", self.friendly_response)
         builder.add_node("agent_brain", self.agent_brain)
         builder.add_node("tools", ToolNode(AVAILABLE_TOOLS))
+        builder.add_node("final_answer", self.final_answer)
 
         builder.add_edge(START, "guardrial")
         builder.add_conditional_edges(
@@ -84,9 +195,10 @@ class RAGAgent(BaseAgent):
         builder.add_edge("tools", "agent_brain")
         #builder.add_edge("guardial", "agent_brain")
         builder.add_edge("friendly_response", END)
+        builder.add_edge("final_answer", END)
 
         # Compile the graph
-        agent_graph = builder.compile()
+        agent_graph = builder.compile(checkpointer=self.checkpointer if stored else None)
 
         # Obtener los bytes de la imagen PNG
         #png_bytes = agent_graph.get_graph().draw_mermaid_png()
@@ -96,9 +208,71 @@ class RAGAgent(BaseAgent):
         
         return agent_graph
     
-    async def guardrial_node(self, state: AgentState) -> Command[Literal["agent_brain", "friendly_response"]]:
+    @timed_stage("guardrail_llm")
+    async def _llm_guardrail(self, state: AgentState) -> GuardialSchema:
+        """Classifies the last user message with the structured-output LLM call."""
+        return await self.guardrails_runnable.ainvoke({
+            "examples": self.guardrails_examples,
+            "input_user": state["messages"][-1].content, 
+            "history": state["messages"]})
+
+    async def _speculate(self, state: AgentState, usage: dict) -> dict:
+        """Runs the first agent_brain step while the guardrail verdict is pending.
+
+        The tools requested by that step are also executed so their searches are
+        already in the retriever caches when the tools node runs; their output is
+        not added to the state.
+
+        `usage` gets the tokens of the step as soon as they are known: the prompt is
+        estimated before the LLM call, since a call cancelled mid-flight is still billed
+        for it, and replaced by the reported usage when the call returns.
+        """
+        prompt_tokens = sum(self.context_manager.message_tokens(message) for message in [self.agent_sys_msg] + state["messages"])
+        usage.update(input_tokens=min(prompt_tokens, self.context_manager.max_tokens), output_tokens=0, estimated=True)
+        update = await self.agent_brain(state)
+        reported = getattr(update["messages"][-1], "usage_metadata", None) or {}
+        usage.update(
+            input_tokens=reported.get("input_tokens", usage["input_tokens"]),
+            output_tokens=reported.get("output_tokens", 0),
+            estimated=not reported,
+        )
+        tool_calls = getattr(update["messages"][-1], "tool_calls", None) or []
+        await asyncio.gather(
+            *[
+                TOOLS_BY_NAME[tool_call["name"]].ainvoke(
+                    {**tool_call, "type": "tool_call", "args": {**tool_call["args"], "state": state}}
+                )
+                for tool_call in tool_calls
+                if tool_call["name"] in TOOLS_BY_NAME
+            ],
+            return_exceptions=True,
+        )
+        return update
+
+    async def _discard_speculation(self, task: asyncio.Task, usage: dict) -> None:
+        """Cancels speculative work after a rejection and accounts the wasted tokens,
+        including the estimated prompt of an LLM call cancelled mid-flight."""
+        self.speculation_stats["discarded"] += 1
+        if not task.done():
+            task.cancel()
+            self.speculation_stats["cancelled"] += 1
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self.speculation_stats["wasted_prompt_tokens"] += usage.get("input_tokens", 0)
+        self.speculation_stats["wasted_completion_tokens"] += usage.get("output_tokens", 0)
+        if usage.get("estimated"):
+            self.speculation_stats["estimated_prompt_tokens"] += usage["input_tokens"]
+
+    @timed_stage("guardrail")
+    async def guardrial_node(self, state: AgentState) -> Command[Literal["agent_brain", "friendly_response", "tools", "final_answer", "__end__"]]:
         """Process incoming messages through guardrails to determine if they should be accepted.
         
+        In speculative mode the first agent_brain step starts at the same time as the
+        LLM guardrail call. It is committed to the state if the query is accepted and
+        cancelled and discarded if it is rejected.
+
         Args:
             state (AgentState): The current state containing messages and metadata.
             
@@ -106,40 +280,62 @@ class RAGAgent(BaseAgent):
             Command: A command object specifying the next node to execute ("agent_brain" or "friendly_response")
             and any state updates. If the message passes guardrails, it proceeds to agent_brain;
             otherwise, it goes to friendly_response with a rejection reason.
+            A committed speculative step routes directly to "tools" or ends the graph.
         """
 
-        prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            self.guardrails_prompt["system"] # .format(examples=self.guardrails_examples)
-        ),
-        MessagesPlaceholder(variable_name="history"),
-        ("human",  self.guardrails_prompt["human"]),
-    ]
-        ) 
-        
-        guardials_runnable = prompt | self.llm.with_structured_output(schema=GuardialSchema, method="function_calling", include_raw=False)
-        guardials_response = await guardials_runnable.ainvoke({
-            "examples": self.guardrails_examples,
-            "input_user": state["messages"][-1].content, 
-            "history": state["messages"]})
+        # Clear-cut queries are decided locally; only ambiguous ones go to the LLM
+        guardials_response = self.guardrails_classifier.classify(
+            state["messages"][-1].content,
+            [message.content for message in state["messages"][:-1] if isinstance(message, HumanMessage)],
+        )
+        guardrail_path = "local"
+        speculative_task = None
+        speculation_usage: dict = {}
+
+        if guardials_response is None:
+            guardrail_path = "llm"
+            if self.speculative:
+                speculative_task = asyncio.create_task(self._speculate(state, speculation_usage))
+                self.speculation_stats["started"] += 1
+            try:
+                guardials_response = await self._llm_guardrail(state)
+            except BaseException:
+                if speculative_task is not None:
+                    speculative_task.cancel()
+                raise
+        self.guardrails_classifier.decisions[guardrail_path] += 1
 
         if guardials_response.classification == "accepted":
             goto = "agent_brain"
             update = {
                 "classification": guardials_response.classification,
+                "guardrail_path": guardrail_path,
             }
+            if speculative_task is not None:
+                try:
+                    brain_update = await speculative_task
+                except Exception as e:
+                    # The verdict stands: agent_brain runs the step again
+                    logger.warning(f"Speculative agent_brain step failed, running it after the guardrail: {e}")
+                    self.speculation_stats["failed"] += 1
+                else:
+                    self.speculation_stats["committed"] += 1
+                    update.update(brain_update)
+                    goto = self.route_condition({"messages": state["messages"] + brain_update["messages"]})
         else:
             goto = "friendly_response"
             update = {
                 "classification": guardials_response.classification,
-                "reject_reason": guardials_response.reason
+                "reject_reason": guardials_response.reason,
+                "guardrail_path": guardrail_path,
                 }
+            if speculative_task is not None:
+                await self._discard_speculation(speculative_task, speculation_usage)
         
         return Command(goto=goto, update=update)
 
 
+    @timed_stage("friendly_response")
     async def friendly_response(self, state: AgentState):
         """Generate a friendly response when a message fails guardrails.
         
@@ -150,25 +346,14 @@ class RAGAgent(BaseAgent):
             dict: A dictionary containing the friendly response message.
         """
 
-        prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            self.friendly_response_prompt["system"]
-        ),
-        MessagesPlaceholder(variable_name="history"),
-        ("human",  self.friendly_response_prompt["human"]),
-    ]
-        ) 
-        
-        friendly_response_runnable = prompt | self.llm
-        friendly_response_answer = await friendly_response_runnable.ainvoke({"reject_reason": state["reject_reason"], "history": state["messages"]})
+        friendly_response_answer = await self.friendly_response_runnable.ainvoke({"reject_reason": state["reject_reason"], "history": state["messages"]})
 
         return {
             "messages": friendly_response_answer,
         }
 
     
+    @timed_stage("agent_brain")
     async def agent_brain(self, state: AgentState):
         """Process accepted messages through the main agent logic.
         
@@ -177,16 +362,13 @@ class RAGAgent(BaseAgent):
             
         Returns:
             dict: A dictionary containing the processed messages, conversation ID, and user ID.
-            The response is generated using the last 12 messages of context.
+            The context (history and tool outputs) is fitted to the token budget before the call.
         """
 
-        llm_with_tools = self.llm.bind_tools(AVAILABLE_TOOLS)
-        textual_description_tool = [format_tool_for_prompt(tool_schema) for tool_schema in AVAILABLE_TOOLS]
-        textual_description_tool = "\n\n".join(textual_description_tool)
-
-        sys_msg = SystemMessage(content=AGENT_SYSTEM_PROMPT_PIC.format(textual_description_tool=textual_description_tool))
-
-        response = [await llm_with_tools.ainvoke([sys_msg] + state["messages"])]
+        AGENT_ITERATIONS.inc()
+        # Fit history and tool outputs into the token budget
+        messages = self.context_manager.fit(self.agent_sys_msg, state["messages"])
+        response = [await self.llm_with_tools.ainvoke([self.agent_sys_msg] + messages)]
         
         # Convert the response back to a dictionary and append to existing messages
         return {
@@ -195,19 +377,32 @@ class RAGAgent(BaseAgent):
             "user_id": state["user_id"]
         }
 
-    async def _run_graph(self, messages: list, metadata: dict):
-        """Internal method to run the agent with the given messages and metadata.
+    @timed_stage("final_answer")
+    async def final_answer(self, state: AgentState):
+        """Answers without tools once the turn reached max_iterations.
+
+        The last agent_brain step asked for tools that will not run: its message is
+        removed, so the conversation never keeps tool calls without their ToolMessages.
+        """
+        pending = state["messages"][-1]
+        messages = self.context_manager.fit(self.agent_sys_msg, state["messages"][:-1])
+        response = await self.llm.ainvoke(
+            [self.agent_sys_msg] + messages + [SystemMessage(content=AGENT_FINAL_ANSWER_PROMPT)]
+        )
+        return {
+            "messages": [RemoveMessage(id=pending.id), response],
+        }
+
+    def _build_state(self, messages: list, metadata: dict) -> dict:
+        """Builds the initial graph state from the conversation messages and metadata.
         
         Args:
-            messages: List of message dictionaries to process.
+            messages: List of MessageItem to process.
             metadata: Metadata of the conversation.
             
         Returns:
-            dict: The final state after running the agent graph.
+            dict: The initial AgentState.
         """
-        if not self.agent_graph:
-            await self.build_graph()
-        
         langchain_messages = []
         for msg in messages:
             if msg.role == "user":
@@ -216,47 +411,394 @@ class RAGAgent(BaseAgent):
                 langchain_messages.append(AIMessage(content=msg.content))
             
         # Initialize the state
-        state = {
+        return {
             "messages": langchain_messages,
             "conversation_id": metadata["conversation_id"],
             "user_id": metadata["user_id"],
             "ids_content": []
         }
-        
+
+    def config_fingerprint(self) -> dict:
+        """Settings that change the answers of the agent. Evaluation results are reused while it is unchanged."""
+        return {
+            "llm": llm_config_key(self.llm_provider, self.llm),
+            "tools": [tool.name for tool in AVAILABLE_TOOLS],
+            "max_iterations": self.max_iterations,
+            "context_budget": self.context_manager.max_tokens,
+            "guardrails_threshold": self.guardrails_classifier.threshold,
+            "answer_cache": {
+                "threshold": self.answer_cache.threshold,
+                "ttl": self.answer_cache.ttl,
+            } if self.answer_cache is not None else None,
+            "retrieval": {name: ENV_VARIABLES.get(name) for name in RETRIEVAL_SETTINGS},
+        }
+
+    def prompt_versions(self) -> dict:
+        """Content hash of each prompt (and the guardrail examples) used by the agent."""
+        return {
+            "agent": content_hash(self.agent_sys_msg.content),
+            "guardrails": content_hash(self.guardrails_prompt),
+            "guardrails_examples": content_hash(self.guardrails_examples),
+            "friendly_response": content_hash(self.friendly_response_prompt),
+        }
+
+    @property
+    def stats(self) -> dict:
+        """Counters of the local guardrail, speculation, context budget and answer cache."""
+        return {
+            "guardrail_decisions": dict(self.guardrails_classifier.decisions),
+            "speculation": dict(self.speculation_stats),
+            "context": self.context_manager.stats,
+            "answer_cache": self.answer_cache.stats if self.answer_cache is not None else {},
+        }
+
+    async def aclose(self) -> None:
+        """Closes the conversation store."""
+        if self.retention is not None:
+            await self.retention.aclose()
+        await close_checkpointer(self.checkpointer)
+
+    def _graph(self, stored: bool):
+        return self.agent_graph if stored else self.stateless_graph
+
+    @staticmethod
+    def _thread_id(metadata: dict) -> str:
+        """Key of the stored conversation: conversation ids are only unique per user."""
+        return json.dumps([metadata["user_id"], metadata["conversation_id"]])
+
+    def _graph_config(self, metadata: dict | None = None, stored: bool = False) -> dict:
         #configuration sent to the invoke method
         config = {
         #"callbacks": [get_tracer()],
+        # Prompt/completion tokens per node for /metrics
+        "callbacks": [TOKEN_USAGE_CALLBACK],
         "run_name": f"RAGAgent",
         #"recursion_limit": 3
         }
-        # Run the agent
-        return await self.agent_graph.ainvoke(state, config=config)
-    
-    async def run(self, history: list, metadata: dict) -> dict:
+        if stored and metadata is not None:
+            # The stored conversation state is keyed by (user_id, conversation_id)
+            config["configurable"] = {"thread_id": self._thread_id(metadata)}
+        return config
+
+    def _graph_kwargs(self, stored: bool = False) -> dict:
+        # Write the stored state once per turn instead of after every step
+        if not stored:
+            return {}
+        return {"durability": ENV_VARIABLES.get("CONVERSATION_STORE_DURABILITY", "exit")}
+
+    def _trim_stored(self, stored: list) -> tuple[list, list]:
         """
-        Executes the user workspace agent with the provided conversation history.
+        Messages to remove from a stored conversation so it keeps at most
+        max_stored_messages after the new one, cut at a user message so tool calls
+        stay with their results. Returns (removals, ids_content of the kept tool results).
         """
-    
-        history_messages = history[-20:]
-
-        final_response = await self._run_graph(history_messages, metadata)
+        overflow = len(stored) + 1 - self.max_stored_messages
+        if overflow <= 0:
+            return [], []
+        cut = overflow
+        while cut < len(stored) and not isinstance(stored[cut], HumanMessage):
+            cut += 1
+        kept_ids = [
+            hit.get("id_content")
+            for message in stored[cut:]
+            if isinstance(message, ToolMessage) and isinstance(message.artifact, list)
+            for hit in message.artifact
+        ]
+        return [RemoveMessage(id=message.id) for message in stored[:cut]], kept_ids
+
+    @staticmethod
+    def _unanswered_tool_calls(stored: list) -> list:
+        """
+        Removals for the AI messages of a stored conversation whose tool calls have no
+        ToolMessage reply (turns stopped before their tools ran), with the partial replies
+        they got. The API rejects a conversation that keeps them.
+        """
+        answered = {message.tool_call_id for message in stored if isinstance(message, ToolMessage)}
+        removals, dropped_calls = [], set()
+        for message in stored:
+            if isinstance(message, AIMessage) and message.tool_calls:
+                call_ids = {tool_call["id"] for tool_call in message.tool_calls}
+                if not call_ids <= answered:
+                    removals.append(RemoveMessage(id=message.id))
+                    dropped_calls |= call_ids
+            elif isinstance(message, ToolMessage) and message.tool_call_id in dropped_calls:
+                removals.append(RemoveMessage(id=message.id))
+        return removals
+
+    async def _graph_input(self, history: list | None, metadata: dict, message: str | None) -> tuple[dict, list]:
+        """Builds the graph input of a turn.
 
-        return final_response
+        Args:
+            history: Conversation sent by the client (last 20 messages). The store is not used.
+            metadata: Metadata of the conversation.
+            message: New user message, appended to the stored conversation instead of sending `history`.
 
-    async def stream_run(self, history: list, metadata: dict):
-        """
-        Yields tuples (stream_mode, chunk) from the graph.
+        Returns:
+            tuple: The graph input and the conversation it answers as MessageItems (empty when
+            it is a stored conversation with previous turns).
         """
-        # Prepare LangChain messages
+        if message is None:
+            history_messages = history[-20:]
+            return self._build_state(history_messages, metadata), history_messages
+
+        if self.checkpointer is None:
+            raise ValueError("Sending only the new message needs a conversation store (CONVERSATION_STORE)")
+        snapshot = await self.agent_graph.aget_state(self._graph_config(metadata, stored=True))
+        stored = snapshot.values.get("messages", [])
+        removals, kept_ids = self._trim_stored(stored)
+        trimmed = {removal.id for removal in removals}
+        removals += [
+            removal for removal in self._unanswered_tool_calls(stored)
+            if removal.id not in trimmed
+        ]
         state = {
-            "messages": [HumanMessage(content=m["content"]) for m in history],
-            "alert_id": metadata["alert_id"],
-            "alert": metadata["alert"]
+            "messages": removals + [HumanMessage(content=message)],
+            "conversation_id": metadata["conversation_id"],
+            "user_id": metadata["user_id"],
         }
+        if removals:
+            # Passages of the dropped turns are no longer in the context
+            state["ids_content"] = ["CLEAR"] + kept_ids
+        return state, [] if stored else [MessageItem(role="user", content=message)]
+
+    def _conversation_lock(self, metadata: dict, message: str | None):
+        """Lock of the stored conversation for turns that resume it; a no-op otherwise."""
+        if message is None or self.checkpointer is None:
+            return nullcontext()
+        thread_id = self._thread_id(metadata)
+        lock = self._conversation_locks.get(thread_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._conversation_locks[thread_id] = lock
+        return lock
+
+    async def _run_graph(self, graph_input: dict, metadata: dict, stored: bool = False):
+        """Internal method to run the agent with the given input and metadata.
+        
+        Args:
+            graph_input: Graph input of the turn (see `_graph_input`).
+            metadata: Metadata of the conversation.
+            stored: The turn resumes the stored conversation and is written back.
+            
+        Returns:
+            dict: The final state after running the agent graph.
+        """
+        # Run the agent
+        return await self._graph(stored).ainvoke(
+            graph_input, config=self._graph_config(metadata, stored), **self._graph_kwargs(stored)
+        )
 
-        # LangGraph’s async stream
-        async for mode, chunk in self.agent_graph.astream(
-            state,
-            stream_mode=["messages", "custom"],
+    async def _after_stored_turn(self, metadata: dict, stored: bool) -> None:
+        """Applies the retention of the conversation store to the conversation just written."""
+        if stored and self.retention is not None:
+            await self.retention.after_turn(self._thread_id(metadata))
+    
+    async def _answer_cache_key(self, history: list) -> tuple | None:
+        """
+        (question vector, index generation) of a single-turn question, None when the
+        answer cache is off or the conversation has previous turns. No search runs for
+        the key: the question vector goes through the shared embedding cache, where a
+        tool search for the same text finds it.
+        """
+        if self.answer_cache is None or len(history) != 1 or history[0].role != "user":
+            return None
+        pool = get_retriever_pool()
+        with observe_stage("answer_cache_lookup"):
+            async with pool.acquire() as search_client:
+                vector = await search_client.generate_embeddings(history[0].content)
+        return vector, pool.result_cache.generation
+
+    async def _cached_state(self, graph_input: dict, history: list, metadata: dict, entry: dict, stored: bool = False) -> dict:
+        """Final state returned for an answer cache hit, shaped like the graph output.
+        A stored conversation also gets the turn written, without the ids_content of the
+        entry: its passages are in no ToolMessage, so later searches must show them in full."""
+        answer = AIMessage(content=entry["answer"])
+        if stored:
+            await self.agent_graph.aupdate_state(
+                self._graph_config(metadata, stored=True),
+                {**graph_input, "messages": graph_input["messages"] + [answer], "classification": "accepted"},
+                as_node="agent_brain",
+            )
+        state = self._build_state(history, metadata)
+        state["messages"].append(answer)
+        state["ids_content"] = entry["ids_content"]
+        state["classification"] = "accepted"
+        state["answer_cache"] = {"question": entry["question"], "similarity": entry["similarity"]}
+        return state
+
+    def _store_answer(self, cache_key: tuple, history: list, final_state: dict) -> None:
+        """Caches answers grounded on retrieved passages; rejections and ungrounded answers are not cached."""
+        messages = final_state.get("messages") or []
+        if (
+            final_state.get("classification") == "accepted"
+            and final_state.get("ids_content")
+            and messages
+            and isinstance(messages[-1], AIMessage)
+            and not messages[-1].tool_calls
+            and messages[-1].content
+        ):
+            self.answer_cache.store(
+                *cache_key,
+                question=history[0].content,
+                answer=messages[-1].content,
+                ids_content=final_state["ids_content"],
+            )
+
+    async def run(self, history: list | None, metadata: dict, message: str | None = None) -> dict:
+        """
+        Executes the user workspace agent with the provided conversation history,
+        or with only the new `message` of a conversation kept in the store.
+        """
+        stored = message is not None
+        async with self._conversation_lock(metadata, message):
+            graph_input, history_messages = await self._graph_input(history, metadata, message)
+
+            cache_key = await self._answer_cache_key(history_messages)
+            if cache_key is not None:
+                entry = self.answer_cache.lookup(*cache_key)
+                if entry is not None:
+                    cached = await self._cached_state(graph_input, history_messages, metadata, entry, stored)
+                    await self._after_stored_turn(metadata, stored)
+                    return cached
+
+            final_response = await self._run_graph(graph_input, metadata, stored)
+            await self._after_stored_turn(metadata, stored)
+
+        if cache_key is not None:
+            self._store_answer(cache_key, history_messages, final_response)
+        return final_response
+
+    @staticmethod
+    def _node_updates(chunk) -> list:
+        """Flattens an "updates" stream chunk into (node, update) pairs."""
+        pairs = []
+        for node, updates in chunk.items():
+            for update in updates if isinstance(updates, list) else [updates]:
+                if isinstance(update, dict):
+                    pairs.append((node, update))
+        return pairs
+
+    @staticmethod
+    def _tool_events(messages: list) -> list:
+        """Events for the tool calls requested by an AI message and the tool results."""
+        events = []
+        for message in messages if isinstance(messages, list) else [messages]:
+            if isinstance(message, AIMessage):
+                for tool_call in message.tool_calls:
+                    events.append({"type": "tool_start", "data": {"tool": tool_call["name"], "args": tool_call["args"], "id": tool_call["id"]}})
+            elif isinstance(message, ToolMessage):
+                hits = message.artifact if isinstance(message.artifact, list) else []
+                events.append({"type": "retrieval", "data": {
+                    "id": message.tool_call_id,
+                    "hits": [
+                        {
+                            "id_content": hit.get("id_content"),
+                            "domain": hit.get("domain"),
+                            "source": hit.get("source"),
+                            "score": search_result_score(hit),
+                        }
+                        for hit in hits
+                    ],
+                }})
+                events.append({"type": "tool_end", "data": {"tool": message.name, "id": message.tool_call_id, "hits": len(hits)}})
+        return events
+
+    async def stream_run(self, history: list | None, metadata: dict, message: str | None = None):
+        """
+        Runs the agent and yields events as they happen:
+            - "guardrail": verdict of the guardrail node (classification, path, reason).
+            - "tool_start" / "tool_end": tool calls requested by the agent and their completion
+              ("skipped" when the turn ran out of iterations before running them).
+            - "retrieval": search hits returned by a tool.
+            - "token": answer tokens from agent_brain, final_answer or friendly_response as the LLM produces them.
+            - "done": final answer, ids_content, time to first token and total time (ms).
+        The input is built the same way as in `run`. An answer cache hit yields the whole
+        answer as one "token" event and a "done" event with answer_cache=True.
+        """
+        async with self._conversation_lock(metadata, message):
+            async for event in self._stream_turn(history, metadata, message):
+                yield event
+
+    async def _stream_turn(self, history: list | None, metadata: dict, message: str | None):
+        start = time.perf_counter()
+        ttft_ms = None
+        final_state = {}
+        # tool_start events without their tool_end yet
+        open_tool_calls = {}
+        stored = message is not None
+        graph_input, history_messages = await self._graph_input(history, metadata, message)
+
+        cache_key = await self._answer_cache_key(history_messages)
+        entry = self.answer_cache.lookup(*cache_key) if cache_key is not None else None
+        if entry is not None:
+            await self._cached_state(graph_input, history_messages, metadata, entry, stored)
+            await self._after_stored_turn(metadata, stored)
+            total_ms = (time.perf_counter() - start) * 1000
+            yield {"type": "token", "data": entry["answer"]}
+            yield {"type": "done", "data": {
+                "response": entry["answer"],
+                "ids_content": entry["ids_content"],
+                "ttft_ms": total_ms,
+                "total_ms": total_ms,
+                "answer_cache": True,
+            }}
+            return
+
+        async for mode, chunk in self._graph(stored).astream(
+            graph_input,
+            config=self._graph_config(metadata, stored),
+            stream_mode=["messages", "updates", "values"],
+            **self._graph_kwargs(stored),
         ):
-            yield {"type": mode, "data": chunk}
+            events = []
+            if mode == "messages":
+                message_chunk, chunk_metadata = chunk
+                # Guardrail calls (and speculative agent steps inside them) are not streamed
+                if chunk_metadata.get("langgraph_node") in ("agent_brain", "final_answer", "friendly_response") and isinstance(message_chunk.content, str) and message_chunk.content:
+                    events.append({"type": "token", "data": message_chunk.content})
+            elif mode == "updates":
+                for node, update in self._node_updates(chunk):
+                    if node == "guardrial":
+                        events.append({"type": "guardrail", "data": {
+                            "classification": update.get("classification"),
+                            "path": update.get("guardrail_path"),
+                            "reason": update.get("reject_reason"),
+                        }})
+                        # A committed speculative step arrives whole in the guardrail update
+                        for message in update.get("messages", []):
+                            if isinstance(message, AIMessage) and not message.tool_calls and message.content:
+                                events.append({"type": "token", "data": message.content})
+                    if node == "final_answer":
+                        events.extend(
+                            {"type": "tool_end", "data": {"tool": tool, "id": tool_call_id, "hits": 0, "skipped": True}}
+                            for tool_call_id, tool in open_tool_calls.items()
+                        )
+                        open_tool_calls.clear()
+                    if "messages" in update:
+                        events.extend(self._tool_events(update["messages"]))
+            elif mode == "values":
+                final_state = chunk
+
+            for event in events:
+                if event["type"] == "tool_start":
+                    open_tool_calls[event["data"]["id"]] = event["data"]["tool"]
+                elif event["type"] == "tool_end":
+                    open_tool_calls.pop(event["data"]["id"], None)
+                if event["type"] == "token" and ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                yield event
+
+        await self._after_stored_turn(metadata, stored)
+        total_ms = (time.perf_counter() - start) * 1000
+        if ttft_ms is not None:
+            STAGE_LATENCY.labels("ttft").observe(ttft_ms / 1000)
+        logger.info(f"stream_run conversation={metadata['conversation_id']} ttft_ms={ttft_ms} total_ms={total_ms:.1f}")
+        if cache_key is not None:
+            self._store_answer(cache_key, history_messages, final_state)
+        messages = final_state.get("messages") or [AIMessage(content="")]
+        yield {"type": "done", "data": {
+            "response": messages[-1].content,
+            "ids_content": final_state.get("ids_content", []),
+            "ttft_ms": ttft_ms,
+            "total_ms": total_ms,
+        }}
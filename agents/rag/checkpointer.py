@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+from config.config import DATA_DIR, ENV_VARIABLES
+
+logger = logging.getLogger(__name__)
+
+
+def _sqlite_checkpointer() -> BaseCheckpointSaver:
+    """
+    Local SQLite file (CONVERSATION_STORE_PATH, default data/conversations.sqlite).
+    Needs langgraph-checkpoint-sqlite and a running event loop.
+    """
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    path = ENV_VARIABLES.get("CONVERSATION_STORE_PATH") or str(DATA_DIR / "conversations.sqlite")
+    # The connection is opened by the saver on first use
+    return AsyncSqliteSaver(aiosqlite.connect(path))
+
+
+CHECKPOINTER_FACTORIES: Dict[str, Callable[[], BaseCheckpointSaver]] = {
+    "sqlite": _sqlite_checkpointer,
+    "memory": InMemorySaver,
+}
+
+
+def build_checkpointer(backend: str | None = None) -> BaseCheckpointSaver | None:
+    """
+    Builds the store of the conversation state (graph checkpoints keyed by conversation_id).
+
+    Args:
+        backend (str): "sqlite", "memory", "none" or any name registered in CHECKPOINTER_FACTORIES
+            (e.g. a Postgres or Redis saver). Defaults to CONVERSATION_STORE, then "sqlite".
+
+    Returns:
+        BaseCheckpointSaver | None: The checkpointer, None for "none" (stateless agent).
+    """
+    backend = backend or ENV_VARIABLES.get("CONVERSATION_STORE", "sqlite")
+    if backend == "none":
+        return None
+    if backend not in CHECKPOINTER_FACTORIES:
+        raise ValueError(f"Conversation store {backend} not supported")
+    return CHECKPOINTER_FACTORIES[backend]()
+
+
+class ConversationRetention:
+    """
+    Keeps the conversation store bounded:
+        - after every stored turn the older checkpoints of that conversation are deleted
+          (SQLite store): a turn only resumes from the latest one;
+        - conversations idle for more than `ttl` seconds are deleted, checked in the
+          background at most every `interval` seconds.
+    """
+
+    def __init__(self, checkpointer: BaseCheckpointSaver, ttl: float | None = None, interval: float | None = None):
+        """
+        Args:
+            checkpointer (BaseCheckpointSaver): The conversation store.
+            ttl (float): Seconds a conversation is kept after its last turn (CONVERSATION_TTL_SECONDS, 0 keeps them).
+            interval (float): Seconds between checks for idle conversations (CONVERSATION_PRUNE_INTERVAL_SECONDS).
+        """
+        self.checkpointer = checkpointer
+        self.ttl = ttl if ttl is not None else float(ENV_VARIABLES.get("CONVERSATION_TTL_SECONDS", 30 * 86400))
+        self.interval = interval if interval is not None else float(ENV_VARIABLES.get("CONVERSATION_PRUNE_INTERVAL_SECONDS", 3600))
+        self._last_expiry: float | None = None
+        self._expiry_task: asyncio.Task | None = None
+        self.expired = 0
+
+    async def after_turn(self, thread_id: str) -> None:
+        """Prunes the conversation just written and starts an expiry pass when one is due."""
+        await self._prune_thread(thread_id)
+        now = time.monotonic()
+        if self.ttl and (self._last_expiry is None or now - self._last_expiry >= self.interval):
+            self._last_expiry = now
+            if self._expiry_task is None or self._expiry_task.done():
+                self._expiry_task = asyncio.create_task(self.expire())
+
+    async def _prune_thread(self, thread_id: str) -> None:
+        try:
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        except ImportError:
+            return
+        if not isinstance(self.checkpointer, AsyncSqliteSaver):
+            return
+        await self.checkpointer.setup()
+        async with self.checkpointer.lock:
+            for table in ("writes", "checkpoints"):
+                await self.checkpointer.conn.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id < "
+                    "(SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '')",
+                    (thread_id, thread_id),
+                )
+            await self.checkpointer.conn.commit()
+
+    async def expire(self) -> int:
+        """Deletes the conversations whose last turn is older than `ttl`. Returns how many."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        last_turn: Dict[str, datetime] = {}
+        try:
+            async for item in self.checkpointer.alist(None):
+                thread_id = item.config["configurable"]["thread_id"]
+                ts = datetime.fromisoformat(item.checkpoint["ts"])
+                if thread_id not in last_turn or ts > last_turn[thread_id]:
+                    last_turn[thread_id] = ts
+            expired = [thread_id for thread_id, ts in last_turn.items() if ts < cutoff]
+            for thread_id in expired:
+                await self.checkpointer.adelete_thread(thread_id)
+        except Exception as e:
+            logger.warning(f"Expiring idle conversations failed: {e}")
+            return 0
+        self.expired += len(expired)
+        return len(expired)
+
+    async def aclose(self) -> None:
+        if self._expiry_task is not None and not self._expiry_task.done():
+            self._expiry_task.cancel()
+            try:
+                await self._expiry_task
+            except asyncio.CancelledError:
+                pass
+
+
+async def close_checkpointer(checkpointer: BaseCheckpointSaver | None) -> None:
+    """Closes the connection held by the checkpointer, if any."""
+    conn = getattr(checkpointer, "conn", None)
+    if conn is None:
+        return
+    is_alive = getattr(conn, "is_alive", None)
+    if is_alive is None or is_alive():
+        await conn.close()
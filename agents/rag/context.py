@@ -0,0 +1,161 @@
+import json
+import logging
+from typing import List, Sequence
+
+import tiktoken
+from langchain_core.messages import AnyMessage, HumanMessage, ToolMessage
+
+from agents.rag.utils import render_search_results, search_result_score
+from config.config import ENV_VARIABLES
+
+# Fixed per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Approximation used when the tiktoken encoding files are not available (offline)
+CHARS_PER_TOKEN = 4
+
+logger = logging.getLogger(__name__)
+
+
+class ContextBudgetManager:
+    """
+    Fits the messages sent to agent_brain into a token budget.
+
+    When the conversation is over budget it, in order:
+    1. trims the search results of older turns, keeping the highest-scoring passages,
+    2. drops the oldest turns, always keeping the current one,
+    3. trims the search results of the current turn.
+    Search results are re-rendered from the ToolMessage artifact, so tool calls and
+    their ToolMessages always stay paired, and a passage is only sent as a reference
+    while the message that showed it in full is still in the context.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        encoding_name: str | None = None,
+        passage_steps: Sequence[int] = (10, 5, 3, 1),
+    ):
+        """
+        Args:
+            max_tokens (int): Budget for system prompt plus messages (AGENT_CONTEXT_TOKEN_BUDGET).
+            encoding_name (str): tiktoken encoding (AGENT_TOKENIZER_ENCODING).
+            passage_steps (list): Passages kept per tool output at each trimming step.
+        """
+        self.max_tokens = max_tokens or int(ENV_VARIABLES.get("AGENT_CONTEXT_TOKEN_BUDGET", 16000))
+        self.encoding_name = encoding_name or ENV_VARIABLES.get("AGENT_TOKENIZER_ENCODING", "o200k_base")
+        self.passage_steps = passage_steps
+        # Loaded here, at agent construction: on a cold cache tiktoken downloads the
+        # encoding, which must not happen inside the event loop of a request
+        self._encoding = self._load_encoding()
+
+        self.calls = 0
+        self.trimmed_calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def _load_encoding(self):
+        try:
+            return tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            logger.warning(f"tiktoken encoding {self.encoding_name} not available, approximating tokens: {e}")
+            return False
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        if not self.encoding:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def message_tokens(self, message: AnyMessage) -> int:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        tokens = self.count(content) + MESSAGE_OVERHEAD_TOKENS
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            tokens += self.count(tool_call["name"]) + self.count(json.dumps(tool_call["args"], ensure_ascii=False))
+        return tokens
+
+    @staticmethod
+    def _has_results(message: AnyMessage) -> bool:
+        return isinstance(message, ToolMessage) and isinstance(message.artifact, list)
+
+    def _render_tool_messages(self, messages: list, tokens: list) -> int:
+        """
+        Re-renders the search results of every ToolMessage. Passages shown in full by an
+        earlier kept message become references. Returns the new total of tokens.
+        """
+        visible_ids = set()
+        for i, message in enumerate(messages):
+            if not self._has_results(message):
+                continue
+            content = render_search_results(message.artifact, visible_ids)
+            if content != message.content:
+                messages[i] = message.model_copy(update={"content": content})
+                tokens[i] = self.message_tokens(messages[i])
+            visible_ids.update(record.get("id_content") for record in message.artifact)
+        return sum(tokens)
+
+    def _trim_tool_outputs(self, messages: list, tokens: list, end: int, total: int, budget: int) -> int:
+        for keep in self.passage_steps:
+            for i in range(end):
+                if total <= budget:
+                    return total
+                message = messages[i]
+                if self._has_results(message) and len(message.artifact) > keep:
+                    passages = sorted(message.artifact, key=search_result_score, reverse=True)[:keep]
+                    messages[i] = message.model_copy(update={"artifact": passages})
+                    total = self._render_tool_messages(messages, tokens)
+        return total
+
+    def fit(self, system_message: AnyMessage, messages: List[AnyMessage]) -> List[AnyMessage]:
+        """
+        Returns the messages to send with `system_message`, within the budget when possible.
+        The state is not modified.
+        """
+        self.calls += 1
+        budget = self.max_tokens - self.message_tokens(system_message)
+        tokens = [self.message_tokens(message) for message in messages]
+        total = sum(tokens)
+        self.tokens_before += total
+        if total <= budget:
+            self.tokens_after += total
+            return messages
+
+        self.trimmed_calls += 1
+        messages = list(messages)
+        turn_starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+        current_turn = turn_starts[-1] if turn_starts else 0
+
+        # 1. Older turns keep only their best passages
+        total = self._trim_tool_outputs(messages, tokens, current_turn, total, budget)
+
+        # 2. Drop the oldest turns
+        cut = 0
+        for start in turn_starts:
+            if total <= budget or start == current_turn:
+                break
+            if start > cut:
+                total -= sum(tokens[cut:start])
+                cut = start
+        if total > budget and current_turn > cut:
+            total -= sum(tokens[cut:current_turn])
+            cut = current_turn
+        if cut:
+            messages, tokens = messages[cut:], tokens[cut:]
+            total = self._render_tool_messages(messages, tokens)
+
+        # 3. The current turn keeps only its best passages
+        total = self._trim_tool_outputs(messages, tokens, len(messages), total, budget)
+
+        self.tokens_after += total
+        return messages
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "trimmed_calls": self.trimmed_calls,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+        }
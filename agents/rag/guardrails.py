@@ -0,0 +1,153 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from agents.rag.schemas.graph import GuardialSchema
+from config.config import ENV_VARIABLES
+
+# Temas aceptados de GUARDRAILS_PROMPT (sin tildes, en minúsculas)
+ACCEPTED_KEYWORDS = {
+    "garantia", "garantias", "warranty", "warranties", "cobertura", "coverage",
+    "manual", "manuales", "instrucciones", "instructions",
+    "producto", "productos", "product", "products", "modelo", "model", "dispositivo", "device",
+    "computador", "computadora", "computadores", "computadoras", "portatil", "portatiles", "laptop", "laptops",
+    "pc", "computer", "computers", "escritorio", "desktop",
+    "televisor", "televisores", "television", "televisions", "tv", "tele",
+    "smartphone", "smartphones", "celular", "celulares", "telefono", "telefonos", "movil", "phone", "phones",
+    "pantalla", "screen", "bateria", "battery", "teclado", "keyboard", "cargador", "charger",
+    "reiniciar", "reinicio", "reset", "restablecer", "configurar", "configuracion", "setup",
+}
+# Temas rechazados de GUARDRAILS_PROMPT: precios y opiniones personales
+PRICE_REASON = "The user is asking about prices, which are outside the scope of the assistant."
+OPINION_REASON = "The user is asking for a personal opinion, which is outside the scope of the assistant."
+REJECTED_PATTERNS = [
+    (re.compile(r"\b(precios?|prices?|descuentos?|discounts?|cuanto (cuesta|vale|valen|cuestan)|how much (is|does|do))\b"), PRICE_REASON),
+    (re.compile(r"\b(mejor marca|best brand|que opinas|tu opinion|your opinion|recomiendas|do you recommend)\b"), OPINION_REASON),
+]
+# Señales fuera de alcance: con cualquiera de ellas (también en turnos anteriores) decide el LLM
+OUT_OF_SCOPE_PATTERNS = [
+    # Prompt injection
+    re.compile(r"\b(ignora\w*|ignore|olvida\w*|forget|disregard)\b.*\b(instrucciones|instructions|reglas|rules|prompt)\b"),
+    re.compile(r"\b(prompt del sistema|system prompt|jailbreak|modo desarrollador|developer mode|actua como|act as|pretend)\b"),
+    # Usos indebidos de un producto
+    re.compile(r"\b(hack\w*|espi(a|o|e|ar)\w*|spy\w*|crack\w*|robar|robad\w*|steal\w*|stolen)\b"),
+    # Tareas que no son consultas (textos creativos, otros temas)
+    re.compile(r"\b(poemas?|poems?|cuentos?|story|chistes?|jokes?|cancion\w*|songs?|ensayos?|essays?|recetas?|recipes?)\b"),
+]
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", _normalize(text))
+
+
+def _ngrams(text: str, n: int = 3) -> Counter:
+    text = f" {' '.join(_tokens(text))} "
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(value * b[key] for key, value in a.items() if key in b)
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+class LocalGuardrailClassifier:
+    """
+    Pre-classifier that decides clear-cut guardrail cases without calling the LLM.
+    It combines keyword rules for the accepted/rejected topics of GUARDRAILS_PROMPT
+    with character n-gram similarity to the labeled guardrails examples.
+    Only decisions whose confidence reaches `threshold` are taken locally: a query
+    is accepted on strong similarity to an accepted example or on several product
+    keywords, and never when it (or an earlier turn) has an out-of-scope signal.
+    """
+
+    def __init__(self, examples: List[Dict[str, str]], threshold: float | None = None):
+        """
+        Args:
+            examples (list): Labeled examples with "input_user", "classification" and "reason".
+            threshold (float): Minimum confidence to decide locally (GUARDRAILS_LOCAL_THRESHOLD).
+                The default 0.9 needs three product keywords, or one keyword less per
+                0.1 below it. A value above 1 sends every query to the LLM.
+        """
+        self.threshold = threshold if threshold is not None else float(
+            ENV_VARIABLES.get("GUARDRAILS_LOCAL_THRESHOLD", 0.9)
+        )
+        self.examples: List[Tuple[Counter, Dict[str, str]]] = [
+            (_ngrams(example["input_user"]), example) for example in examples
+        ]
+        # Decisions by path: "local" or "llm"
+        self.decisions: Counter = Counter()
+
+    def _nearest_example(self, text: str) -> Tuple[float, Dict[str, str] | None]:
+        vector = _ngrams(text)
+        best_score, best_example = 0.0, None
+        for example_vector, example in self.examples:
+            score = _cosine(vector, example_vector)
+            if score > best_score:
+                best_score, best_example = score, example
+        return best_score, best_example
+
+    def predict(self, text: str, history: List[str] | None = None) -> Tuple[GuardialSchema, float]:
+        """
+        Classifies a user query.
+
+        Args:
+            text (str): The query.
+            history (list): Previous user messages of the conversation.
+
+        Returns:
+            tuple: The classification and its confidence between 0 and 1.
+        """
+        normalized = " ".join(_tokens(text))
+        if any(
+            pattern.search(" ".join(_tokens(message)))
+            for message in [text, *(history or [])]
+            for pattern in OUT_OF_SCOPE_PATTERNS
+        ):
+            return GuardialSchema(classification="rejected", reason="Possible out-of-scope request."), 0.0
+        rejected = [reason for pattern, reason in REJECTED_PATTERNS if pattern.search(normalized)]
+        accepted = set(normalized.split()) & ACCEPTED_KEYWORDS
+        similarity, example = self._nearest_example(text)
+
+        if rejected:
+            prediction = GuardialSchema(classification="rejected", reason=rejected[0])
+            # A product topic together with a price/opinion topic is left to the LLM
+            confidence = 0.5 if accepted else 0.9
+        elif accepted:
+            prediction = GuardialSchema(
+                classification="accepted",
+                reason="The user is asking about products, warranties or manuals.",
+            )
+            # One keyword alone stays below the default threshold
+            confidence = min(0.6 + 0.1 * len(accepted), 0.9)
+        elif example is not None:
+            prediction = GuardialSchema(classification=example["classification"], reason=example["reason"])
+            return prediction, similarity
+        else:
+            return GuardialSchema(classification="rejected", reason="Unknown topic."), 0.0
+
+        if example is not None and similarity > 0.5:
+            if example["classification"] == prediction.classification:
+                confidence = max(confidence, similarity)
+            else:
+                confidence -= 0.2
+        return prediction, confidence
+
+    def classify(self, text: str, history: List[str] | None = None) -> GuardialSchema | None:
+        """
+        Returns the local classification if it is confident enough, otherwise None
+        (the query must go to the LLM).
+        """
+        prediction, confidence = self.predict(text, history)
+        if confidence >= self.threshold:
+            return prediction
+        return None
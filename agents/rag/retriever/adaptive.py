@@ -0,0 +1,90 @@
+from typing import Dict, List
+
+from agents.rag.utils import resolve_search_mode, search_result_score
+from config.config import ENV_VARIABLES
+from tracing.metrics import RETRIEVAL_TOP_K, RETRIEVAL_WIDENED
+
+
+def is_confident(results: List[Dict], top: int, mode: str, margin: float, reranker_threshold: float, fusion_threshold: float) -> bool:
+    """
+    Whether a ranking of `top` results is good enough to stop widening:
+        - fewer results than `top`: the filters left nothing more to fetch;
+        - with semantic reranker scores (0-4), the best one reaches `reranker_threshold`;
+        - hybrid scores are reciprocal rank fusion scores, flat by construction: the best
+          one reaches `fusion_threshold`, i.e. it is near the top of both rankings;
+        - otherwise the best score stands out from the last one by at least `margin`
+          (relative), i.e. the scores are not flat.
+    """
+    if not results or len(results) < top:
+        return True
+    if results[0].get("@search.reranker_score") is not None:
+        return search_result_score(results[0]) >= reranker_threshold
+    if mode == "hybrid":
+        return search_result_score(results[0]) >= fusion_threshold
+    best, last = search_result_score(results[0]), search_result_score(results[-1])
+    if best <= 0:
+        return False
+    return (best - last) / best >= margin
+
+
+async def adaptive_search(
+    search_client,
+    query: str,
+    filters: Dict | None = None,
+    select: List[str] | None = None,
+    mode: str | None = None,
+    semantic_rerank: bool | None = None,
+    initial_top: int | None = None,
+    max_top: int | None = None,
+    margin: float | None = None,
+    reranker_threshold: float | None = None,
+    fusion_threshold: float | None = None,
+) -> List[Dict]:
+    """
+    Searches with a small `top` and doubles it, up to `max_top`, only while the
+    results look low-confidence (see `is_confident`). Clear queries stop at the
+    first search with a few passages; ambiguous ones get more candidates.
+
+    Args:
+        search_client: CognitiveSearch, LocalVectorSearch or FakeCognitiveSearch.
+        query (str): Search text.
+        filters (dict): Field filters, e.g. {"domain": "manuales"}.
+        select (list): Fields to return.
+        mode (str): "vector", "keyword" or "hybrid". Defaults to SEARCH_MODE.
+        semantic_rerank (bool): Semantic reranking. Defaults to SEARCH_SEMANTIC_RERANK.
+        initial_top (int): top of the first search (SEARCH_TOP_K_INITIAL).
+        max_top (int): Largest top (SEARCH_TOP_K_MAX). Equal to initial_top disables widening.
+        margin (float): Relative gap between first and last score that counts as confident (SEARCH_TOP_K_MARGIN).
+        reranker_threshold (float): Reranker score that counts as confident (SEARCH_RERANKER_CONFIDENT).
+        fusion_threshold (float): Hybrid (RRF) score that counts as confident (SEARCH_FUSION_CONFIDENT).
+            With k=60 a row in both rankings scores 2/(60+r), so the default 0.03 needs
+            about the top 6 or 7 (r <= 6.7) of both the keyword and vector rankings.
+
+    Returns:
+        list: Results of the last search, best first.
+    """
+    mode, semantic_rerank = resolve_search_mode(mode, semantic_rerank=semantic_rerank)
+    top = initial_top or int(ENV_VARIABLES.get("SEARCH_TOP_K_INITIAL", 5))
+    max_top = max(max_top or int(ENV_VARIABLES.get("SEARCH_TOP_K_MAX", 20)), top)
+    margin = margin if margin is not None else float(ENV_VARIABLES.get("SEARCH_TOP_K_MARGIN", 0.2))
+    if reranker_threshold is None:
+        reranker_threshold = float(ENV_VARIABLES.get("SEARCH_RERANKER_CONFIDENT", 2.0))
+    if fusion_threshold is None:
+        fusion_threshold = float(ENV_VARIABLES.get("SEARCH_FUSION_CONFIDENT", 0.03))
+
+    while True:
+        results = await search_client.search(
+            query,
+            top=top,
+            filters=filters,
+            select=select,
+            mode=mode,
+            semantic_rerank=semantic_rerank,
+        )
+        if top >= max_top or is_confident(results, top, mode, margin, reranker_threshold, fusion_threshold):
+            break
+        RETRIEVAL_WIDENED.labels(mode).inc()
+        top = min(top * 2, max_top)
+
+    RETRIEVAL_TOP_K.labels(mode).observe(top)
+    return results
@@ -0,0 +1,97 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from config.config import ENV_VARIABLES
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into a single `embeddings.create` call.
+    Requests are collected for `batch_window_ms` milliseconds or until
+    `max_batch_size` texts are waiting, whichever comes first; each caller
+    receives its own vector.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int | None = None,
+        batch_window_ms: float | None = None,
+    ):
+        """
+        Args:
+            embed_batch (callable): Coroutine that embeds a list of texts and returns the vectors in order.
+            max_batch_size (int): Maximum texts per call (EMBEDDING_BATCH_MAX_SIZE).
+            batch_window_ms (float): Milliseconds to wait for more requests (EMBEDDING_BATCH_WINDOW_MS).
+        """
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size or int(ENV_VARIABLES.get("EMBEDDING_BATCH_MAX_SIZE", 16))
+        self.batch_window = (
+            batch_window_ms if batch_window_ms is not None else float(ENV_VARIABLES.get("EMBEDDING_BATCH_WINDOW_MS", 5))
+        ) / 1000
+
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._inflight: set = set()
+
+        self.batches = 0
+        self.requests = 0
+        self.inputs = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        # Identical texts in the same window are embedded once
+        positions: Dict[str, int] = {}
+        for text, _ in batch:
+            positions.setdefault(text, len(positions))
+        texts = list(positions)
+
+        self.batches += 1
+        self.inputs += len(texts)
+        try:
+            vectors = await self.embed_batch(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future in batch:
+            if not future.done():
+                future.set_result(vectors[positions[text]])
+
+    @property
+    def stats(self) -> dict:
+        """
+        Batching metrics. `fill_rate` is the mean fraction of `max_batch_size` used per call.
+        """
+        avg_batch_size = self.inputs / self.batches if self.batches else 0.0
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "inputs": self.inputs,
+            "avg_batch_size": avg_batch_size,
+            "fill_rate": avg_batch_size / self.max_batch_size,
+        }
@@ -0,0 +1,248 @@
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable, List, Optional, Tuple
+
+from config.config import ENV_VARIABLES
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliza un texto para usarlo como llave de caché:
+    unicode NFC, minúsculas y espacios colapsados.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class TTLCache:
+    """
+    Bounded in-memory LRU cache whose entries expire after `ttl` seconds.
+    Not thread-safe; meant to be used from a single event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        """
+        Args:
+            maxsize (int): Maximum number of entries. The least recently used entry is evicted first.
+            ttl (float): Seconds an entry stays valid. None disables expiration.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is not None:
+            created, value = entry
+            if self.ttl is None or time.monotonic() - created < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteEmbeddingStore:
+    """
+    Persistent embedding tier. Vectors are stored as float32 blobs in a SQLite table.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, ttl: float | None = None) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT vector, created FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        blob, created = row
+        if ttl is not None and time.time() - created >= ttl:
+            return None
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def set(self, key: str, vector: List[float]) -> None:
+        blob = array("f", vector).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by (deployment, normalized text):
+    a bounded in-memory LRU with TTL and an optional SQLite tier shared between
+    workers and restarts.
+    """
+
+    def __init__(
+        self,
+        maxsize: int | None = None,
+        ttl: float | None = None,
+        disk_path: str | Path | None = None,
+    ):
+        """
+        Args:
+            maxsize (int): Entries kept in memory (EMBEDDING_CACHE_SIZE).
+            ttl (float): Seconds an embedding stays valid (EMBEDDING_CACHE_TTL).
+            disk_path (str): SQLite file for the persistent tier (EMBEDDING_CACHE_PATH). Disabled if empty.
+        """
+        maxsize = maxsize if maxsize is not None else int(ENV_VARIABLES.get("EMBEDDING_CACHE_SIZE", 2048))
+        ttl = ttl if ttl is not None else float(ENV_VARIABLES.get("EMBEDDING_CACHE_TTL", 86400))
+        disk_path = disk_path if disk_path is not None else ENV_VARIABLES.get("EMBEDDING_CACHE_PATH")
+
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteEmbeddingStore(disk_path) if disk_path else None
+        self.disk_hits = 0
+
+    @staticmethod
+    def key(deployment: str, text: str) -> str:
+        return f"{deployment}\x1f{normalize_text(text)}"
+
+    async def get(self, deployment: str, text: str) -> Optional[List[float]]:
+        key = self.key(deployment, text)
+        vector = self.memory.get(key)
+        if vector is None and self.disk is not None:
+            vector = await asyncio.to_thread(self.disk.get, key, self.ttl)
+            if vector is not None:
+                self.disk_hits += 1
+                self.memory.set(key, vector)
+        return vector
+
+    async def set(self, deployment: str, text: str, vector: List[float]) -> None:
+        key = self.key(deployment, text)
+        self.memory.set(key, vector)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, vector)
+
+    @property
+    def stats(self) -> dict:
+        stats = self.memory.stats
+        stats["disk_hits"] = self.disk_hits
+        # A memory miss served from disk is still a cache hit
+        stats["hits"] += self.disk_hits
+        stats["misses"] -= self.disk_hits
+        return stats
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+
+class SearchResultCache:
+    """
+    Cache of search results keyed by (index generation, normalized query,
+    canonical filter expression, top, options). Bumping the generation after
+    re-indexing invalidates every entry.
+    """
+
+    def __init__(
+        self,
+        maxsize: int | None = None,
+        ttl: float | None = None,
+        generation: str | None = None,
+    ):
+        """
+        Args:
+            maxsize (int): Maximum cached result lists (SEARCH_CACHE_SIZE).
+            ttl (float): Seconds a result list stays valid (SEARCH_CACHE_TTL).
+            generation (str): Initial index generation (SEARCH_INDEX_GENERATION).
+        """
+        maxsize = maxsize if maxsize is not None else int(ENV_VARIABLES.get("SEARCH_CACHE_SIZE", 512))
+        ttl = ttl if ttl is not None else float(ENV_VARIABLES.get("SEARCH_CACHE_TTL", 300))
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generation = generation or ENV_VARIABLES.get("SEARCH_INDEX_GENERATION", "0")
+
+    def key(self, semantic_query: str, filter_expression: str | None, top: int, **options) -> tuple:
+        return (
+            self.generation,
+            normalize_text(semantic_query),
+            filter_expression or "",
+            top,
+            tuple(sorted(options.items())),
+        )
+
+    def get(self, key: tuple) -> Optional[list]:
+        return self.memory.get(key)
+
+    def set(self, key: tuple, results: list) -> None:
+        # Results computed for an older generation are discarded
+        if key[0] == self.generation:
+            self.memory.set(key, results)
+
+    def invalidate(self, generation: str | None = None) -> str:
+        """
+        Drops every cached result. Call after re-indexing.
+
+        Args:
+            generation (str): New index generation. If omitted, a numeric generation is incremented.
+
+        Returns:
+            str: The new generation.
+        """
+        if generation is None:
+            generation = str(int(self.generation) + 1) if self.generation.isdigit() else f"{self.generation}+1"
+        self.generation = generation
+        self.memory.clear()
+        return generation
+
+    @property
+    def stats(self) -> dict:
+        stats = self.memory.stats
+        stats["generation"] = self.generation
+        return stats
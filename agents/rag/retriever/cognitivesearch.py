@@ -5,23 +5,49 @@ from azure.identity import EnvironmentCredential, AzureAuthorityHosts, get_beare
 from langchain_openai import AzureOpenAIEmbeddings
 from openai import AsyncAzureOpenAI
 
+from agents.rag.utils import project_search_result, resolve_search_mode
 from config.config import ENV_VARIABLES
+from tracing.metrics import observe_stage
 
 
 class CognitiveSearch:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        credential=None,
+        transport=None,
+        http_client=None,
+        token_provider=None,
+        embedding_cache=None,
+        embedding_batcher=None,
+        result_cache=None,
+    ) -> None:
+        """
+        Args:
+            credential: Credential shared with other clients. A new EnvironmentCredential is created if not provided.
+            transport: Azure core transport (e.g. a shared AioHttpTransport) for the search client.
+            http_client: httpx.AsyncClient shared by the embeddings client. It is not closed by `aclose`.
+            token_provider: Bearer token provider for Azure OpenAI.
+            embedding_cache: Cache with async `get(deployment, text)` / `set(deployment, text, vector)` (e.g. EmbeddingCache).
+            embedding_batcher: EmbeddingBatcher that coalesces concurrent embedding requests.
+            result_cache: SearchResultCache for `search` results.
+        """
 
         authority = AzureAuthorityHosts.AZURE_PUBLIC_CLOUD
-        credential = EnvironmentCredential(authority_host=authority)
+        if credential is None:
+            credential = EnvironmentCredential(authority_host=authority)
+
+        search_kwargs = {"transport": transport} if transport is not None else {}
         self.search_client = AsyncSearchClient(
             endpoint=f"https://{ENV_VARIABLES['AZURE_SEARCH_SERVICE']}.search.windows.net", 
             index_name=ENV_VARIABLES["AZURE_SEARCH_INDEX"], 
-            credential=credential
+            credential=credential,
+            **search_kwargs
         )
     
         self._embed_model = ENV_VARIABLES.get("AZURE_OPENAI_EMBEDDING", "textembedding")
 
-        token_provider = get_bearer_token_provider(
+        if token_provider is None:
+            token_provider = get_bearer_token_provider(
     EnvironmentCredential(),
     "https://cognitiveservices.azure.com/.default"
 )
@@ -30,24 +56,76 @@ class CognitiveSearch:
             azure_ad_token_provider=token_provider,
             azure_deployment=self._embed_model,
             api_version="2024-02-15-preview",
+            http_client=http_client,
+        )
+        self._owns_http_client = http_client is None
+        self.embedding_cache = embedding_cache
+        self.embedding_batcher = embedding_batcher
+        self.result_cache = result_cache
+        # Longest `content` returned per chunk; 0 keeps it whole
+        self.max_content_chars = int(
+            ENV_VARIABLES.get("SEARCH_CONTENT_MAX_CHARS", ENV_VARIABLES.get("TOOL_PASSAGE_MAX_CHARS", 1500))
         )
         self._closed = False
 
+    async def __aenter__(self):
+        return self
+
     async def __aexit__(self, exc_type, exc, tb):
         await self.aclose()
 
     async def aclose(self):
         if not self._closed:
             await self.search_client.close()
-            await self._client.close()
+            # A shared http client is closed by its owner (see RetrieverPool)
+            if self._owns_http_client:
+                await self._client.close()
             self._closed = True
 
     async def generate_embeddings(self, text):
-        response = await self._client.embeddings.create(
-            input=[text], model=self._embed_model
-        )
-        embeddings = response.data[0].embedding
+        if self.embedding_cache is not None:
+            embeddings = await self.embedding_cache.get(self._embed_model, text)
+            if embeddings is not None:
+                return embeddings
+
+        if self.embedding_batcher is not None:
+            embeddings = await self.embedding_batcher.embed(text)
+        else:
+            with observe_stage("embedding"):
+                response = await self._client.embeddings.create(
+                    input=[text], model=self._embed_model
+                )
+            embeddings = response.data[0].embedding
+
+        if self.embedding_cache is not None:
+            await self.embedding_cache.set(self._embed_model, text, embeddings)
         return embeddings
+
+    async def generate_embeddings_batch(self, texts: list) -> list:
+        """
+        Embeds several texts with a single call. Vectors are returned in the order of `texts`.
+        """
+        with observe_stage("embedding"):
+            response = await self._client.embeddings.create(
+                input=texts, model=self._embed_model
+            )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def upload_documents(self, documents: list) -> None:
+        """
+        Sube (o reemplaza) documentos en el índice, identificados por id_content.
+        Falla si algún documento no fue indexado.
+        """
+        results = await self.search_client.upload_documents(documents=documents)
+        failed = [result.key for result in results if not result.succeeded]
+        if failed:
+            raise RuntimeError(f"No se pudieron indexar {len(failed)} documentos: {failed[:5]}")
+
+    async def delete_documents(self, ids: list) -> None:
+        """
+        Elimina documentos del índice por id_content.
+        """
+        await self.search_client.delete_documents(documents=[{"id_content": id_content} for id_content in ids])
     
 
     async def search(
@@ -56,49 +134,105 @@ class CognitiveSearch:
         top: int = 5,
         use_hybrid: bool = True,
         filters: dict | None = None,
+        select: list | None = None,
+        max_content_chars: int | None = None,
+        mode: str | None = None,
+        semantic_rerank: bool | None = None,
         **kwargs: dict | None,
     ):
+        """
+        Busca `top` documentos únicos (por id_content).
 
-        vector = await self.generate_embeddings(semantic_query)
+        Args:
+            use_hybrid (bool): Con False, y sin `mode`, la búsqueda es solo vectorial.
+            mode (str): "vector" (embedding), "keyword" (texto completo, sin llamada de embedding)
+                o "hybrid" (ambas, fusionadas por el servicio). Por defecto SEARCH_MODE.
+            semantic_rerank (bool): Reordena con el ranker semántico del servicio
+                (SEARCH_SEMANTIC_CONFIG). Por defecto SEARCH_SEMANTIC_RERANK.
+            select (list): Campos a devolver, pedidos al servicio (los vectores no se transfieren).
+                Por defecto, todos los campos recuperables.
+            max_content_chars (int): Largo máximo de `content` por documento. Por defecto
+                SEARCH_CONTENT_MAX_CHARS (0: sin límite).
+        """
+        if max_content_chars is None:
+            max_content_chars = self.max_content_chars
+        mode, semantic_rerank = resolve_search_mode(mode, use_hybrid, semantic_rerank)
+        if select:
+            # id_content is needed to deduplicate
+            select = sorted(set(select) | {"id_content"})
 
-        vector_query = VectorizedQuery(
-            vector=vector,
-            k_nearest_neighbors=top,
-            fields=ENV_VARIABLES["MAIN_VECTOR_FIELD"],
-        )
+        if self.result_cache is not None:
+            filter_expression = self._build_filters(filters) if filters else None
+            cache_key = self.result_cache.key(
+                semantic_query, filter_expression, top,
+                mode=mode, semantic_rerank=semantic_rerank, select=tuple(select or ()), max_content_chars=max_content_chars,
+            )
+            cached_docs = self.result_cache.get(cache_key)
+            if cached_docs is not None:
+                return list(cached_docs)
+
+        vector_query = None
+        if mode != "keyword":
+            vector = await self.generate_embeddings(semantic_query)
+            vector_query = VectorizedQuery(
+                vector=vector,
+                k_nearest_neighbors=top,
+                fields=ENV_VARIABLES["MAIN_VECTOR_FIELD"],
+            )
+
+        with observe_stage("search"):
+            result_docs = await self._search(
+                semantic_query, vector_query, top, mode != "vector", filters,
+                select=select, max_content_chars=max_content_chars, semantic_rerank=semantic_rerank, **kwargs
+            )
 
-        return await self._search(semantic_query, vector_query, top, use_hybrid, filters, **kwargs)
+        if self.result_cache is not None:
+            self.result_cache.set(cache_key, result_docs)
+            result_docs = list(result_docs)
+        return result_docs
 
         
     async def _search(
         self,
         semantic_query: str,
-        vector_query: VectorizedQuery,
+        vector_query: VectorizedQuery | None,
         top: int = 5,
-        use_hybrid: bool = True,
+        use_text: bool = True,
         filters: str | None = None,
+        select: list | None = None,
+        max_content_chars: int | None = None,
+        semantic_rerank: bool = False,
         **kwargs: dict | None,
     ):
 
-
+        search_kwargs = {}
         if filters:
-            filters = self._build_filters(filters)
+            search_kwargs["filter"] = self._build_filters(filters)
+        if select:
+            search_kwargs["select"] = select
+        if vector_query is not None:
+            search_kwargs["vector_queries"] = [vector_query]
+        if semantic_rerank:
+            search_kwargs["query_type"] = "semantic"
+            search_kwargs["semantic_configuration_name"] = ENV_VARIABLES.get("SEARCH_SEMANTIC_CONFIG", "default")
 
-            results = await self.search_client.search(
-                search_text=semantic_query,
-                vector_queries=[vector_query],
-                filter=filters,
-                top=top,
-            )
-        else:
-            results = await self.search_client.search(
-                search_text=semantic_query,
-                vector_queries=[vector_query],
-                top=top,
-            )
+        results = await self.search_client.search(
+            # Without text only the vector query runs
+            search_text=semantic_query if use_text else None,
+            top=top,
+            **search_kwargs,
+        )
 
-        result_docs = [record async for record in results]
-        result_docs = self.delete_duplicates(result_docs)
+        # Deduplicated while the results are read; stops once `top` unique documents arrived
+        seen = set()
+        result_docs = []
+        async for record in results:
+            if record["id_content"] in seen:
+                continue
+            seen.add(record["id_content"])
+            result_docs.append(project_search_result(record, max_content_chars=max_content_chars))
+            if len(result_docs) >= top:
+                break
 
         return result_docs
 
@@ -114,15 +248,18 @@ class CognitiveSearch:
 
         Resultado:
         "category eq 'health' and (region eq 'north' or region eq 'south')"
+
+        Los campos y valores se ordenan, de modo que filtros equivalentes producen
+        la misma expresión (se usa como llave de caché).
         """
         filter_expressions = []
 
-        for key, value in filters.items():
+        for key, value in sorted(filters.items()):
             if isinstance(value, list):
                 if not value:
                     continue  # evitar listas vacías
                 # Unir cada valor con "or" para ese campo
-                expressions = [f"{key} eq '{v}'" for v in value]
+                expressions = [f"{key} eq '{v}'" for v in sorted(set(value))]
                 joined = " or ".join(expressions)
                 filter_expressions.append(f"({joined})")
             elif isinstance(value, str):
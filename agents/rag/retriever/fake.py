@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+from agents.rag.utils import project_search_result, resolve_search_mode
+from config.config import DATA_DIR, ENV_VARIABLES
+from tracing.metrics import observe_stage
+
+EMBEDDING_DIM = 256
+
+
+def _tokens(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """
+    Deterministic embedding: hashed bag of words, L2-normalized.
+    Texts sharing words have positive cosine similarity.
+    """
+    vector = [0.0] * dim
+    for token in _tokens(text):
+        digest = hashlib.md5(token.encode()).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class LocalCorpus:
+    """
+    Documents of the fake search index, loaded from a JSONL file with the index
+    fields (id_content, id_document, domain, source, content).
+    """
+
+    def __init__(self, documents: List[Dict] | None = None):
+        self.documents: List[Dict] = []
+        self._vectors: List[List[float]] = []
+        self._terms: List[Counter] = []
+        self.upload_documents(documents or [])
+
+    @classmethod
+    def load(cls, path: str | Path | None = None) -> "LocalCorpus":
+        path = Path(path or ENV_VARIABLES.get("LOCAL_CORPUS_PATH") or DATA_DIR / "local_corpus.jsonl")
+        with open(path, "r", encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    def save(self, path: str | Path) -> None:
+        """Writes the documents (without vectors) as JSONL, the format read by `load`."""
+        with open(path, "w", encoding="utf-8") as f:
+            for doc in self.documents:
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+
+    def upload_documents(self, documents: List[Dict]) -> None:
+        """Adds or replaces documents by id_content."""
+        vector_field = ENV_VARIABLES.get("MAIN_VECTOR_FIELD", "embedding")
+        positions = {doc["id_content"]: i for i, doc in enumerate(self.documents)}
+        for doc in documents:
+            vector = doc.get(vector_field) or fake_embedding(doc["content"])
+            doc = {key: value for key, value in doc.items() if key != vector_field}
+            terms = Counter(_tokens(doc["content"]))
+            if doc["id_content"] in positions:
+                i = positions[doc["id_content"]]
+                self.documents[i], self._vectors[i], self._terms[i] = doc, vector, terms
+            else:
+                positions[doc["id_content"]] = len(self.documents)
+                self.documents.append(doc)
+                self._vectors.append(vector)
+                self._terms.append(terms)
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """Removes documents by id_content."""
+        ids = set(ids)
+        kept = [i for i, doc in enumerate(self.documents) if doc["id_content"] not in ids]
+        self.documents = [self.documents[i] for i in kept]
+        self._vectors = [self._vectors[i] for i in kept]
+        self._terms = [self._terms[i] for i in kept]
+
+    def search(self, query: str, vector: List[float] | None, top: int, filters: Dict | None = None, mode: str = "hybrid") -> List[Dict]:
+        """Keyword term overlap, vector dot product, or their average for "hybrid"."""
+        query_terms = set(_tokens(query))
+        scored = []
+        for doc, doc_vector, terms in zip(self.documents, self._vectors, self._terms):
+            if filters and not all(
+                doc.get(key) in (value if isinstance(value, list) else [value]) for key, value in filters.items()
+            ):
+                continue
+            keyword = sum(1 for term in query_terms if term in terms) / (len(query_terms) or 1)
+            if mode == "keyword":
+                if keyword:
+                    scored.append((keyword, doc))
+                continue
+            semantic = sum(a * b for a, b in zip(vector, doc_vector))
+            scored.append((semantic if mode == "vector" else 0.5 * keyword + 0.5 * semantic, doc))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [{**doc, "@search.score": score, "@search.reranker_score": None} for score, doc in scored[:top]]
+
+
+class FakeCognitiveSearch:
+    """
+    Offline stand-in for CognitiveSearch: same `search` contract, served from a
+    LocalCorpus with deterministic embeddings and an optional simulated latency.
+    """
+
+    def __init__(self, corpus: LocalCorpus | None = None, latency: float | None = None) -> None:
+        """
+        Args:
+            corpus (LocalCorpus): Documents to search. Defaults to LOCAL_CORPUS_PATH.
+            latency (float): Seconds added to each search call (FAKE_SEARCH_LATENCY).
+        """
+        self.corpus = corpus or LocalCorpus.load()
+        self.latency = latency if latency is not None else float(ENV_VARIABLES.get("FAKE_SEARCH_LATENCY", 0))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        pass
+
+    async def generate_embeddings(self, text):
+        return fake_embedding(text)
+
+    async def generate_embeddings_batch(self, texts: list) -> list:
+        return [fake_embedding(text) for text in texts]
+
+    async def search(
+        self,
+        semantic_query: str,
+        top: int = 5,
+        use_hybrid: bool = True,
+        filters: dict | None = None,
+        select: list | None = None,
+        max_content_chars: int | None = None,
+        mode: str | None = None,
+        semantic_rerank: bool | None = None,
+        **kwargs: dict | None,
+    ):
+        # No semantic ranker offline: semantic_rerank is accepted and ignored
+        mode, _ = resolve_search_mode(mode, use_hybrid, semantic_rerank)
+        vector = await self.generate_embeddings(semantic_query) if mode != "keyword" else None
+        with observe_stage("search"):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            results = self.corpus.search(semantic_query, vector, top, filters, mode)
+        return [project_search_result(record, select, max_content_chars) for record in results]
+
+    async def upload_documents(self, documents: List[Dict]) -> None:
+        self.corpus.upload_documents(documents)
+
+    async def delete_documents(self, ids: List[str]) -> None:
+        self.corpus.delete_documents(ids)
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from agents.rag.utils import content_hash
+from agents.scheduler import AdaptiveScheduler
+from config.config import ENV_VARIABLES
+
+logger = logging.getLogger(__name__)
+
+# File name prefix (before the first "-") -> index domain
+DOMAIN_BY_PREFIX = {
+    "garantias": "garantias",
+    "manual_de_usuario": "manuales",
+}
+
+
+def chunk_text(text: str, size: int, overlap: int) -> List[str]:
+    """Splits `text` in windows of `size` characters, each one sharing `overlap` characters with the previous."""
+    step = max(size - overlap, 1)
+    chunks = []
+    for start in range(0, len(text), step):
+        chunks.append(text[start:start + size])
+        if start + size >= len(text):
+            break
+    return chunks
+
+
+def document_id(source: str) -> str:
+    """id_document of a source file; the prefix of the id_content of its chunks."""
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+
+def parse_pdf(path: str, chunk_size: int, chunk_overlap: int) -> Dict:
+    """
+    Extracts and chunks the text of one PDF. Runs in a worker process.
+
+    Returns:
+        dict: source, pages and chunks with the index fields (id_content, id_document, domain, source, content).
+    """
+    from pypdf import PdfReader
+
+    path = Path(path)
+    reader = PdfReader(path)
+    text = re.sub(r"\s+", " ", " ".join(page.extract_text() or "" for page in reader.pages)).strip()
+
+    source = path.name
+    id_document = document_id(source)
+    prefix = path.stem.split("-")[0]
+    domain = DOMAIN_BY_PREFIX.get(prefix, prefix)
+    chunks = [
+        {
+            "id_content": f"{id_document}-{i}",
+            "id_document": id_document,
+            "domain": domain,
+            "source": source,
+            "content": content,
+        }
+        for i, content in enumerate(chunk_text(text, chunk_size, chunk_overlap))
+    ]
+    return {"source": source, "pages": len(reader.pages), "chunks": chunks}
+
+
+class IngestionManifest:
+    """
+    Content hash of every chunk in the index, with its source, stored as JSON.
+    A chunk is re-embedded only when its hash changes.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_current(self, id_content: str, chunk_hash: str) -> bool:
+        entry = self.entries.get(id_content)
+        return entry is not None and entry["hash"] == chunk_hash
+
+    def ids_of(self, sources: set) -> set:
+        return {id_content for id_content, entry in self.entries.items() if entry["source"] in sources}
+
+    def ids_of_documents(self, id_documents: set) -> set:
+        return {id_content for id_content in self.entries if id_content.rsplit("-", 1)[0] in id_documents}
+
+    @property
+    def sources(self) -> set:
+        return {entry["source"] for entry in self.entries.values()}
+
+    def record(self, chunks: List[Dict], hashes: Dict[str, str]) -> None:
+        for chunk in chunks:
+            self.entries[chunk["id_content"]] = {"hash": hashes[chunk["id_content"]], "source": chunk["source"]}
+
+    def remove(self, ids: set) -> None:
+        for id_content in ids:
+            self.entries.pop(id_content, None)
+
+    @property
+    def generation(self) -> str:
+        """Version of the index content, usable as SEARCH_INDEX_GENERATION."""
+        return content_hash(sorted(entry["hash"] for entry in self.entries.values()))
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class IngestionPipeline:
+    """
+    Loads PDFs into the search index:
+
+    1. parse: PDFs are extracted and chunked in a process pool;
+    2. diff: chunks whose content hash is in the manifest are skipped, chunks of a
+       re-parsed source that no longer exist are deleted;
+    3. embed: new or changed chunks are embedded in batches through an AdaptiveScheduler
+       (rate limits, AIMD concurrency, retries);
+    4. upload: embedded chunks are uploaded in batches, several at a time, while the
+       remaining batches are still being embedded.
+
+    The manifest is saved after every uploaded batch, so an interrupted run resumes
+    where it stopped. `search_client` is a CognitiveSearch or FakeCognitiveSearch.
+    """
+
+    def __init__(
+        self,
+        search_client,
+        manifest: IngestionManifest,
+        chunk_size: int | None = None,
+        chunk_overlap: int | None = None,
+        processes: int | None = None,
+        embedding_batch_size: int | None = None,
+        upload_batch_size: int | None = None,
+        upload_concurrency: int | None = None,
+        scheduler: AdaptiveScheduler | None = None,
+    ):
+        """
+        Args:
+            search_client: Client with `generate_embeddings_batch`, `upload_documents` and `delete_documents`.
+            manifest (IngestionManifest): Hashes of the chunks already in the index.
+            chunk_size (int): Characters per chunk (INGESTION_CHUNK_SIZE).
+            chunk_overlap (int): Characters shared by consecutive chunks (INGESTION_CHUNK_OVERLAP).
+            processes (int): Parsing processes (INGESTION_PROCESSES, default one per CPU).
+            embedding_batch_size (int): Texts per embedding call (INGESTION_EMBEDDING_BATCH_SIZE).
+            upload_batch_size (int): Documents per upload call (INGESTION_UPLOAD_BATCH_SIZE).
+            upload_concurrency (int): Upload calls running at the same time (INGESTION_UPLOAD_CONCURRENCY).
+            scheduler (AdaptiveScheduler): Scheduler of the embedding calls. Defaults to one limited by
+                INGESTION_EMBEDDING_RPM / INGESTION_EMBEDDING_TPM / INGESTION_EMBEDDING_CONCURRENCY.
+        """
+        self.search_client = search_client
+        self.manifest = manifest
+        self.chunk_size = chunk_size or int(ENV_VARIABLES.get("INGESTION_CHUNK_SIZE", 800))
+        self.chunk_overlap = chunk_overlap if chunk_overlap is not None else int(ENV_VARIABLES.get("INGESTION_CHUNK_OVERLAP", 100))
+        self.processes = processes or int(ENV_VARIABLES.get("INGESTION_PROCESSES", 0)) or os.cpu_count() or 1
+        self.embedding_batch_size = embedding_batch_size or int(ENV_VARIABLES.get("INGESTION_EMBEDDING_BATCH_SIZE", 16))
+        self.upload_batch_size = upload_batch_size or int(ENV_VARIABLES.get("INGESTION_UPLOAD_BATCH_SIZE", 100))
+        self.upload_concurrency = upload_concurrency or int(ENV_VARIABLES.get("INGESTION_UPLOAD_CONCURRENCY", 4))
+        self.scheduler = scheduler or AdaptiveScheduler(
+            rpm=float(ENV_VARIABLES.get("INGESTION_EMBEDDING_RPM", 0)),
+            tpm=float(ENV_VARIABLES.get("INGESTION_EMBEDDING_TPM", 0)),
+            max_concurrency=int(ENV_VARIABLES.get("INGESTION_EMBEDDING_CONCURRENCY", 8)),
+        )
+        self.vector_field = ENV_VARIABLES.get("MAIN_VECTOR_FIELD", "embedding")
+        # Part of the chunk hash: a new embedding deployment re-embeds everything
+        self.embedding_model = getattr(search_client, "_embed_model", type(search_client).__name__)
+
+    def chunk_hash(self, chunk: Dict) -> str:
+        return content_hash({**chunk, "embedding_model": self.embedding_model})
+
+    async def parse(self, paths: List[Path]) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=min(self.processes, len(paths))) as executor:
+            return await asyncio.gather(*[
+                loop.run_in_executor(executor, parse_pdf, str(path), self.chunk_size, self.chunk_overlap)
+                for path in paths
+            ])
+
+    async def run(self, paths: List[str | Path], force: bool = False) -> Dict:
+        """
+        Ingests the PDFs in `paths`, the whole corpus: chunks of sources in the
+        manifest that are no longer in `paths` are deleted from the index.
+
+        Args:
+            paths (list): PDF files.
+            force (bool): Re-embed and upload every chunk, even unchanged ones.
+
+        Returns:
+            dict: Counts, time per stage, pages/sec and chunks/sec, and the new index generation.
+        """
+        paths = [Path(path) for path in paths]
+        report = Counter(files=len(paths), chunks_uploaded=0, chunks_failed=0, chunks_deleted=0)
+        start = time.perf_counter()
+        if not paths and not self.manifest.entries:
+            return dict(report)
+
+        documents = await self.parse(paths) if paths else []
+        report["parse_seconds"] = time.perf_counter() - start
+        chunks = [chunk for document in documents for chunk in document["chunks"]]
+        report["pages"] = sum(document["pages"] for document in documents)
+        report["chunks"] = len(chunks)
+
+        hashes = {chunk["id_content"]: self.chunk_hash(chunk) for chunk in chunks}
+        pending = [
+            chunk for chunk in chunks
+            if force or not self.manifest.is_current(chunk["id_content"], hashes[chunk["id_content"]])
+        ]
+        report["chunks_unchanged"] = len(chunks) - len(pending)
+        parsed_sources = {document["source"] for document in documents}
+        # Chunks a re-parsed source no longer has, and every chunk of the sources that are gone
+        removed = self.manifest.ids_of(parsed_sources) - set(hashes)
+        deleted_sources = self.manifest.sources - parsed_sources
+        removed |= self.manifest.ids_of_documents({document_id(source) for source in deleted_sources})
+        report["files_deleted"] = len(deleted_sources)
+
+        embed_start = time.perf_counter()
+        upload_semaphore = asyncio.Semaphore(self.upload_concurrency)
+        upload_tasks: List[asyncio.Task] = []
+        buffer: List[Dict] = []
+
+        async def upload(batch: List[Dict]) -> None:
+            async with upload_semaphore:
+                try:
+                    await self.search_client.upload_documents(batch)
+                except Exception as e:
+                    logger.error(f"Upload of {len(batch)} chunks failed: {e}")
+                    report["chunks_failed"] += len(batch)
+                    return
+            self.manifest.record(batch, hashes)
+            self.manifest.save()
+            report["chunks_uploaded"] += len(batch)
+
+        def flush(force: bool = False) -> None:
+            while buffer and (force or len(buffer) >= self.upload_batch_size):
+                batch = buffer[:self.upload_batch_size]
+                del buffer[:self.upload_batch_size]
+                upload_tasks.append(asyncio.create_task(upload(batch)))
+
+        async def embed(batch: List[Dict]) -> None:
+            vectors = await self.search_client.generate_embeddings_batch([chunk["content"] for chunk in batch])
+            buffer.extend({**chunk, self.vector_field: vector} for chunk, vector in zip(batch, vectors))
+            flush()
+
+        batches = [pending[i:i + self.embedding_batch_size] for i in range(0, len(pending), self.embedding_batch_size)]
+        results = await self.scheduler.run(
+            batches,
+            embed,
+            cost=lambda batch: (1, sum(len(chunk["content"]) for chunk in batch) / 4),
+        )
+        embedding_failed = 0
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Embedding of {len(batch)} chunks failed: {result}")
+                embedding_failed += len(batch)
+        report["chunks_failed"] += embedding_failed
+        flush(force=True)
+        await asyncio.gather(*upload_tasks)
+        # Counted once every upload finished (uploads add to chunks_failed too)
+        report["chunks_embedded"] = len(pending) - embedding_failed
+        report["embed_upload_seconds"] = time.perf_counter() - embed_start
+
+        if removed:
+            await self.search_client.delete_documents(sorted(removed))
+            self.manifest.remove(removed)
+            self.manifest.save()
+            report["chunks_deleted"] = len(removed)
+
+        report["total_seconds"] = time.perf_counter() - start
+        report["pages_per_second"] = report["pages"] / report["total_seconds"]
+        report["chunks_per_second"] = report["chunks"] / report["total_seconds"]
+        report["generation"] = self.manifest.generation
+        logger.info(
+            f"Ingestion: {report['pages']} pages, {report['chunks']} chunks "
+            f"({report['chunks_unchanged']} unchanged, {report['chunks_uploaded']} uploaded, "
+            f"{report['chunks_failed']} failed) in {report['total_seconds']:.2f}s, "
+            f"{report['pages_per_second']:.1f} pages/s, {report['chunks_per_second']:.1f} chunks/s"
+        )
+        return dict(report)
@@ -0,0 +1,344 @@
+import asyncio
+import json
+import math
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Hashable, List
+
+import numpy as np
+
+from agents.rag.retriever.fake import EMBEDDING_DIM, LocalCorpus, _tokens, fake_embedding
+from agents.rag.utils import project_search_result, resolve_search_mode
+from config.config import DATA_DIR, ENV_VARIABLES
+from tracing.metrics import observe_stage
+
+# Constant of reciprocal rank fusion, the one used by Azure AI Search hybrid queries
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = RRF_K) -> List[tuple]:
+    """
+    Fuses several rankings of ids (rows, id_content...): score = sum of 1 / (k + rank)
+    over the rankings that contain the id. Returns (id, score) pairs sorted by score.
+    """
+    scores: Dict[Hashable, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest finite scores, best first."""
+    valid = np.flatnonzero(np.isfinite(scores))
+    if len(valid) > k:
+        valid = valid[np.argpartition(scores[valid], -k)[-k:]]
+    return valid[np.argsort(scores[valid])[::-1]]
+
+
+class LocalVectorIndex:
+    """
+    In-process search index stored in a directory:
+        - vectors.f32: L2-normalized float32 embedding matrix, memory-mapped read-only;
+        - documents.jsonl: the index fields of every row (id_content, id_document, domain, source, content);
+        - index.json: row count, dimension and embedding model.
+    Keyword search is BM25 over an inverted index built at load time, and every
+    domain has a precomputed row mask. Uploaded rows are buffered and the matrix and
+    the postings are rebuilt once, by `apply_pending`, before the next search, delete or save.
+    """
+
+    def __init__(self, documents: List[Dict], vectors: np.ndarray, embedding_model: str, path: Path | None = None):
+        self.documents = documents
+        self.vectors = vectors
+        self.embedding_model = embedding_model
+        self.path = path
+        self.k1 = float(ENV_VARIABLES.get("LOCAL_INDEX_BM25_K1", 1.2))
+        self.b = float(ENV_VARIABLES.get("LOCAL_INDEX_BM25_B", 0.75))
+        # Uploads not yet in the matrix: new rows in order, and replaced rows of the matrix
+        self._appended: List[np.ndarray] = []
+        self._replaced: Dict[int, np.ndarray] = {}
+        self._stale = False
+        self._refresh()
+
+    @staticmethod
+    def default_path() -> Path:
+        return Path(ENV_VARIABLES.get("LOCAL_INDEX_DIR") or DATA_DIR / "local_index")
+
+    @classmethod
+    def load(cls, path: str | Path | None = None, embedding_model: str | None = None) -> "LocalVectorIndex":
+        """
+        Args:
+            path (Path): Index directory. Defaults to LOCAL_INDEX_DIR.
+            embedding_model (str): Embedding model of the queries; the index must have been
+                built with the same one ("fake" for the deterministic fake embeddings).
+
+        Raises:
+            ValueError: The index was built with another embedding model or dimension.
+        """
+        path = Path(path or cls.default_path())
+        with open(path / "index.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if embedding_model is not None and meta["count"]:
+            cls.check_embeddings(meta["embedding_model"], meta["dim"], embedding_model, path)
+        with open(path / "documents.jsonl", "r", encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f if line.strip()]
+        if meta["count"]:
+            vectors = np.memmap(path / "vectors.f32", dtype=np.float32, mode="r", shape=(meta["count"], meta["dim"]))
+        else:
+            vectors = np.zeros((0, meta["dim"]), dtype=np.float32)
+        return cls(documents, vectors, meta["embedding_model"], path)
+
+    @staticmethod
+    def check_embeddings(index_model: str, dim: int, embedding_model: str, path: Path | None = None) -> None:
+        """Fails when vectors of `embedding_model` cannot be compared with the index ones."""
+        if index_model != embedding_model:
+            raise ValueError(
+                f"Local index {path or ''} was built with the embedding model {index_model!r}, "
+                f"but the queries use {embedding_model!r}: rebuild it with scripts/ingest_corpus.py --backend local"
+            )
+        if embedding_model == "fake" and dim != EMBEDDING_DIM:
+            raise ValueError(f"Local index {path or ''} has {dim}-dimensional vectors, the fake embeddings have {EMBEDDING_DIM}")
+
+    @classmethod
+    def empty(cls, path: str | Path | None = None) -> "LocalVectorIndex":
+        return cls([], np.zeros((0, 0), dtype=np.float32), "fake", Path(path) if path else None)
+
+    @classmethod
+    def from_corpus(cls, corpus: LocalCorpus) -> "LocalVectorIndex":
+        """In-memory index of a LocalCorpus with the deterministic fake embeddings."""
+        vectors = np.array([fake_embedding(doc["content"]) for doc in corpus.documents], dtype=np.float32)
+        return cls(list(corpus.documents), vectors.reshape(len(corpus.documents), EMBEDDING_DIM), "fake")
+
+    def save(self, path: str | Path | None = None) -> None:
+        path = Path(path or self.path or self.default_path())
+        path.mkdir(parents=True, exist_ok=True)
+        self.apply_pending()
+        vectors = np.ascontiguousarray(self.vectors, dtype=np.float32)
+        # Written to new files first: the current ones may be memory-mapped
+        vectors.tofile(path / "vectors.f32.tmp")
+        with open(path / "documents.jsonl.tmp", "w", encoding="utf-8") as f:
+            for doc in self.documents:
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        (path / "vectors.f32.tmp").replace(path / "vectors.f32")
+        (path / "documents.jsonl.tmp").replace(path / "documents.jsonl")
+        with open(path / "index.json", "w", encoding="utf-8") as f:
+            json.dump({"count": len(self.documents), "dim": vectors.shape[1], "embedding_model": self.embedding_model}, f)
+        self.path = path
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _refresh(self) -> None:
+        """Rebuilds the BM25 postings, the domain masks and the id positions."""
+        self.positions = {doc["id_content"]: row for row, doc in enumerate(self.documents)}
+        n = len(self.documents)
+
+        postings: Dict[str, List[tuple]] = defaultdict(list)
+        lengths = np.zeros(n, dtype=np.float32)
+        for row, doc in enumerate(self.documents):
+            terms = Counter(_tokens(doc["content"]))
+            lengths[row] = sum(terms.values())
+            for term, tf in terms.items():
+                postings[term].append((row, tf))
+        self.avg_length = float(lengths.mean()) if n else 0.0
+        self._length_norm = self.k1 * (1 - self.b + self.b * lengths / (self.avg_length or 1))
+        self.postings = {
+            term: (
+                np.array([row for row, _ in rows], dtype=np.int32),
+                np.array([tf for _, tf in rows], dtype=np.float32),
+                math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5)),
+            )
+            for term, rows in postings.items()
+        }
+
+        domains = np.array([doc.get("domain") for doc in self.documents], dtype=object)
+        self.domain_masks = {domain: domains == domain for domain in set(domains.tolist())}
+
+    def upload_documents(self, documents: List[Dict], vectors: List[List[float]]) -> None:
+        """
+        Adds or replaces rows by id_content. Vectors are normalized on the way in and
+        buffered: an ingestion of many batches builds the matrix and the postings once.
+        """
+        new_vectors = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1))
+        rows_in_matrix = len(self.vectors)
+        for doc, vector in zip(documents, new_vectors):
+            row = self.positions.get(doc["id_content"])
+            if row is None:
+                self.positions[doc["id_content"]] = len(self.documents)
+                self.documents.append(doc)
+                self._appended.append(vector)
+            else:
+                self.documents[row] = doc
+                if row < rows_in_matrix:
+                    self._replaced[row] = vector
+                else:
+                    self._appended[row - rows_in_matrix] = vector
+        self._stale = True
+
+    def apply_pending(self) -> None:
+        """Moves the buffered uploads into the matrix and rebuilds the postings, if there are any."""
+        if not self._stale:
+            return
+        if self._appended or self._replaced:
+            dim = len(self._appended[0]) if self._appended else self.vectors.shape[1]
+            matrix = np.array(self.vectors, dtype=np.float32) if len(self.vectors) else np.zeros((0, dim), dtype=np.float32)
+            for row, vector in self._replaced.items():
+                matrix[row] = vector
+            if self._appended:
+                matrix = np.vstack([matrix, np.stack(self._appended)])
+            self.vectors = matrix
+            self._appended, self._replaced = [], {}
+        self._refresh()
+        self._stale = False
+
+    def delete_documents(self, ids: List[str]) -> None:
+        self.apply_pending()
+        ids = set(ids)
+        kept = [row for row, doc in enumerate(self.documents) if doc["id_content"] not in ids]
+        self.documents = [self.documents[row] for row in kept]
+        self.vectors = np.array(self.vectors, dtype=np.float32)[kept]
+        self._refresh()
+
+    def mask(self, filters: Dict | None) -> np.ndarray | None:
+        """Rows allowed by `filters` ({field: value or [values]}); None when there is no filter."""
+        if not filters:
+            return None
+        mask = np.ones(len(self.documents), dtype=bool)
+        for key, value in filters.items():
+            values = value if isinstance(value, list) else [value]
+            if key == "domain":
+                field_mask = np.zeros(len(self.documents), dtype=bool)
+                for domain in values:
+                    if domain in self.domain_masks:
+                        field_mask |= self.domain_masks[domain]
+            else:
+                field_mask = np.array([doc.get(key) in values for doc in self.documents], dtype=bool)
+            mask &= field_mask
+        return mask
+
+    def vector_scores(self, vector: List[float]) -> np.ndarray:
+        """Cosine similarity of every row."""
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        if query.shape[-1] != self.vectors.shape[1]:
+            raise ValueError(
+                f"Query vector has {query.shape[-1]} dimensions, the local index {self.vectors.shape[1]} "
+                f"({self.embedding_model!r}): rebuild it with scripts/ingest_corpus.py --backend local"
+            )
+        return self.vectors @ query
+
+    def keyword_scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row; -inf for rows without any query term."""
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        matched = np.zeros(len(self.documents), dtype=bool)
+        for term in set(_tokens(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf, idf = posting
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self._length_norm[rows])
+            matched[rows] = True
+        return np.where(matched, scores, -np.inf)
+
+
+class LocalVectorSearch:
+    """
+    Drop-in replacement of CognitiveSearch backed by a LocalVectorIndex: same
+    `search(semantic_query, top, use_hybrid, filters, mode)` contract, no network for the search.
+    Hybrid queries take the best `k_nearest` rows of the vector and keyword rankings and
+    fuse them with reciprocal rank fusion; "vector" (or `use_hybrid=False`) ranks by cosine
+    similarity and "keyword" by BM25, without embedding the query.
+    Query vectors come from `embedder` (a CognitiveSearch sharing the pool embedding
+    cache) or, without one, from the deterministic fake embeddings.
+    """
+
+    def __init__(self, index: LocalVectorIndex, embedder=None, k_nearest: int | None = None):
+        """
+        Args:
+            index (LocalVectorIndex): Index to search.
+            embedder: Object with async `generate_embeddings` / `generate_embeddings_batch`. Defaults to fake embeddings.
+            k_nearest (int): Rows taken from each ranking before fusion (LOCAL_INDEX_K_NEAREST).
+        """
+        self.index = index
+        self.embedder = embedder
+        self.k_nearest = k_nearest or int(ENV_VARIABLES.get("LOCAL_INDEX_K_NEAREST", 50))
+        self._embed_model = getattr(embedder, "_embed_model", "fake")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        if self.embedder is not None:
+            await self.embedder.aclose()
+
+    async def generate_embeddings(self, text):
+        if self.embedder is None:
+            return fake_embedding(text)
+        return await self.embedder.generate_embeddings(text)
+
+    async def generate_embeddings_batch(self, texts: list) -> list:
+        if self.embedder is None:
+            return [fake_embedding(text) for text in texts]
+        return await self.embedder.generate_embeddings_batch(texts)
+
+    async def search(
+        self,
+        semantic_query: str,
+        top: int = 5,
+        use_hybrid: bool = True,
+        filters: dict | None = None,
+        select: list | None = None,
+        max_content_chars: int | None = None,
+        mode: str | None = None,
+        semantic_rerank: bool | None = None,
+        **kwargs: dict | None,
+    ):
+        # No semantic ranker in process: semantic_rerank is accepted and ignored
+        mode, _ = resolve_search_mode(mode, use_hybrid, semantic_rerank)
+        vector = await self.generate_embeddings(semantic_query) if mode != "keyword" else None
+        self.index.apply_pending()
+        with observe_stage("search"):
+            # NumPy scoring off the event loop: tens of milliseconds on large indexes
+            results = await asyncio.to_thread(self._search, semantic_query, vector, top, mode, filters)
+        return [project_search_result(record, select, max_content_chars) for record in results]
+
+    def _search(self, semantic_query: str, vector: List[float] | None, top: int, mode: str, filters: dict | None) -> List[Dict]:
+        index = self.index
+        if not index.documents:
+            return []
+        mask = index.mask(filters)
+        k = max(top, self.k_nearest)
+
+        rankings = {}
+        if mode != "keyword":
+            rankings["vector"] = index.vector_scores(vector)
+        if mode != "vector":
+            rankings["keyword"] = index.keyword_scores(semantic_query)
+        if mask is not None:
+            rankings = {name: np.where(mask, scores, -np.inf) for name, scores in rankings.items()}
+
+        if mode == "hybrid":
+            ranked = reciprocal_rank_fusion([_top_k(scores, k).tolist() for scores in rankings.values()])[:top]
+        else:
+            scores = rankings[mode]
+            ranked = [(int(row), float(scores[row])) for row in _top_k(scores, top)]
+
+        return [
+            {**index.documents[row], "@search.score": score, "@search.reranker_score": None}
+            for row, score in ranked
+        ]
+
+    async def upload_documents(self, documents: List[Dict]) -> None:
+        vector_field = ENV_VARIABLES.get("MAIN_VECTOR_FIELD", "embedding")
+        if len(self.index.vectors):
+            self.index.check_embeddings(self.index.embedding_model, self.index.vectors.shape[1], self._embed_model, self.index.path)
+        vectors = [doc.get(vector_field) or await self.generate_embeddings(doc["content"]) for doc in documents]
+        self.index.embedding_model = self._embed_model
+        self.index.upload_documents([{key: value for key, value in doc.items() if key != vector_field} for doc in documents], vectors)
+
+    async def delete_documents(self, ids: List[str]) -> None:
+        self.index.delete_documents(ids)
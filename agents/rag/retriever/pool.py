@@ -0,0 +1,258 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity import EnvironmentCredential, AzureAuthorityHosts
+from openai import DefaultAsyncHttpxClient
+import httpx
+
+from agents.rag.retriever.batching import EmbeddingBatcher
+from agents.rag.retriever.cache import EmbeddingCache, SearchResultCache
+from agents.rag.retriever.cognitivesearch import CognitiveSearch
+from agents.rag.retriever.fake import FakeCognitiveSearch, LocalCorpus
+from agents.rag.retriever.local import LocalVectorIndex, LocalVectorSearch
+from config.config import ENV_VARIABLES, RAG_BACKEND
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+
+class CachedTokenProvider:
+    """
+    Bearer token provider that reuses the last token until shortly before it expires,
+    so concurrent embedding calls do not hit the credential on every request.
+    """
+
+    def __init__(self, credential, scope: str, refresh_margin: int = 300):
+        self._credential = credential
+        self._scope = scope
+        self._refresh_margin = refresh_margin
+        self._token = None
+        self._lock = threading.Lock()
+
+    def _expired(self) -> bool:
+        return self._token is None or self._token.expires_on - self._refresh_margin <= time.time()
+
+    def __call__(self) -> str:
+        if self._expired():
+            with self._lock:
+                if self._expired():
+                    self._token = self._credential.get_token(self._scope)
+        return self._token.token
+
+
+class RetrieverPool:
+    """
+    Process-wide pool of CognitiveSearch clients.
+    All members share one credential (and its token cache), one keep-alive aiohttp
+    session for Azure AI Search, one httpx client for Azure OpenAI embeddings, one
+    embedding cache, one embedding batcher and one search result cache.
+    The pool size bounds the number of searches running at the same time.
+    With the "fake" backend the members are FakeCognitiveSearch clients sharing one
+    LocalCorpus, and no credential or transport is created.
+    With the "local" backend the members are LocalVectorSearch clients sharing one
+    LocalVectorIndex; query embeddings still go to Azure OpenAI unless RAG_BACKEND is "fake".
+    """
+
+    def __init__(
+        self,
+        size: int | None = None,
+        max_connections: int | None = None,
+        max_keepalive_connections: int | None = None,
+        keepalive_expiry: float | None = None,
+        backend: str | None = None,
+    ):
+        """
+        Args:
+            size (int): Maximum number of CognitiveSearch clients (concurrent searches).
+            max_connections (int): Connection limit of each shared HTTP transport.
+            max_keepalive_connections (int): Idle connections kept open for reuse.
+            keepalive_expiry (float): Seconds an idle connection is kept open.
+            backend (str): "azure", "local" or "fake". Defaults to RETRIEVER_BACKEND, then RAG_BACKEND.
+        """
+        self.size = size or int(ENV_VARIABLES.get("RETRIEVER_POOL_SIZE", 8))
+        self.max_connections = max_connections or int(ENV_VARIABLES.get("RETRIEVER_MAX_CONNECTIONS", 100))
+        self.max_keepalive_connections = max_keepalive_connections or int(
+            ENV_VARIABLES.get("RETRIEVER_MAX_KEEPALIVE_CONNECTIONS", 20)
+        )
+        self.keepalive_expiry = keepalive_expiry or float(ENV_VARIABLES.get("RETRIEVER_KEEPALIVE_EXPIRY", 30))
+        self.backend = backend or ENV_VARIABLES.get("RETRIEVER_BACKEND") or RAG_BACKEND
+        self._corpus: LocalCorpus | None = None
+        self._local_index: LocalVectorIndex | None = None
+
+        self._credential = None
+        self._token_provider = None
+        self._session: aiohttp.ClientSession | None = None
+        self._http_client: httpx.AsyncClient | None = None
+        self.embedding_cache: EmbeddingCache | None = None
+        self.embedding_batcher: EmbeddingBatcher | None = None
+        self.result_cache = SearchResultCache()
+
+        self._members: List[CognitiveSearch] = []
+        self._idle: asyncio.Queue | None = None
+        self._lock = asyncio.Lock()
+        self._started = False
+        self._closed = False
+
+    async def start(self) -> None:
+        """
+        Creates the shared credential and HTTP transports. Called on first `acquire`.
+        """
+        async with self._lock:
+            if self._started:
+                return
+            if self._closed:
+                raise RuntimeError("RetrieverPool is closed")
+
+            self._idle = asyncio.Queue()
+            if self.backend == "fake":
+                self._corpus = LocalCorpus.load()
+                self._started = True
+                return
+            if self.backend == "local":
+                self._local_index = self._load_local_index()
+                if RAG_BACKEND == "fake":
+                    self._started = True
+                    return
+
+            self._credential = EnvironmentCredential(authority_host=AzureAuthorityHosts.AZURE_PUBLIC_CLOUD)
+            self._token_provider = CachedTokenProvider(self._credential, COGNITIVE_SERVICES_SCOPE)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    keepalive_timeout=self.keepalive_expiry,
+                ),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                auto_decompress=False,
+            )
+            self._http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                )
+            )
+            self.embedding_cache = EmbeddingCache()
+            self._started = True
+
+    @staticmethod
+    def _load_local_index() -> LocalVectorIndex:
+        path = LocalVectorIndex.default_path()
+        if (path / "index.json").exists():
+            # Queries are embedded with the fake embeddings offline, with Azure OpenAI otherwise
+            embedding_model = "fake" if RAG_BACKEND == "fake" else ENV_VARIABLES.get("AZURE_OPENAI_EMBEDDING", "textembedding")
+            return LocalVectorIndex.load(path, embedding_model=embedding_model)
+        if RAG_BACKEND == "fake":
+            # Offline runs without a built index search the local corpus
+            return LocalVectorIndex.from_corpus(LocalCorpus.load())
+        raise FileNotFoundError(f"Local index not found in {path}: run scripts/ingest_corpus.py --backend local")
+
+    def _new_member(self) -> CognitiveSearch:
+        if self.backend == "fake":
+            member = FakeCognitiveSearch(corpus=self._corpus)
+        elif self.backend == "local":
+            embedder = None if RAG_BACKEND == "fake" else self._new_cognitive_search()
+            member = LocalVectorSearch(self._local_index, embedder=embedder)
+        else:
+            member = self._new_cognitive_search()
+        self._members.append(member)
+        return member
+
+    def _new_cognitive_search(self) -> CognitiveSearch:
+        member = CognitiveSearch(
+            credential=self._credential,
+            transport=AioHttpTransport(session=self._session, session_owner=False),
+            http_client=self._http_client,
+            token_provider=self._token_provider,
+            embedding_cache=self.embedding_cache,
+            result_cache=self.result_cache,
+        )
+        if self.embedding_batcher is None:
+            # Every member uses the same http client, so any of them can send the batches
+            self.embedding_batcher = EmbeddingBatcher(member.generate_embeddings_batch)
+        member.embedding_batcher = self.embedding_batcher
+        return member
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[CognitiveSearch]:
+        """
+        Borrows a CognitiveSearch client, waiting if all `size` clients are in use.
+
+        Example:
+            async with get_retriever_pool().acquire() as search_client:
+                results = await search_client.search(query, top=20)
+        """
+        if not self._started:
+            await self.start()
+
+        if self._idle.empty() and len(self._members) < self.size:
+            member = self._new_member()
+        else:
+            member = await self._idle.get()
+        try:
+            yield member
+        finally:
+            self._idle.put_nowait(member)
+
+    @property
+    def stats(self) -> dict:
+        in_use = len(self._members) - (self._idle.qsize() if self._idle else 0)
+        stats = {"size": self.size, "created": len(self._members), "in_use": in_use}
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.stats
+        stats["search_cache"] = self.result_cache.stats
+        if self.embedding_batcher is not None:
+            stats["embedding_batcher"] = self.embedding_batcher.stats
+        return stats
+
+    async def aclose(self) -> None:
+        """
+        Closes every member and then the shared transports and credential.
+        """
+        async with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for member in self._members:
+                await member.aclose()
+            self._members.clear()
+            if self._http_client is not None:
+                await self._http_client.aclose()
+            if self._session is not None:
+                await self._session.close()
+            if self._credential is not None:
+                self._credential.close()
+            if self.embedding_cache is not None:
+                self.embedding_cache.close()
+
+
+# Global pool shared by the search tools
+_pool_instance: RetrieverPool | None = None
+
+
+def get_retriever_pool() -> RetrieverPool:
+    """Get the process-wide retriever pool - cached version """
+    global _pool_instance
+    if _pool_instance is None or _pool_instance._closed:
+        _pool_instance = RetrieverPool()
+    return _pool_instance
+
+
+def invalidate_search_cache(generation: str | None = None) -> str:
+    """
+    Invalidates cached search results of this process. Call after re-indexing.
+
+    Args:
+        generation (str): New index generation. If omitted, the current one is incremented.
+    """
+    return get_retriever_pool().result_cache.invalidate(generation)
+
+
+async def close_retriever_pool() -> None:
+    global _pool_instance
+    if _pool_instance is not None:
+        await _pool_instance.aclose()
+        _pool_instance = None
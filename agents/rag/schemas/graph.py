@@ -15,6 +15,7 @@ def combine_ids(
 ) -> List[str]:
     """
     - Si `update` es una cadena "CLEAR", reinicia la lista.
+    - Si es una lista que empieza por "CLEAR", reinicia la lista con el resto.
     - Si es str distinto, lo añade.
     - Si es lista, la extiende.
     - Elimina duplicados preservando orden.
@@ -25,6 +26,8 @@ def combine_ids(
     # Handle special "CLEAR"
     if update == "CLEAR":
         return []
+    if isinstance(update, list) and update[:1] == ["CLEAR"]:
+        entries, update = [], update[1:]
 
     # Aplanar update
     if isinstance(update, list):
@@ -48,6 +51,8 @@ class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     reject_reason: Optional[str] = None
     classification: Optional[str] = None
+    # "local" or "llm": which path took the guardrail decision
+    guardrail_path: Optional[str] = None
     # should be optional Annotated[list[str], add_ids]
     ids_content: Annotated[List[str], combine_ids]
 
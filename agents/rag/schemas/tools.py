@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Annotated, Literal
+from typing import Optional, Annotated, Literal, List
 from langgraph.prebuilt import InjectedState
 from langchain_core.tools import InjectedToolCallId
 
@@ -14,4 +14,14 @@ class DomainSearchInput(BaseModel):
     query: str = Field(..., description="Frase de búsqueda")
     domain: Literal["manuales", "garantias"] = Field(..., description="Dominio de la búsqueda: consultas relacionadas con manuales de producto debes usar el dominio 'manuales' y para consultas relacionadas con garantías debes usar el dominio 'garantias'")
     state: Optional[Annotated[dict, InjectedState]] = None
-    tool_call_id: Annotated[str, InjectedToolCallId]
\ No newline at end of file
+    tool_call_id: Annotated[str, InjectedToolCallId]
+class SearchRequest(BaseModel):
+    """Una búsqueda de multi_search."""
+    query: str = Field(..., description="Frase de búsqueda")
+    domain: Optional[Literal["manuales", "garantias"]] = Field(default=None, description="Dominio de la búsqueda ('manuales' o 'garantias'); vacío para buscar en toda la base de conocimiento")
+
+class MultiSearchInput(BaseModel):
+    """Varias búsquedas en paralelo, fusionadas en una sola lista."""
+    searches: List[SearchRequest] = Field(..., min_length=1, max_length=4, description="Búsquedas a realizar en paralelo (máximo 4), cada una con 'query' y opcionalmente 'domain'. Úsalo cuando la pregunta involucra varios temas o ambos dominios")
+    state: Optional[Annotated[dict, InjectedState]] = None
+    tool_call_id: Annotated[str, InjectedToolCallId]
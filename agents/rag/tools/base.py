@@ -1,3 +1,4 @@
+import asyncio
 from typing import Annotated, List, Dict
 
 from langchain_core.tools import tool
@@ -6,11 +7,21 @@ from langgraph.types import Command
 from langchain_core.tools import InjectedToolCallId
 from langchain_core.messages import ToolMessage
 
-from agents.rag.schemas.tools import GeneralSearchInput, DomainSearchInput
-from agents.rag.retriever.cognitivesearch import CognitiveSearch
+from agents.rag.schemas.tools import GeneralSearchInput, DomainSearchInput, MultiSearchInput
+from agents.rag.retriever.adaptive import adaptive_search
+from agents.rag.retriever.local import reciprocal_rank_fusion
+from agents.rag.retriever.pool import get_retriever_pool
+from agents.rag.utils import render_search_results
+from config.config import ENV_VARIABLES
+from tracing.metrics import timed_stage
+
+
+# Index fields the tools use: only these travel over the wire (no vectors)
+SEARCH_SELECT = ["domain", "source", "id_document", "id_content", "content"]
 
 
 @tool("general_search", args_schema=GeneralSearchInput)
+@timed_stage("tool_general_search")
 async def general_search(
     query: str,
     state: Annotated[dict, InjectedState],
@@ -22,13 +33,9 @@ async def general_search(
     include_fields = ["domain", "source", "id_document", "id_content", "@search.score", "@search.reranker_score", "content"]
     #user_id = state['user_id']
     
-    search_client = CognitiveSearch()
-    search_results = await search_client.search(
-        query,
-        top=20,
-        use_hybrid=True,
-    )
-    await search_client.aclose()
+    # Few passages for clear queries, more only when the scores are ambiguous
+    async with get_retriever_pool().acquire() as search_client:
+        search_results = await adaptive_search(search_client, query, select=SEARCH_SELECT)
     result_fields: List[Dict] = [
         { field: record.get(field) for field in include_fields }
         for record in search_results
@@ -36,15 +43,19 @@ async def general_search(
 
     # get all ids
     ids_content = [record['id_content'] for record in result_fields]
+    # Passages already returned in this conversation are sent as references
+    seen_ids = set((state or {}).get("ids_content") or [])
 
     return Command(update={
         "ids_content": ids_content,
         "messages": [
-            ToolMessage(content=str(result_fields), tool_call_id=tool_call_id)
+            # The structured results travel as artifact so the context manager can trim them
+            ToolMessage(content=render_search_results(result_fields, seen_ids), artifact=result_fields, tool_call_id=tool_call_id)
         ]
         })
 
 @tool("domain_search", args_schema=DomainSearchInput)
+@timed_stage("tool_domain_search")
 async def domain_search(
     query: str,
     domain: str,
@@ -57,26 +68,73 @@ async def domain_search(
 
     include_fields = ["domain", "source", "id_document", "id_content", "@search.score", "@search.reranker_score", "content"]
 
-    search_client = CognitiveSearch()
-    search_results = await search_client.search(
-        query,
-        top=20,
-        use_hybrid=True,
-        filters={"domain": domain}
-    )
-    await search_client.aclose()
+    async with get_retriever_pool().acquire() as search_client:
+        search_results = await adaptive_search(search_client, query, filters={"domain": domain}, select=SEARCH_SELECT)
 
     result_fields: List[Dict] = [
         { field: record.get(field) for field in include_fields }
         for record in search_results
     ]
     ids_content = [record['id_content'] for record in result_fields]
+    seen_ids = set((state or {}).get("ids_content") or [])
+
+    return Command(update={
+        "ids_content": ids_content,
+        "messages": [
+            # The structured results travel as artifact so the context manager can trim them
+            ToolMessage(content=render_search_results(result_fields, seen_ids), artifact=result_fields, tool_call_id=tool_call_id)
+        ]
+        })
+
+@tool("multi_search", args_schema=MultiSearchInput)
+@timed_stage("tool_multi_search")
+async def multi_search(
+    searches: List[Dict],
+    state: Annotated[dict, InjectedState],
+    tool_call_id: Annotated[str, InjectedToolCallId]
+) -> List[Dict]:
+    """
+    Utiliza este tool para hacer varias búsquedas a la vez (distintas consultas o dominios)
+    y recibir un solo listado de resultados combinados.
+    """
+
+    include_fields = ["domain", "source", "id_document", "id_content", "@search.score", "@search.reranker_score", "content"]
+    top = int(ENV_VARIABLES.get("MULTI_SEARCH_TOP", 20))
+    searches = [dict(search) if isinstance(search, dict) else search.model_dump() for search in searches]
+
+    # One client for every query: the searches run concurrently over its connections
+    async with get_retriever_pool().acquire() as search_client:
+        rankings = await asyncio.gather(*[
+            adaptive_search(
+                search_client,
+                search["query"],
+                filters={"domain": search["domain"]} if search.get("domain") else None,
+                select=SEARCH_SELECT,
+            )
+            for search in searches
+        ])
+
+    # Reciprocal rank fusion of the rankings, deduplicated by id_content
+    records: Dict[str, Dict] = {}
+    for ranking in rankings:
+        for record in ranking:
+            records.setdefault(record["id_content"], record)
+    fused = reciprocal_rank_fusion([[record["id_content"] for record in ranking] for ranking in rankings])[:top]
+
+    result_fields: List[Dict] = [
+        {**{field: records[id_content].get(field) for field in include_fields}, "@search.score": score}
+        for id_content, score in fused
+    ]
+    ids_content = [record['id_content'] for record in result_fields]
+    seen_ids = set((state or {}).get("ids_content") or [])
 
     return Command(update={
         "ids_content": ids_content,
         "messages": [
-            ToolMessage(content=str(result_fields), tool_call_id=tool_call_id)
+            # The structured results travel as artifact so the context manager can trim them
+            ToolMessage(content=render_search_results(result_fields, seen_ids), artifact=result_fields, tool_call_id=tool_call_id)
         ]
         })
 
-AVAILABLE_TOOLS = [general_search, domain_search]
+AVAILABLE_TOOLS = [general_search, domain_search, multi_search]
+TOOLS_BY_NAME = {tool.name: tool for tool in AVAILABLE_TOOLS}
@@ -1,9 +1,10 @@
+import hashlib
 import json
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Set
 from langchain_core.tools import BaseTool
 
-from config.config import BASE_DIR
+from config.config import BASE_DIR, ENV_VARIABLES
 
 def format_tool_for_prompt(tool: BaseTool) -> str:
     """
@@ -56,4 +57,93 @@ def load_guardrails_examples() -> List[Dict[str, str]]:
     
 def load_json_examples(file_name: str) -> List[Dict[str, str]]:
     with open(Path(BASE_DIR, "agents", "rag", "prompts", file_name), "r") as f:
-        return json.load(f)
\ No newline at end of file
+        return json.load(f)
+
+def render_search_results(
+    results: List[Dict],
+    seen_ids: Set[str] | None = None,
+    max_chars: int | None = None,
+) -> str:
+    """
+    Convierte los resultados de búsqueda de un tool en el texto del ToolMessage:
+    pasajes numerados con una etiqueta corta de fuente y el contenido recortado.
+    Los pasajes que el modelo ya vio (`seen_ids`) se reemplazan por una referencia.
+
+    Ejemplo:
+        [1] garantias | garantias-computadores 1.pdf | id=abc-3
+        La garantía cubre...
+
+        [2] manuales | manual_de_usuario-smartphones 1.pdf | id=def-1 (ya mostrado)
+    """
+    seen_ids = seen_ids or set()
+    max_chars = max_chars or int(ENV_VARIABLES.get("TOOL_PASSAGE_MAX_CHARS", 1500))
+
+    passages = []
+    for n, record in enumerate(results, start=1):
+        id_content = record.get("id_content")
+        source = str(record.get("source") or "").rsplit("/", 1)[-1]
+        tag = f"[{n}] {record.get('domain')} | {source} | id={id_content}"
+        if id_content in seen_ids:
+            passages.append(f"{tag} (ya mostrado)")
+            continue
+        content = " ".join(str(record.get("content") or "").split())
+        if len(content) > max_chars:
+            content = content[:max_chars].rstrip() + "…"
+        passages.append(f"{tag}\n{content}")
+
+    if not passages:
+        return "Sin resultados."
+    return "\n\n".join(passages)
+
+
+def search_result_score(record: Dict) -> float:
+    """
+    Score de relevancia de un resultado: reranker semántico si existe, si no el score de búsqueda.
+    """
+    score = record.get("@search.reranker_score")
+    if score is None:
+        score = record.get("@search.score")
+    return score or 0.0
+
+
+def project_search_result(record: Dict, select: List[str] | None = None, max_content_chars: int | None = None) -> Dict:
+    """
+    Deja en un resultado de búsqueda solo los campos de `select` (más los scores "@search.*")
+    y recorta `content` a `max_content_chars` caracteres (por defecto SEARCH_CONTENT_MAX_CHARS,
+    o TOOL_PASSAGE_MAX_CHARS; 0 no recorta).
+    """
+    if max_content_chars is None:
+        max_content_chars = int(ENV_VARIABLES.get("SEARCH_CONTENT_MAX_CHARS", ENV_VARIABLES.get("TOOL_PASSAGE_MAX_CHARS", 1500)))
+    if select:
+        record = {field: value for field, value in record.items() if field in select or field.startswith("@search.")}
+    content = record.get("content")
+    if max_content_chars and isinstance(content, str) and len(content) > max_content_chars:
+        record = {**record, "content": content[:max_content_chars].rstrip() + "…"}
+    return record
+
+
+SEARCH_MODES = ("vector", "keyword", "hybrid")
+
+
+def resolve_search_mode(mode: str | None, use_hybrid: bool = True, semantic_rerank: bool | None = None) -> tuple:
+    """
+    Modo de búsqueda efectivo y si se aplica el reranker semántico.
+    Sin `mode`, se usa SEARCH_MODE ("hybrid" por defecto) o "vector" si use_hybrid=False.
+    El reranker (SEARCH_SEMANTIC_RERANK) necesita texto de búsqueda: no aplica en modo "vector".
+    """
+    if mode is None:
+        mode = ENV_VARIABLES.get("SEARCH_MODE", "hybrid") if use_hybrid else "vector"
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Modo de búsqueda no soportado: {mode}")
+    if semantic_rerank is None:
+        semantic_rerank = str(ENV_VARIABLES.get("SEARCH_SEMANTIC_RERANK", "false")).lower() in ("1", "true", "yes")
+    return mode, semantic_rerank and mode != "vector"
+
+
+def content_hash(value) -> str:
+    """
+    Hash estable de un valor serializable a JSON (prompts, configuración del agente).
+    Se usa como versión para reutilizar resultados de evaluación.
+    """
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,67 @@
+from typing import Callable, Dict
+
+from agents.base import BaseAgent
+from agents.rag.base import RAGAgent
+from config.config import RAG_BACKEND
+
+
+def build_rag_agent() -> RAGAgent:
+    return RAGAgent(llm_provider=RAG_BACKEND, retrieval_args={})
+
+
+DEFAULT_AGENT_FACTORIES: Dict[str, Callable[[], BaseAgent]] = {
+    "rag": build_rag_agent,
+}
+
+
+class AgentRegistry:
+    """
+    Holds the agents of a worker process.
+    Each agent (LLM client, credentials, compiled graph) is built once at startup
+    and shared by every request handled by the worker.
+    """
+
+    def __init__(self, factories: Dict[str, Callable[[], BaseAgent]] | None = None):
+        """
+        Initializes the registry.
+
+        Args:
+            factories (dict): Mapping of agent name to a callable that builds the agent.
+        """
+        self.factories = factories or DEFAULT_AGENT_FACTORIES
+        self._agents: Dict[str, BaseAgent] = {}
+
+    def startup(self) -> None:
+        """
+        Builds every registered agent.
+        """
+        for name in self.factories:
+            self.get(name)
+
+    def get(self, name: str) -> BaseAgent:
+        """
+        Returns the shared agent registered under `name`, building it on first use.
+
+        Args:
+            name (str): Name of the agent (e.g. "rag").
+
+        Returns:
+            BaseAgent: The shared agent instance.
+        """
+        agent = self._agents.get(name)
+        if agent is None:
+            if name not in self.factories:
+                raise KeyError(f"Agent {name} not registered")
+            agent = self.factories[name]()
+            self._agents[name] = agent
+        return agent
+
+    async def shutdown(self) -> None:
+        """
+        Closes (if they hold connections) and drops the shared agents.
+        """
+        for agent in self._agents.values():
+            aclose = getattr(agent, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        self._agents.clear()
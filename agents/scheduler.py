@@ -0,0 +1,237 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, List, Tuple
+
+import openai
+
+from config.config import ENV_VARIABLES
+
+RETRIABLE_STATUS = {408, 409, 429}
+
+
+def retry_after(error: BaseException) -> float | None:
+    """Seconds requested by the `retry-after-ms` / `retry-after` headers of an API error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) / scale
+            except ValueError:
+                # HTTP-date values are not used by Azure OpenAI
+                continue
+    return None
+
+
+def status_code(error: BaseException) -> int | None:
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+
+def is_rate_limit(error: BaseException) -> bool:
+    return isinstance(error, openai.RateLimitError) or status_code(error) == 429
+
+
+def is_retriable(error: BaseException) -> bool:
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = status_code(error)
+    return code is not None and (code in RETRIABLE_STATUS or code >= 500)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+    It holds at most `burst_seconds` worth of tokens, so a full bucket cannot
+    exceed the quota over the short windows Azure OpenAI enforces.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Waits until `amount` tokens are available and takes them. Waiters are served in order."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits of a deployment, plus a
+    global pause set when the service answers with Retry-After.
+    """
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None):
+        """
+        Args:
+            rpm (float): Requests per minute. 0 or None disables the limit.
+            tpm (float): Tokens per minute. 0 or None disables the limit.
+        """
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, requests: float = 1, tokens: float = 0) -> None:
+        while (wait := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(wait)
+        if self.requests is not None:
+            await self.requests.acquire(requests)
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens)
+
+
+class AdaptiveScheduler:
+    """
+    Runs a coroutine over many items as fast as the rate limits allow.
+
+    - Every attempt takes its estimated requests/tokens from a RateLimiter first.
+    - Concurrency follows AIMD: +1/limit per success, halved on a rate-limit error
+      (once per congestion window, i.e. only for attempts started after the last decrease).
+    - Each item is retried on its own with exponential backoff and jitter, waiting the
+      Retry-After of the service when it sends one. Other items keep running.
+    Failed items (non-retriable or out of retries) return their exception.
+    """
+
+    def __init__(
+        self,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        min_concurrency: int | None = None,
+        max_concurrency: int | None = None,
+        initial_concurrency: int | None = None,
+        max_retries: int | None = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        """
+        Args:
+            rpm (float): Requests per minute of the deployment (EVAL_RPM).
+            tpm (float): Tokens per minute of the deployment (EVAL_TPM).
+            min_concurrency (int): Lower bound of the concurrency (EVAL_MIN_CONCURRENCY).
+            max_concurrency (int): Upper bound of the concurrency (EVAL_MAX_CONCURRENCY).
+            initial_concurrency (int): Starting concurrency (EVAL_INITIAL_CONCURRENCY).
+            max_retries (int): Retries per item (EVAL_MAX_RETRIES).
+            base_delay (float): First backoff delay in seconds.
+            max_delay (float): Maximum backoff delay in seconds.
+        """
+        rpm = rpm if rpm is not None else float(ENV_VARIABLES.get("EVAL_RPM", 0))
+        tpm = tpm if tpm is not None else float(ENV_VARIABLES.get("EVAL_TPM", 0))
+        self.limiter = RateLimiter(rpm, tpm)
+        self.min_concurrency = min_concurrency or int(ENV_VARIABLES.get("EVAL_MIN_CONCURRENCY", 1))
+        self.max_concurrency = max_concurrency or int(ENV_VARIABLES.get("EVAL_MAX_CONCURRENCY", 32))
+        initial_concurrency = initial_concurrency or int(ENV_VARIABLES.get("EVAL_INITIAL_CONCURRENCY", 4))
+        self.max_retries = max_retries if max_retries is not None else int(ENV_VARIABLES.get("EVAL_MAX_RETRIES", 6))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.max_limit_reached = self.limit
+        self._active = 0
+        self._last_decrease = 0.0
+        self._condition: asyncio.Condition | None = None
+        # succeeded / failed / retries / rate_limited / decreases
+        self.stats = Counter()
+
+    async def run(
+        self,
+        items: List[Any],
+        func: Callable[[Any], Awaitable[Any]],
+        cost: Callable[[Any], Tuple[float, float]] | None = None,
+    ) -> List[Any]:
+        """
+        Runs `func(item)` for every item.
+
+        Args:
+            items (list): Items to process.
+            func (callable): Coroutine function called with each item.
+            cost (callable): Returns the estimated (requests, tokens) of one attempt. Defaults to (1, 0).
+
+        Returns:
+            list: Results in the order of `items`; the exception for items that failed.
+        """
+        self._condition = asyncio.Condition()
+        results: List[Any] = [None] * len(items)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, item in enumerate(items):
+            queue.put_nowait((index, item))
+
+        async def worker():
+            while not queue.empty():
+                index, item = queue.get_nowait()
+                results[index] = await self._run_item(item, func, cost)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(items)))))
+        return results
+
+    async def _acquire_slot(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+
+    async def _release_slot(self, started: float, error: BaseException | None) -> None:
+        async with self._condition:
+            self._active -= 1
+            if error is None:
+                # Additive increase: about +1 per `limit` successes
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.max_limit_reached = max(self.max_limit_reached, self.limit)
+            elif is_rate_limit(error) and started > self._last_decrease:
+                # Multiplicative decrease, once per congestion window
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._last_decrease = time.monotonic()
+                self.stats["decreases"] += 1
+            self._condition.notify_all()
+
+    def _backoff(self, error: BaseException, attempt: int) -> float:
+        delay = retry_after(error)
+        if delay is not None:
+            self.limiter.pause(delay)
+            return delay + random.uniform(0, self.base_delay)
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1)
+
+    async def _run_item(self, item: Any, func: Callable, cost: Callable | None) -> Any:
+        requests, tokens = cost(item) if cost else (1, 0)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(requests, tokens)
+            await self._acquire_slot()
+            started = time.monotonic()
+            error = None
+            try:
+                result = await func(item)
+            except Exception as e:
+                error = e
+            finally:
+                await self._release_slot(started, error)
+
+            if error is None:
+                self.stats["succeeded"] += 1
+                return result
+            if is_rate_limit(error):
+                self.stats["rate_limited"] += 1
+            if not is_retriable(error) or attempt == self.max_retries:
+                self.stats["failed"] += 1
+                return error
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._backoff(error, attempt))
@@ -4,12 +4,10 @@ import os
 import logging
 import logging.config
 
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
-
-from rich.logging import RichHandler
 from dotenv import dotenv_values, load_dotenv
 
+from config.settings import Settings
+
 BASE_DIR = Path(__file__).parent.parent.absolute()
 CONFIG_DIR = Path(BASE_DIR, "config")
 LOGS_DIR = Path(BASE_DIR, "logs")
@@ -17,23 +15,17 @@ SQLAGENT_DIR = Path(BASE_DIR, "agents","sqlagent")
 
 DATA_DIR = Path(BASE_DIR, "data")
 
-LOGS_DIR.mkdir(parents=True, exist_ok=True)
-
-ENV_VARIABLES = {
+_env_values = {
     **dotenv_values(BASE_DIR / ".env"),  # load environment variables from .env file
     **os.environ,  # load environment variables from the system
 }
 
 load_dotenv(BASE_DIR / ".env")
 
-KEY_VAULT_URL = os.getenv("KEY_VAULT_URL")
+# "azure" (default) or "fake": in-process stand-ins for Azure OpenAI and Azure AI Search
+RAG_BACKEND = _env_values.get("RAG_BACKEND", "azure")
 
-if not KEY_VAULT_URL:
-    raise RuntimeError("KEY_VAULT_URL no está definido en .env o variables de entorno.")
-
-
-credential = DefaultAzureCredential()
-client = SecretClient(vault_url=KEY_VAULT_URL, credential=credential)
+KEY_VAULT_URL = _env_values.get("KEY_VAULT_URL") or None
 
 # List of secrets you want to load
 SECRETS_TO_LOAD = [
@@ -43,17 +35,15 @@ SECRETS_TO_LOAD = [
     "APP-REGISTRATION-CLIENT-ID"
 ]
 
-for secret_name in SECRETS_TO_LOAD:
-    try:
-        secret = client.get_secret(secret_name)
-        value = secret.value
-
-        # Set in os.environ and ENV_VARIABLES
-        os.environ[secret_name] = value
-        ENV_VARIABLES[secret_name] = value
-
-    except Exception as e:
-        print(f"⚠️ Could not load secret '{secret_name}': {e}")
+# Secrets are fetched on first use (see Settings): keyvault, file or env
+ENV_VARIABLES = Settings(
+    _env_values,
+    SECRETS_TO_LOAD,
+    source=_env_values.get("SECRETS_SOURCE") or None,
+    vault_url=KEY_VAULT_URL,
+    secrets_file=_env_values.get("SECRETS_FILE") or CONFIG_DIR / "secrets.env",
+    refresh_interval=float(_env_values.get("SECRETS_REFRESH_SECONDS", 3600)),
+)
 
 
 #Logger
@@ -97,6 +87,23 @@ logging_config = {
     },
 }
 
-logging.config.dictConfig(logging_config)
+_logging_configured = False
+
+
+def setup_logging() -> None:
+    """
+    Configures the root logger once per process, however many times it is called.
+    Called by the entry points (app lifespan, scripts), not on import.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    from rich.logging import RichHandler
+
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    logging.config.dictConfig(logging_config)
+    logging.getLogger().handlers[0] = RichHandler(markup=True)
+    _logging_configured = True
+
+
 logger = logging.getLogger()
-logger.handlers[0] = RichHandler(markup=True)
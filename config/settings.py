@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from dotenv import dotenv_values
+
+logger = logging.getLogger(__name__)
+
+
+class Settings(MutableMapping):
+    """
+    Environment variables plus secrets loaded on first use.
+
+    Plain variables (.env and os.environ) are available at import time. Secrets are
+    only fetched the first time one of them is read, all at once, and kept for
+    `refresh_interval` seconds. Sources (SECRETS_SOURCE):
+        - "keyvault": Azure Key Vault at KEY_VAULT_URL, secrets fetched concurrently.
+        - "file": a dotenv file (SECRETS_FILE).
+        - "env": only the environment; nothing is fetched.
+    """
+
+    def __init__(
+        self,
+        values: Dict[str, str],
+        secret_names: Iterable[str],
+        source: str | None = None,
+        vault_url: str | None = None,
+        secrets_file: str | Path | None = None,
+        refresh_interval: float | None = None,
+    ):
+        """
+        Args:
+            values (dict): Variables from .env and the environment.
+            secret_names (list): Names of the secrets to load.
+            source (str): "keyvault", "file" or "env". Defaults to "keyvault" if `vault_url` is set, else "env".
+            vault_url (str): Key Vault URL.
+            secrets_file (str): dotenv file with the secrets for the "file" source.
+            refresh_interval (float): Seconds before secrets are fetched again.
+        """
+        self._values = dict(values)
+        self.secret_names = list(secret_names)
+        self.vault_url = vault_url
+        self.source = source or ("keyvault" if vault_url else "env")
+        if self.source not in ("keyvault", "file", "env"):
+            raise ValueError(f"Secrets source {self.source} not supported")
+        self.secrets_file = secrets_file
+        self.refresh_interval = refresh_interval if refresh_interval is not None else 3600
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    # Mapping interface; only secret names can trigger a load
+    def __getitem__(self, key: str) -> str:
+        if key in self.secret_names and self._stale():
+            self.load_secrets()
+        return self._values[key]
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self._values[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.secret_names and self._stale():
+            self.load_secrets()
+        return key in self._values
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def _store(self, secrets: Dict[str, str]) -> None:
+        for name, value in secrets.items():
+            # Set in os.environ and the settings
+            os.environ[name] = value
+            self._values[name] = value
+        self._loaded_at = time.monotonic()
+
+    async def _fetch_keyvault(self) -> Dict[str, str]:
+        if not self.vault_url:
+            raise RuntimeError("KEY_VAULT_URL no está definido en .env o variables de entorno.")
+        # Imported here so that processes that never read a secret do not pay for them
+        from azure.identity.aio import DefaultAzureCredential
+        from azure.keyvault.secrets.aio import SecretClient
+
+        async with DefaultAzureCredential() as credential:
+            async with SecretClient(vault_url=self.vault_url, credential=credential) as client:
+                responses = await asyncio.gather(
+                    *(client.get_secret(name) for name in self.secret_names), return_exceptions=True
+                )
+        secrets = {}
+        for name, response in zip(self.secret_names, responses):
+            if isinstance(response, BaseException):
+                logger.warning(f"⚠️ Could not load secret '{name}': {response}")
+            else:
+                secrets[name] = response.value
+        return secrets
+
+    def _fetch_file(self) -> Dict[str, str]:
+        values = dotenv_values(self.secrets_file) if self.secrets_file else {}
+        return {name: values[name] for name in self.secret_names if values.get(name) is not None}
+
+    async def aload_secrets(self, force: bool = False) -> None:
+        """
+        Loads the secrets from the configured source. Use from async code (e.g. app startup).
+
+        Args:
+            force (bool): Fetch again even if the cached secrets are still fresh.
+        """
+        if not force and not self._stale():
+            return
+        if self.source == "keyvault":
+            secrets = await self._fetch_keyvault()
+        elif self.source == "file":
+            secrets = self._fetch_file()
+        else:
+            secrets = {}
+        with self._lock:
+            self._store(secrets)
+
+    async def refresh_secrets(self) -> None:
+        """
+        Fetches the secrets again shortly before they go stale, forever. Run as a
+        background task of the app, so request handlers never load them.
+        """
+        while True:
+            await asyncio.sleep(self.refresh_interval * 0.9)
+            await self._refresh()
+
+    async def _refresh(self) -> None:
+        try:
+            await self.aload_secrets(force=True)
+        except Exception as e:
+            # The current secrets stay in use until the next attempt
+            logger.warning(f"Refreshing the secrets failed: {e}")
+
+    def load_secrets(self, force: bool = False) -> None:
+        """
+        Blocking version of `aload_secrets`, used on first read of a secret outside an
+        event loop. Inside a running loop Key Vault is never waited on: the secrets must
+        have been loaded with `await aload_secrets()` first, and stale ones stay in use
+        while a background task fetches them again.
+
+        Raises:
+            RuntimeError: A Key Vault secret is read inside the event loop before any load.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and self.source == "keyvault":
+            if self._loaded_at is None:
+                raise RuntimeError(
+                    "Secrets read inside the event loop before they were loaded: "
+                    "await ENV_VARIABLES.aload_secrets() at startup"
+                )
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = loop.create_task(self._refresh())
+            return
+        with self._lock:
+            if not force and not self._stale():
+                return
+            if self.source == "keyvault":
+                secrets = asyncio.run(self._fetch_keyvault())
+            elif self.source == "file":
+                secrets = self._fetch_file()
+            else:
+                secrets = {}
+            self._store(secrets)
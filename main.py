@@ -1,11 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 import uvicorn
 from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
+from prometheus_client import REGISTRY
 from fastapi.middleware.cors import CORSMiddleware
 
+from agents.registry import AgentRegistry
+from agents.rag.retriever.pool import close_retriever_pool, get_retriever_pool
+from config.config import ENV_VARIABLES, setup_logging
+from routers.admission import AdmissionController
 from routers.ragagent import router as ragrouter
+from routers.singleflight import SingleFlight
+from tracing.metrics import StatsCollector, metrics_payload
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    # Secrets are fetched here and refreshed in the background: reading one in a
+    # request handler never takes the blocking load path
+    await ENV_VARIABLES.aload_secrets()
+    secrets_refresh = asyncio.create_task(ENV_VARIABLES.refresh_secrets())
+    # Build the agents (LLM clients and compiled graphs) once per worker
+    agent_registry = AgentRegistry()
+    agent_registry.startup()
+    app.state.agent_registry = agent_registry
+    app.state.admission = AdmissionController()
+    app.state.chat_single_flight = SingleFlight("chat")
+    # Existing in-process stats, read on each /metrics scrape
+    stats_collector = StatsCollector({
+        "retriever_pool": lambda: get_retriever_pool().stats,
+        "agent": lambda: agent_registry.get("rag").stats,
+        "admission": lambda: app.state.admission.stats,
+        "chat_single_flight": lambda: app.state.chat_single_flight.stats,
+    })
+    REGISTRY.register(stats_collector)
+    yield
+    REGISTRY.unregister(stats_collector)
+    secrets_refresh.cancel()
+    with suppress(asyncio.CancelledError):
+        await secrets_refresh
+    await agent_registry.shutdown()
+    # Release the shared search/embedding connections
+    await close_retriever_pool()
+
+app = FastAPI(lifespan=lifespan)
 app.title = "Backend RAG Agents"
 app.version = "0.0.1"
 
@@ -24,5 +65,10 @@ app.add_middleware(
 def message():
     return HTMLResponse("<h1>Service: RAG Agents</h1>")
 
+@app.get("/metrics", tags=["monitoring"])
+def metrics():
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="localhost", port=8000)
\ No newline at end of file
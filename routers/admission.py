@@ -0,0 +1,207 @@
+import asyncio
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque
+
+from fastapi import HTTPException
+
+from config.config import ENV_VARIABLES
+from tracing.metrics import ADMISSION_ADMITTED, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT
+
+
+class AdmissionRejected(HTTPException):
+    """429 (this user is over its limits) or 503 (the service is saturated), with Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(
+            status_code=status_code,
+            detail=f"Request rejected by admission control: {reason}",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.reason = reason
+        ADMISSION_REJECTED.labels(reason).inc()
+
+
+class AdmissionTicket:
+    """Slot held by an admitted request. `release` can be called more than once."""
+
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(self.user_id, time.monotonic() - self.started)
+
+
+class AdmissionController:
+    """
+    Admission control in front of the agent graph.
+
+    - At most `max_in_flight` requests run at a time, and at most `max_per_user` per user_id.
+    - Requests over those limits wait in per-user FIFO queues. Freed slots go to the
+      users round-robin, so a burst from one user does not delay the others.
+    - A request is shed before the graph starts, with Retry-After:
+        * 429 if its user already has `max_per_user_queue` requests waiting,
+        * 503 if the global queue is full, if the estimated wait exceeds the deadline,
+          or if the deadline passes while it waits.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int | None = None,
+        max_per_user: int | None = None,
+        max_queue: int | None = None,
+        max_per_user_queue: int | None = None,
+        deadline: float | None = None,
+    ):
+        """
+        Args:
+            max_in_flight (int): Requests running at the same time (ADMISSION_MAX_IN_FLIGHT).
+            max_per_user (int): Requests of one user running at the same time (ADMISSION_MAX_PER_USER).
+            max_queue (int): Requests waiting, all users (ADMISSION_MAX_QUEUE).
+            max_per_user_queue (int): Requests of one user waiting (ADMISSION_MAX_PER_USER_QUEUE).
+            deadline (float): Seconds a request may wait before it starts (ADMISSION_DEADLINE_SECONDS).
+        """
+        self.max_in_flight = max_in_flight or int(ENV_VARIABLES.get("ADMISSION_MAX_IN_FLIGHT", 32))
+        self.max_per_user = max_per_user or int(ENV_VARIABLES.get("ADMISSION_MAX_PER_USER", 4))
+        self.max_queue = max_queue if max_queue is not None else int(ENV_VARIABLES.get("ADMISSION_MAX_QUEUE", 128))
+        self.max_per_user_queue = max_per_user_queue if max_per_user_queue is not None else int(
+            ENV_VARIABLES.get("ADMISSION_MAX_PER_USER_QUEUE", 8)
+        )
+        self.deadline = deadline or float(ENV_VARIABLES.get("ADMISSION_DEADLINE_SECONDS", 15))
+
+        self.in_flight = 0
+        self.queued = 0
+        self._user_in_flight: Counter = Counter()
+        # Round-robin order of the users with waiting requests
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # Moving average of the time a request holds its slot, None until the first one ends
+        self.avg_service_time: float | None = None
+
+    def _estimated_wait(self, position: int) -> float:
+        if self.avg_service_time is None:
+            return 0.0
+        return self.avg_service_time * position / self.max_in_flight
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._estimated_wait(self.queued + 1)))
+
+    def _grant(self, user_id: str) -> None:
+        self.in_flight += 1
+        self._user_in_flight[user_id] += 1
+        ADMISSION_ADMITTED.set(self.in_flight)
+
+    def _dispatch(self) -> None:
+        """Hands free slots to waiting requests, one user at a time."""
+        while self.in_flight < self.max_in_flight and self._queues:
+            for user_id in list(self._queues):
+                if self._user_in_flight[user_id] < self.max_per_user:
+                    break
+            else:
+                # Every waiting user is at its own limit
+                break
+            queue = self._queues.pop(user_id)
+            future = queue.popleft()
+            if queue:
+                # Back of the round-robin order
+                self._queues[user_id] = queue
+            self.queued -= 1
+            self._grant(user_id)
+            future.set_result(None)
+        ADMISSION_QUEUE_DEPTH.set(self.queued)
+
+    def _release(self, user_id: str, service_time: float) -> None:
+        self.in_flight -= 1
+        self._user_in_flight[user_id] -= 1
+        if self._user_in_flight[user_id] <= 0:
+            del self._user_in_flight[user_id]
+        if self.avg_service_time is None:
+            self.avg_service_time = service_time
+        else:
+            self.avg_service_time = 0.9 * self.avg_service_time + 0.1 * service_time
+        ADMISSION_ADMITTED.set(self.in_flight)
+        self._dispatch()
+
+    def _remove(self, user_id: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(user_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._queues[user_id]
+            ADMISSION_QUEUE_DEPTH.set(self.queued)
+
+    async def acquire(self, user_id: str) -> AdmissionTicket:
+        """
+        Waits for a slot for `user_id`.
+
+        Raises:
+            AdmissionRejected: The request is shed (429 or 503 with Retry-After).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        self._dispatch()
+        if future.done():
+            ADMISSION_WAIT.observe(0)
+            return AdmissionTicket(self, user_id)
+
+        # It has to wait: shed it now if it would wait too long
+        rejection = None
+        if len(self._queues[user_id]) > self.max_per_user_queue:
+            rejection = (429, "user_queue_full")
+        elif self.queued > self.max_queue:
+            rejection = (503, "queue_full")
+        elif self._estimated_wait(self.queued) > self.deadline:
+            rejection = (503, "overloaded")
+        if rejection is not None:
+            self._remove(user_id, future)
+            raise AdmissionRejected(*rejection, self._retry_after())
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=self.deadline)
+        except BaseException:
+            # Client gone while waiting: give back the slot if it was granted meanwhile
+            if future.done():
+                AdmissionTicket(self, user_id).release()
+            else:
+                self._remove(user_id, future)
+            raise
+        ADMISSION_WAIT.observe(time.monotonic() - start)
+        # Checked on the future, not on `done`: the slot may have been granted after the
+        # timeout fired but before this coroutine resumed, and then it must be used
+        if not future.done():
+            self._remove(user_id, future)
+            raise AdmissionRejected(503, "deadline_exceeded", self._retry_after())
+        return AdmissionTicket(self, user_id)
+
+    @asynccontextmanager
+    async def admit(self, user_id: str) -> AsyncIterator[AdmissionTicket]:
+        """
+        Holds a slot for the duration of the block.
+
+        Example:
+            async with admission.admit(input.user_id):
+                predict = await assistant.run(...)
+        """
+        ticket = await self.acquire(user_id)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "users_waiting": len(self._queues),
+            "avg_service_time": self.avg_service_time or 0.0,
+        }
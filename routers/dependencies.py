@@ -0,0 +1,26 @@
+from fastapi import Request
+
+from agents.rag.base import RAGAgent
+from routers.admission import AdmissionController
+from routers.singleflight import SingleFlight
+
+
+def get_rag_agent(request: Request) -> RAGAgent:
+    """
+    Returns the RAGAgent built at startup for this worker.
+    """
+    return request.app.state.agent_registry.get("rag")
+
+
+def get_admission(request: Request) -> AdmissionController:
+    """
+    Returns the admission controller of this worker.
+    """
+    return request.app.state.admission
+
+
+def get_chat_single_flight(request: Request) -> SingleFlight:
+    """
+    Returns the single-flight group that collapses identical /chat requests.
+    """
+    return request.app.state.chat_single_flight
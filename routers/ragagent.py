@@ -2,17 +2,33 @@ from datetime import datetime
 import uuid
 import json
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 
 from agents.rag.base import RAGAgent
+from starlette.background import BackgroundTask
+
+from routers.admission import AdmissionController
+from routers.dependencies import get_admission, get_chat_single_flight, get_rag_agent
+from routers.singleflight import SingleFlight, chat_request_key
 from schemas.conversation import InputChat, ResponseRAG
+from tracing.metrics import REQUESTS_IN_FLIGHT, observe_stage
 
 router = APIRouter(prefix="/api/v1")
 
+
+def check_conversation_store(input: InputChat, assistant: RAGAgent) -> None:
+    # Only the new message: the conversation has to be in the store
+    if input.message is not None and assistant.checkpointer is None:
+        raise HTTPException(status_code=400, detail="Conversation store disabled: send the history")
+
 @router.post("/chat", tags=["assistant"])
 async def process_data(
-    request: Request, input: InputChat
+    request: Request,
+    input: InputChat,
+    assistant: RAGAgent = Depends(get_rag_agent),
+    admission: AdmissionController = Depends(get_admission),
+    single_flight: SingleFlight = Depends(get_chat_single_flight),
 ) -> dict:
     call_id = str(uuid.uuid4())
     user_id = input.user_id
@@ -21,9 +37,16 @@ async def process_data(
         "user_id": user_id,
         "conversation_id": conversation_id
         }
+    check_conversation_store(input, assistant)
+
+    async def run_graph():
+        # Sheds the request (429/503 with Retry-After) before the graph starts
+        async with admission.admit(user_id):
+            with REQUESTS_IN_FLIGHT.labels("chat").track_inprogress(), observe_stage("request_chat"):
+                return await assistant.run(history=input.history, metadata=metadata, message=input.message)
 
-    assistant = RAGAgent(llm_provider="azure", retrieval_args={})
-    predict = await assistant.run(history=input.history, metadata=metadata)
+    # Identical requests in flight (retries, double submits) share one graph execution
+    predict = await single_flight.do(chat_request_key(user_id, conversation_id, input.history, input.message), run_graph)
 
     response = {
         "id": call_id,
@@ -37,7 +60,10 @@ async def process_data(
 
 @router.post("/streamchat", tags=["rag"])
 async def process_data(
-    request: Request, input: InputChat
+    request: Request,
+    input: InputChat,
+    assistant: RAGAgent = Depends(get_rag_agent),
+    admission: AdmissionController = Depends(get_admission),
 ) -> dict:
     call_id = str(uuid.uuid4())
     user_id = input.user_id
@@ -46,21 +72,25 @@ async def process_data(
         "user_id": user_id,
         "conversation_id": conversation_id
         }
+    check_conversation_store(input, assistant)
 
-    agent = RAGAgent(llm_provider="azure", retrieval_args={})
+    # Admitted before the response starts, so a shed request gets a real 429/503
+    ticket = await admission.acquire(user_id)
 
     async def event_generator():
-        async for event in agent.stream_run(input.history, metadata):
-            type_event = event['type']
-            if type_event == "custom":
-                yield f"event: {event['type']}\n"
-                yield f"data: {json.dumps(event['data'])}\n\n"
-            elif type_event == "messages":
-                yield f"event: {event['type']}\n"
-                yield f"data: {json.dumps(event['data'][0].content)}\n\n"
+        # guardrail / tool_start / retrieval / tool_end / token / done
+        try:
+            with REQUESTS_IN_FLIGHT.labels("streamchat").track_inprogress(), observe_stage("request_streamchat"):
+                async for event in assistant.stream_run(input.history, metadata, input.message):
+                    yield f"event: {event['type']}\n"
+                    yield f"data: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+        finally:
+            ticket.release()
 
     return StreamingResponse(
         event_generator(), 
         media_type="text/event-stream", 
-        headers={"Cache-Control": "no-cache","Connection": "keep-alive"}
+        headers={"Cache-Control": "no-cache","Connection": "keep-alive"},
+        # Also frees the slot if the client disconnects before the stream starts
+        background=BackgroundTask(ticket.release),
         )
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from agents.rag.retriever.cache import normalize_text
+from agents.rag.utils import content_hash
+from schemas.conversation import MessageItem
+from tracing.metrics import SINGLE_FLIGHT_COLLAPSED
+
+
+def chat_request_key(user_id: str, conversation_id: str, history: Optional[List[MessageItem]], message: Optional[str] = None) -> str:
+    """
+    Key of a chat request: user, conversation and the normalized history the agent
+    actually sees (last 20 messages) or the new message, so retries and double submits collapse.
+    """
+    return content_hash({
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "history": [(item.role, normalize_text(item.content)) for item in (history or [])[-20:]],
+        "message": normalize_text(message) if message is not None else None,
+    })
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+    The first caller starts it; later callers with the same key wait for it and get the
+    same result (or exception). The key is forgotten as soon as the execution ends, so
+    nothing is cached. A caller that disconnects does not cancel the execution the
+    others are waiting for.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): Label of the collapsed-requests counter (e.g. the endpoint).
+        """
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the result of `func()`, shared with the concurrent calls for `key`.
+        """
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.collapsed += 1
+            SINGLE_FLIGHT_COLLAPSED.labels(self.name).inc()
+        return await asyncio.shield(task)
+
+    @property
+    def stats(self) -> dict:
+        return {"calls": self.calls, "collapsed": self.collapsed, "in_flight": len(self._calls)}
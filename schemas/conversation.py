@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Literal, Optional, Dict
 
 class MessageItem(BaseModel):
@@ -7,8 +7,18 @@ class MessageItem(BaseModel):
 
 class InputChat(BaseModel):
     user_id: str = Field(default="test0001", min_length=1, max_length=10000)
-    conversation_id: str = Field(default="convtest0001", min_length=5, max_length=10000)
-    history: List[MessageItem] = Field(..., min_items=1, max_items=100, description="Conversation message history")
+    conversation_id: str = Field(default="convtest0001", min_length=5, max_length=10000, description="Required with message: the stored conversation is the one of (user_id, conversation_id)")
+    history: Optional[List[MessageItem]] = Field(default=None, min_items=1, max_items=100, description="Conversation message history. Replaces the stored conversation")
+    message: Optional[str] = Field(default=None, min_length=1, description="New user message, appended to the stored conversation of conversation_id")
+
+    @model_validator(mode="after")
+    def check_history_or_message(self):
+        if (self.history is None) == (self.message is None):
+            raise ValueError("Send either the conversation history or the new message")
+        if self.message is not None and "conversation_id" not in self.model_fields_set:
+            # The default id would make every client resume the same conversation
+            raise ValueError("conversation_id is required when sending only the new message")
+        return self
 
 class ResponseRAG(BaseModel):
     response: str
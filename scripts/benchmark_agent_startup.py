@@ -0,0 +1,55 @@
+"""
+Measures the per-request overhead of building a RAGAgent inside the handler
+(previous behaviour) against reusing the agent built once by AgentRegistry.
+
+Usage:
+    python scripts/benchmark_agent_startup.py --requests 20
+"""
+import argparse
+import statistics
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.registry import AgentRegistry, build_rag_agent
+
+
+def measure(fn, n_requests: int) -> list:
+    timings = []
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list) -> None:
+    print(
+        f"{name:<22} mean={statistics.mean(timings):8.3f} ms  "
+        f"p50={statistics.median(timings):8.3f} ms  max={max(timings):8.3f} ms"
+    )
+
+
+def main(n_requests: int):
+    # Before: every request builds credential, LLM client, examples and graph
+    per_request = measure(build_rag_agent, n_requests)
+
+    # After: the agent is built once at startup and looked up per request
+    registry = AgentRegistry()
+    start = time.perf_counter()
+    registry.startup()
+    startup_ms = (time.perf_counter() - start) * 1000
+    shared = measure(lambda: registry.get("rag"), n_requests)
+
+    print(f"Requests: {n_requests}")
+    report("per-request agent", per_request)
+    report("shared agent", shared)
+    print(f"One-time startup cost: {startup_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+    main(args.requests)
@@ -0,0 +1,39 @@
+"""
+Measures the cold-start time of the API: a fresh interpreter importing `main:app`
+(config, agents, routers), repeated `--runs` times. Secrets are not read during
+startup, so Key Vault is not contacted unless an agent needs one.
+
+Usage:
+    python scripts/benchmark_cold_start.py --runs 5
+    python scripts/benchmark_cold_start.py --module config.config
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_start(module: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main(module: str, runs: int):
+    cold_start(module)  # warm the .pyc and filesystem caches
+    times = sorted(cold_start(module) for _ in range(runs))
+    print(f"import {module}: {runs} runs")
+    print(f"  p50 {statistics.median(times) * 1000:.0f} ms  min {times[0] * 1000:.0f} ms  max {times[-1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str, default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    main(args.module, args.runs)
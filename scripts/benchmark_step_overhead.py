@@ -0,0 +1,41 @@
+"""
+Micro-benchmark of the per-step Python overhead of the RAGAgent nodes:
+building prompts/runnables on every call (previous behaviour) against reusing
+the ones the agent builds once in `build_runnables`. No LLM call is made.
+
+Usage:
+    RAG_BACKEND=fake python scripts/benchmark_step_overhead.py --iterations 200
+"""
+import argparse
+import sys
+import os
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.rag.base import RAGAgent
+from config.config import RAG_BACKEND
+
+
+def main(iterations: int, llm_provider: str):
+    agent = RAGAgent(llm_provider=llm_provider, retrieval_args={}, checkpointer="none")
+
+    steps = {
+        "guardrial": (agent._build_guardrails_runnable, lambda: agent.guardrails_runnable),
+        "friendly_response": (agent._build_friendly_response_runnable, lambda: agent.friendly_response_runnable),
+        "agent_brain": (agent._build_agent_runnable, lambda: (agent.llm_with_tools, agent.agent_sys_msg)),
+    }
+
+    print(f"Iterations: {iterations}")
+    print(f"{'node':<20}{'per-call build (us)':>22}{'prebuilt (us)':>16}")
+    for name, (builder, prebuilt) in steps.items():
+        per_call = timeit.timeit(builder, number=iterations) / iterations * 1e6
+        reused = timeit.timeit(prebuilt, number=iterations) / iterations * 1e6
+        print(f"{name:<20}{per_call:>22.1f}{reused:>16.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--llm-provider", type=str, default=RAG_BACKEND, help="azure or fake")
+    args = parser.parse_args()
+    main(args.iterations, args.llm_provider)
@@ -0,0 +1,76 @@
+"""
+Compares the input tokens of search tool outputs rendered as the Python repr of
+the result dicts (previous behaviour) against the compact rendering, with and
+without cross-turn dedup of passages already seen in the conversation.
+
+Usage:
+    python scripts/benchmark_tool_tokens.py
+    python scripts/benchmark_tool_tokens.py --results search_results.json --overlap 0.5
+
+`--results` is a JSON list of search result dicts (as returned by CognitiveSearch.search).
+Without it, 20 synthetic passages are built from the golden dataset.
+"""
+import argparse
+import json
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import DATA_DIR
+from agents.rag.context import ContextBudgetManager
+from agents.rag.utils import render_search_results
+
+INCLUDE_FIELDS = ["domain", "source", "id_document", "id_content", "@search.score", "@search.reranker_score", "content"]
+
+
+def synthetic_results(n_results: int = 20, offset: int = 0) -> list:
+    with open(DATA_DIR / "golden_dataset.json", "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+    results = []
+    for i in range(offset, offset + n_results):
+        record = dataset[i % len(dataset)]
+        content = " ".join([record["question"], record["answer"]] * 8)
+        results.append({
+            "domain": "garantias",
+            "source": "https://storage.blob.core.windows.net/docs/garantias-computadores 1.pdf",
+            "id_document": f"doc-{i % 3}",
+            "id_content": f"doc-{i % 3}-chunk-{i}",
+            "@search.score": 0.03 - i * 0.001,
+            "@search.reranker_score": 3.0 - i * 0.1,
+            "content": content,
+        })
+    return results
+
+
+def main(results_path: str | None, overlap: float):
+    if results_path:
+        with open(results_path, "r", encoding="utf-8") as f:
+            first_turn = [{field: record.get(field) for field in INCLUDE_FIELDS} for record in json.load(f)]
+        # Second call: same results shifted, so `overlap` of them were already seen
+        shift = int(len(first_turn) * (1 - overlap))
+        second_turn = first_turn[shift:] + first_turn[:shift]
+    else:
+        first_turn = synthetic_results()
+        second_turn = synthetic_results(offset=int(len(first_turn) * (1 - overlap)))
+
+    counter = ContextBudgetManager()
+    seen_ids = {record["id_content"] for record in first_turn}
+
+    rows = [
+        ("repr (before)", counter.count(str(first_turn)) + counter.count(str(second_turn))),
+        ("compact", counter.count(render_search_results(first_turn)) + counter.count(render_search_results(second_turn))),
+        ("compact + dedup", counter.count(render_search_results(first_turn)) + counter.count(render_search_results(second_turn, seen_ids))),
+    ]
+
+    print(f"Two search calls of {len(first_turn)} passages, {overlap:.0%} overlap")
+    baseline = rows[0][1]
+    for name, tokens in rows:
+        print(f"{name:<18}{tokens:>8} tokens  ({tokens / baseline:.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results", type=str, default=None)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    args = parser.parse_args()
+    main(args.results, args.overlap)
@@ -0,0 +1,43 @@
+"""
+Checks the local guardrail classifier against the labeled regression set
+(agents/rag/prompts/guardrails_regression.json): off-topic, misuse and prompt
+injection queries, single and multi-turn. Queries the classifier leaves to the
+LLM are fine; a local decision that contradicts the label is a failure.
+
+Usage:
+    python scripts/check_guardrails.py
+    python scripts/check_guardrails.py --threshold 0.8
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.rag.guardrails import LocalGuardrailClassifier
+from agents.rag.utils import load_guardrails_examples, load_json_examples
+
+
+def main(threshold: float | None) -> int:
+    classifier = LocalGuardrailClassifier(load_guardrails_examples(), threshold=threshold)
+    failures = 0
+    local = 0
+    cases = load_json_examples("guardrails_regression.json")
+    for case in cases:
+        prediction, confidence = classifier.predict(case["input_user"], case.get("history"))
+        decided = confidence >= classifier.threshold
+        local += decided
+        status = "llm"
+        if decided:
+            status = "ok" if prediction.classification == case["classification"] else "FAIL"
+            failures += status == "FAIL"
+        print(f"{status:4} {confidence:.2f} {case['classification']:8} {case['input_user']}")
+
+    print(f"\n{local}/{len(cases)} decided locally, {failures} wrong (threshold {classifier.threshold})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=None, help="Defaults to GUARDRAILS_LOCAL_THRESHOLD")
+    args = parser.parse_args()
+    sys.exit(main(args.threshold))
@@ -0,0 +1,79 @@
+"""
+Loads the PDFs of a directory into the search index (see agents/rag/retriever/ingestion.py).
+Re-runs only embed and upload the chunks that are new or changed since the last run;
+chunks of PDFs removed from the directory are deleted from the index.
+
+With the "fake" backend the index is the local corpus file served by FakeCognitiveSearch
+(LOCAL_CORPUS_PATH, default data/local_corpus.jsonl), so the pipeline runs without network.
+With the "local" backend it is the LocalVectorIndex directory (LOCAL_INDEX_DIR, default
+data/local_index) served by LocalVectorSearch.
+
+Usage:
+    python scripts/ingest_corpus.py --backend fake
+    python scripts/ingest_corpus.py --backend local
+    python scripts/ingest_corpus.py --input data/raw_example --backend azure --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import DATA_DIR, ENV_VARIABLES, RAG_BACKEND, setup_logging
+from agents.rag.retriever.ingestion import IngestionManifest, IngestionPipeline
+
+
+async def main(input_dir: str, backend: str, output: str | None, manifest_path: str | None, processes: int | None, force: bool):
+    paths = sorted(Path(input_dir).glob("*.pdf"))
+
+    if backend == "fake":
+        from agents.rag.retriever.fake import FakeCognitiveSearch, LocalCorpus
+
+        output = Path(output or ENV_VARIABLES.get("LOCAL_CORPUS_PATH") or DATA_DIR / "local_corpus.jsonl")
+        corpus = LocalCorpus.load(output) if output.exists() else LocalCorpus()
+        search_client = FakeCognitiveSearch(corpus, latency=0)
+        manifest_path = manifest_path or output.with_suffix(".manifest.json")
+    elif backend == "local":
+        from agents.rag.retriever.cognitivesearch import CognitiveSearch
+        from agents.rag.retriever.local import LocalVectorIndex, LocalVectorSearch
+
+        output = Path(output or LocalVectorIndex.default_path())
+        # Same embeddings as the queries: Azure OpenAI, or the fake ones offline
+        embedder = None if RAG_BACKEND == "fake" else CognitiveSearch()
+        embedding_model = getattr(embedder, "_embed_model", "fake")
+        index = LocalVectorIndex.load(output, embedding_model) if (output / "index.json").exists() else LocalVectorIndex.empty(output)
+        search_client = LocalVectorSearch(index, embedder=embedder)
+        manifest_path = manifest_path or output / "manifest.json"
+    else:
+        from agents.rag.retriever.cognitivesearch import CognitiveSearch
+
+        search_client = CognitiveSearch()
+        manifest_path = manifest_path or DATA_DIR / "ingestion" / f"{ENV_VARIABLES['AZURE_SEARCH_INDEX']}.manifest.json"
+
+    # Kept with --force too: it lists the chunks of the PDFs that were removed
+    manifest = IngestionManifest(manifest_path)
+
+    async with search_client:
+        report = await IngestionPipeline(search_client, manifest, processes=processes).run(paths, force=force)
+
+    if backend == "fake":
+        corpus.save(output)
+    elif backend == "local":
+        index.save(output)
+    print(json.dumps(report, indent=2))
+    print(f"SEARCH_INDEX_GENERATION={report.get('generation')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, default=str(DATA_DIR / "raw_example"), help="Directory with the PDFs")
+    parser.add_argument("--backend", type=str, default=ENV_VARIABLES.get("RETRIEVER_BACKEND") or RAG_BACKEND, help="azure, local or fake")
+    parser.add_argument("--output", type=str, default=None, help="Local corpus file (fake backend) or index directory (local backend)")
+    parser.add_argument("--manifest", type=str, default=None, help="Chunk hashes of the previous runs")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Re-embed and upload every chunk")
+    args = parser.parse_args()
+    setup_logging()
+    asyncio.run(main(args.input, args.backend, args.output, args.manifest, args.processes, args.force))
@@ -0,0 +1,53 @@
+"""
+Runs the /chat and /streamchat endpoints end to end without network, using the
+in-process stand-ins for Azure OpenAI and Azure AI Search (RAG_BACKEND=fake).
+The search backend serves data/local_corpus.jsonl (LOCAL_CORPUS_PATH).
+
+Usage:
+    python scripts/offline_chat.py
+    python scripts/offline_chat.py --question "¿Qué cubre la garantía?" --llm-latency 0.3 --tokens-per-second 50
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("RAG_BACKEND", "fake")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main(question: str, llm_latency: float, tokens_per_second: float, search_latency: float):
+    os.environ["FAKE_LLM_LATENCY"] = str(llm_latency)
+    os.environ["FAKE_LLM_TOKENS_PER_SECOND"] = str(tokens_per_second)
+    os.environ["FAKE_SEARCH_LATENCY"] = str(search_latency)
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    payload = {"history": [{"role": "user", "content": question}]}
+    with TestClient(app) as client:
+        start = time.perf_counter()
+        response = client.post("/api/v1/chat", json=payload)
+        response.raise_for_status()
+        body = response.json()
+        print(f"/chat {time.perf_counter() - start:.3f}s")
+        print(f"  response: {body['response'][:200]}")
+
+        start = time.perf_counter()
+        events = []
+        with client.stream("POST", "/api/v1/streamchat", json=payload) as stream:
+            for line in stream.iter_lines():
+                if line.startswith("event:"):
+                    events.append(line.split(":", 1)[1].strip())
+        print(f"/streamchat {time.perf_counter() - start:.3f}s")
+        print(f"  events: {', '.join(sorted(set(events)))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--question", type=str, default="¿Cuál es la duración de la garantía para portátiles?")
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--search-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    main(args.question, args.llm_latency, args.tokens_per_second, args.search_latency)
@@ -1,3 +1,4 @@
+import argparse
 import json
 import sys
 import os
@@ -8,11 +9,29 @@ from collections import Counter
 from matplotlib.ticker import MaxNLocator
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.config import DATA_DIR, ENV_VARIABLES
+from config.config import DATA_DIR, ENV_VARIABLES, RAG_BACKEND, setup_logging
 from agents.evaluation import DataLoader, Evaluator
 from agents.rag.base import RAGAgent
 
-async def main(prediction_run: Optional[str] = None):
+def write_jsonl(path, records: list) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(path) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def main(prediction_run: Optional[str] = None, run_name: Optional[str] = None, size_sample: int = 300, seed: int = 42) -> str:
+    """
+    Runs predictions and judgments, reusing the checkpoints in data/evaluations/checkpoints.
+    Re-running after a crash (or after changing a prompt) only computes what is missing or affected.
+
+    Returns:
+        str: Name of the run directory.
+    """
     # Load the data
     # test_data = DATA_DIR / "data_to_process" / "test.jsonl"
     # data_loader = DataLoader(file_dir=test_data)
@@ -21,45 +40,48 @@ async def main(prediction_run: Optional[str] = None):
     data_loader = DataLoader(file_dir=validation_data)
 
     # Initialize the assistant
-    assistant = RAGAgent(llm_provider="azure", retrieval_args={})
-
-    # Initialize the evaluator
-    evaluator = Evaluator(dataloader=data_loader, model_pipeline=assistant)
+    # Every record sends its full history: nothing to keep in the conversation store
+    assistant = RAGAgent(llm_provider=RAG_BACKEND, retrieval_args={}, checkpointer="none")
 
     evaluations_run_dir = DATA_DIR / "evaluations"
+
+    # Initialize the evaluator; completed records are appended to the checkpoints as they finish
+    evaluator = Evaluator(
+        dataloader=data_loader,
+        model_pipeline=assistant,
+        checkpoint_dir=evaluations_run_dir / "checkpoints",
+    )
+
     if prediction_run is None:
         # Run the evaluation
-        sampled_data = await evaluator.run_prediction(size_sample=300)
-
-        if not evaluations_run_dir.exists():
-            evaluations_run_dir.mkdir(parents=True, exist_ok=True)
-        # list runs folders
-        runs_folders = evaluations_run_dir.glob("run_*")
-        run_id = len(list(runs_folders)) + 1
-        run_dir = evaluations_run_dir / f"run_{run_id}"
+        sampled_data = await evaluator.run_prediction(size_sample=size_sample, seed=seed)
+
+        if run_name is None:
+            # list runs folders
+            runs_folders = evaluations_run_dir.glob("run_*")
+            run_name = f"run_{len(list(runs_folders)) + 1}"
+        run_dir = evaluations_run_dir / run_name
         run_dir.mkdir(parents=True, exist_ok=True)
 
         # save the results
-        with open(run_dir / "predictions_results.json", "w", encoding="utf-8") as f:
-            json.dump(sampled_data, f, indent=4)
+        write_jsonl(run_dir / "predictions_results.jsonl", sampled_data)
 
     else: #load the results
         run_dir = evaluations_run_dir / prediction_run
-        with open(run_dir / "predictions_results.json", "r", encoding="utf-8") as f:
-            sampled_data = json.load(f)
+        sampled_data = read_jsonl(run_dir / "predictions_results.jsonl")
 
     # Run the evaluation
     sampled_data = await evaluator.evaluate_prediction(sampled_data)
+    evaluator.close()
 
     # save the results
-    with open(run_dir / "evaluations_results.json", "w", encoding="utf-8") as f:
-        json.dump(sampled_data, f, indent=4)
+    write_jsonl(run_dir / "evaluations_results.jsonl", sampled_data)
+    return run_dir.name
 
 async def get_metrics(prediction_run: str):
     evaluations_run_dir = DATA_DIR / "evaluations"
     run_dir = evaluations_run_dir / prediction_run
-    with open(run_dir / "evaluations_results.json", "r", encoding="utf-8") as f:
-        sampled_data = json.load(f)
+    sampled_data = read_jsonl(run_dir / "evaluations_results.jsonl")
 
         # Extraer los scores
     scores = [item["evaluation"]["score"] for item in sampled_data]
@@ -119,5 +141,14 @@ async def get_metrics(prediction_run: str):
 # Run the main function
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(main())
-    asyncio.run(get_metrics("run_2"))
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prediction-run", type=str, default=None, help="Judge the predictions of an existing run")
+    parser.add_argument("--run-name", type=str, default=None, help="Run directory to write (default: next run_N)")
+    parser.add_argument("--size", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    setup_logging()
+    # Secrets are resolved before the event loop starts: reading one inside it never blocks
+    ENV_VARIABLES.load_secrets()
+    run_name = asyncio.run(main(args.prediction_run, args.run_name, args.size, args.seed))
+    asyncio.run(get_metrics(run_name))
\ No newline at end of file
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-test_compliance_stream.py
+streaming_test.py
 
 Instalación previa:
     pip install requests sseclient-py
@@ -11,21 +11,17 @@ import requests
 from sseclient import SSEClient
 
 def main():
-    url = "http://localhost:8000/api/v1/complianceagent"
+    url = "http://localhost:8000/api/v1/streamchat"
     headers = {
         "Accept": "text/event-stream",
         "Content-Type": "application/json",
     }
     payload = {
-        "alert_id": "alert-1234",
-        "alert": {
-            "alert_id": "alert-1234",
-            "type": "transaction",
-            "account_id": "ACC-001",
-            "monto": 1500,
-            "umbral": 1000,
-            "generated_at": "2025-07-01T14:00:00Z"
-        }
+        "user_id": "test0001",
+        "conversation_id": "convtest0001",
+        "history": [
+            {"role": "user", "content": "¿Cuál es la duración de la garantía para portátiles?"}
+        ]
     }
 
     # Lanza la petición en modo streaming
@@ -37,21 +33,20 @@ def main():
 
     print("=== Conectado al stream, esperando eventos… ===")
     for event in client.events():
-        # Cada event tiene .event (tipo) y .data (payload JSON o texto)
+        # Cada event tiene .event (tipo) y .data (payload JSON)
         type_event = event.event
-        data = event.data
         try:
-            if type_event == "custom":
-                data = json.loads(data) # json response from tool
-                if data.get("tool") == "assess_risk":
-                    output = data.get("output")
-                    print(f"[{type_event}] → {output}")
-                print(f"[{type_event}] → {data}")
-            elif type_event == "messages":
-                message = event.data # message from agent string
-                print(f"[{type_event}] → {message}")
+            data = json.loads(event.data)
         except ValueError:
             print("Error al procesar el evento")
+            continue
+
+        if type_event == "token":
+            print(data, end="", flush=True)
+        elif type_event == "done":
+            print(f"\n[{type_event}] → ttft_ms={data['ttft_ms']} total_ms={data['total_ms']}")
+        else:
+            print(f"[{type_event}] → {data}")
 
 if __name__ == "__main__":
     main()
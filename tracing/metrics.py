@@ -0,0 +1,166 @@
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# From cache hits (~1 ms) to slow LLM calls (~30 s)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    "rag_stage_latency_seconds",
+    "Latency of each stage of a request: graph nodes, tools, embedding and search calls.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "LLM tokens by graph node and kind (prompt or completion).",
+    ["node", "kind"],
+)
+AGENT_ITERATIONS = Counter(
+    "rag_agent_iterations_total",
+    "agent_brain calls (iterations of the agent loop).",
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "rag_requests_in_flight",
+    "Requests being processed, by endpoint.",
+    ["endpoint"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rag_admission_queue_depth",
+    "Requests waiting for an admission slot.",
+)
+ADMISSION_ADMITTED = Gauge(
+    "rag_admission_admitted",
+    "Requests holding an admission slot.",
+)
+ADMISSION_WAIT = Histogram(
+    "rag_admission_wait_seconds",
+    "Time requests waited in the admission queue before starting.",
+    buckets=LATENCY_BUCKETS,
+)
+SINGLE_FLIGHT_COLLAPSED = Counter(
+    "rag_singleflight_collapsed_total",
+    "Requests that waited on an identical request already in flight instead of running the graph.",
+    ["endpoint"],
+)
+ADMISSION_REJECTED = Counter(
+    "rag_admission_rejected_total",
+    "Requests shed by admission control, by reason.",
+    ["reason"],
+)
+RETRIEVAL_TOP_K = Histogram(
+    "rag_retrieval_top_k",
+    "top of the last search of an adaptive retrieval, by search mode.",
+    ["mode"],
+    buckets=(1, 2, 5, 10, 20, 40, 80),
+)
+RETRIEVAL_WIDENED = Counter(
+    "rag_retrieval_widened_total",
+    "Adaptive retrievals that widened top-k because the first results were low-confidence.",
+    ["mode"],
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """
+    Observes the duration of the block in rag_stage_latency_seconds{stage}.
+
+    Example:
+        with observe_stage("search"):
+            results = await search_client.search(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def timed_stage(stage: str):
+    """
+    Decorator version of `observe_stage` for coroutine functions (graph nodes, tools).
+    The wrapped signature and annotations are kept, so LangGraph and @tool still see them.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    Counts prompt and completion tokens of every chat model call of the graph,
+    labelled with the node that made it (speculative agent_brain steps count
+    under the guardrail node that runs them).
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._nodes: Dict[UUID, str] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: dict | None = None, **kwargs: Any):
+        self._nodes[run_id] = (metadata or {}).get("langgraph_node", "unknown")
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        node = self._nodes.pop(run_id, "unknown")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.labels(node, "prompt").inc(usage.get("input_tokens", 0))
+                    LLM_TOKENS.labels(node, "completion").inc(usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._nodes.pop(run_id, None)
+
+
+TOKEN_USAGE_CALLBACK = TokenUsageCallback()
+
+
+def _flatten(prefix: str, stats: dict):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+class StatsCollector(Collector):
+    """
+    Exposes the `stats` dicts already kept by the app (retriever pool, caches,
+    batcher, guardrails, context manager) as gauges, read at scrape time.
+    """
+
+    def __init__(self, sources: Dict[str, Callable[[], dict]]):
+        """
+        Args:
+            sources (dict): Metric prefix to a callable returning a (nested) stats dict.
+        """
+        self.sources = sources
+
+    def collect(self):
+        for prefix, source in self.sources.items():
+            for name, value in _flatten(f"rag_{prefix}", source()):
+                yield GaugeMetricFamily(name, f"Current value of {name} from the {prefix} stats.", value=value)
+
+
+def metrics_payload() -> tuple:
+    """Returns (body, content type) in Prometheus text format."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST